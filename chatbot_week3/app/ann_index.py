@@ -0,0 +1,314 @@
+import hashlib
+import json
+import os
+from typing import List, Sequence, Tuple
+import faiss
+import numpy as np
+from app.vector_codec import normalize_rows
+
+ANN_INDEX_DIR = os.getenv("ANN_INDEX_DIR", ".vector_indexes")
+DEFAULT_INDEX_KIND = os.getenv("ANN_INDEX_KIND", "hnsw")
+# Queries scored per matmul in exact search, bounding the (queries x rows) score matrix
+QUERY_BLOCK = 256
+
+
+class AnnIndex:
+    """
+    Inner-product index over L2-normalized vectors (i.e. cosine similarity).
+    Keeps the mapping from index rows to external document ids plus the
+    collection version the index was built against.
+
+    Deletes are tombstones: the rows stay in the index but are filtered from
+    results, and `needs_rebuild` turns true once too many rows are dead.
+
+    Kinds with a trained quantizer train it on the first vectors they are given,
+    which during ingestion is a single batch. `trained_on` records how many, and
+    `needs_rebuild` also turns true once the index holds RETRAIN_GROWTH times
+    that many, until a sample of TRAIN_SIZE vectors has been used.
+    """
+    kind = None
+    REBUILD_FRACTION = 0.2
+    # Vectors a quantizer wants to train on; 0 for kinds without one
+    TRAIN_SIZE = 0
+    RETRAIN_GROWTH = 4
+    # Extra neighbours fetched per search to absorb tombstones that cluster near a query
+    OVERFETCH_SLACK = 8
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.ids: List[str] = []
+        self.dead_rows = set()
+        self._rows = {}  # id -> row numbers, for deletes
+        self.version = None
+        self.trained_on = None
+        self._index = self._new_index()
+
+    def _new_index(self):
+        raise NotImplementedError
+
+    def __len__(self):
+        return len(self.ids) - len(self.dead_rows)
+
+    @property
+    def needs_rebuild(self) -> bool:
+        # Rebuilding from the whole collection retrains on it; growth by RETRAIN_GROWTH keeps the total
+        # cost of those rebuilds proportional to the collection size
+        undertrained = (self.trained_on is not None and self.trained_on < self.TRAIN_SIZE
+                        and len(self) >= self.RETRAIN_GROWTH * self.trained_on)
+        return undertrained or len(self.dead_rows) > self.REBUILD_FRACTION * max(len(self.ids), 1)
+
+    def reset(self):
+        self.ids = []
+        self.dead_rows = set()
+        self._rows = {}
+        self.trained_on = None
+        self._index = self._new_index()
+
+    def _add_ids(self, ids: Sequence[str]):
+        for doc_id in ids:
+            self._rows.setdefault(str(doc_id), []).append(len(self.ids))
+            self.ids.append(str(doc_id))
+
+    def add(self, ids: Sequence[str], vectors):
+        if not len(ids):
+            return
+        self._index.add(normalize_rows(vectors))
+        self._add_ids(ids)
+
+    def remove(self, ids: Sequence[str]):
+        for doc_id in ids:
+            self.dead_rows.update(self._rows.pop(str(doc_id), []))
+
+    def search(self, query_vector, k: int = 3) -> List[Tuple[str, float]]:
+        """Return up to k (id, cosine score) pairs, best first."""
+        return self.search_many([query_vector], k)[0]
+
+    def search_many(self, query_vectors, k: int = 3) -> List[List[Tuple[str, float]]]:
+        """Batched `search`: one ranked hit list per query vector, from a single index call."""
+        queries = normalize_rows(query_vectors)
+        if not len(self):
+            return [[] for _ in queries]
+        # Over-fetch in proportion to the share of tombstones, not by their number: up to
+        # REBUILD_FRACTION of a big index may be dead, and an ANN search costs more the more
+        # neighbours it returns. Queries that still come up short are searched again wider.
+        n = min(len(self.ids), k + int(k * len(self.dead_rows) / len(self)) + self.OVERFETCH_SLACK)
+        results = [None] * len(queries)
+        todo = np.arange(len(queries))
+        while len(todo):
+            scores, rows = self._index.search(queries[todo], n)
+            short = []
+            for q, row_ids, row_scores in zip(todo, rows, scores):
+                hits = [(self.ids[r], float(s)) for r, s in zip(row_ids, row_scores)
+                        if r >= 0 and r not in self.dead_rows][:k]
+                results[q] = hits
+                if len(hits) < k and n < len(self.ids):
+                    short.append(q)
+            todo = np.array(short, dtype=int)
+            n = min(len(self.ids), 4 * n)
+        return results
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._save_data(path)
+        # Write the metadata last (and atomically) so readers never see ids without data
+        tmp = path + ".json.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"kind": self.kind, "dim": self.dim, "version": self.version, "ids": self.ids,
+                       "dead_rows": sorted(self.dead_rows), "trained_on": self.trained_on}, f)
+        os.replace(tmp, path + ".json")
+
+    def _save_data(self, path: str):
+        if self._index is not None:
+            faiss.write_index(self._index, path + ".faiss")
+
+    @classmethod
+    def load(cls, path: str):
+        """Load an index saved with `save`, or return None if it does not exist."""
+        if not os.path.exists(path + ".json"):
+            return None
+        with open(path + ".json") as f:
+            meta = json.load(f)
+        index = INDEX_KINDS[meta["kind"]](meta["dim"])
+        if not index._load_data(path):
+            return None
+        index._add_ids(meta["ids"])
+        index.dead_rows = set(meta.get("dead_rows", []))
+        for row in index.dead_rows:
+            index._rows[index.ids[row]].remove(row)
+        index.version = meta["version"]
+        index.trained_on = meta.get("trained_on")
+        return index
+
+    def _load_data(self, path: str) -> bool:
+        if not os.path.exists(path + ".faiss"):
+            return False
+        self._index = faiss.read_index(path + ".faiss")
+        return True
+
+
+class HNSWIndex(AnnIndex):
+    kind = "hnsw"
+    M = 32
+    EF_CONSTRUCTION = 80
+    EF_SEARCH = 64
+
+    def _new_index(self):
+        index = faiss.IndexHNSWFlat(self.dim, self.M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = self.EF_CONSTRUCTION
+        index.hnsw.efSearch = self.EF_SEARCH
+        return index
+
+
+class IVFIndex(AnnIndex):
+    """Inverted-file index. The coarse quantizer is trained on the first batch (see `needs_rebuild`)."""
+    kind = "ivf"
+    NLIST = 256
+    NPROBE = 16
+    # FAISS k-means wants ~39 points per centroid
+    POINTS_PER_LIST = 39
+    TRAIN_SIZE = POINTS_PER_LIST * NLIST
+
+    def _new_index(self):
+        return None
+
+    def add(self, ids: Sequence[str], vectors):
+        if not len(ids):
+            return
+        vectors = normalize_rows(vectors)
+        if self._index is None:
+            nlist = max(1, min(self.NLIST, int(np.sqrt(len(vectors))), len(vectors) // self.POINTS_PER_LIST))
+            quantizer = faiss.IndexFlatIP(self.dim)
+            self._index = faiss.IndexIVFFlat(quantizer, self.dim, nlist, faiss.METRIC_INNER_PRODUCT)
+            self._index.train(vectors)
+            self._index.nprobe = min(self.NPROBE, nlist)
+            self.trained_on = len(vectors)
+        self._index.add(vectors)
+        self._add_ids(ids)
+
+
+class SQ8Index(AnnIndex):
+    """8-bit scalar quantization, 4x smaller than float32. Per-dimension ranges are trained on the first batch."""
+    kind = "sq8"
+    TRAIN_SIZE = 1024
+
+    def _new_index(self):
+        return None
+
+    def _trained_index(self, vectors: np.ndarray):
+        index = faiss.IndexScalarQuantizer(self.dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+        return index
+
+    def add(self, ids: Sequence[str], vectors):
+        if not len(ids):
+            return
+        vectors = normalize_rows(vectors)
+        if self._index is None:
+            self._index = self._trained_index(vectors)
+            self.trained_on = len(vectors)
+        self._index.add(vectors)
+        self._add_ids(ids)
+
+
+class PQIndex(SQ8Index):
+    """
+    Product quantization: one byte per SUBVECTOR_DIM dimensions (96 bytes for 768 dims).
+    The codebook is trained on the first batch; collections too small to train one use SQ8.
+    """
+    kind = "pq"
+    SUBVECTOR_DIM = 8
+    # FAISS k-means wants ~39 points per centroid, 256 centroids per sub-quantizer
+    MIN_TRAIN = 39 * 256
+    TRAIN_SIZE = MIN_TRAIN
+
+    def _trained_index(self, vectors: np.ndarray):
+        m = self.dim // self.SUBVECTOR_DIM
+        if len(vectors) < self.MIN_TRAIN or m == 0 or self.dim % m:
+            return super()._trained_index(vectors)
+        index = faiss.IndexPQ(self.dim, m, 8, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+        return index
+
+
+class MatrixIndex(AnnIndex):
+    """
+    Exact search: one matmul over a float32, L2-normalized embedding matrix.
+    The matrix is saved as .npy and memory-mapped read-only on load, so every
+    worker process on the machine shares the same pages instead of a private copy.
+    """
+    kind = "exact"
+
+    def _new_index(self):
+        self._pending = []
+        return np.empty((0, self.dim), dtype=np.float32)
+
+    def _matrix(self) -> np.ndarray:
+        # Batches are appended lazily so a long ingestion run copies the matrix once, not per batch
+        if self._pending:
+            self._index = np.concatenate([self._index, *self._pending])
+            self._pending = []
+        return self._index
+
+    def add(self, ids: Sequence[str], vectors):
+        if not len(ids):
+            return
+        self._pending.append(normalize_rows(vectors))
+        self._add_ids(ids)
+
+    def search_many(self, query_vectors, k: int = 3) -> List[List[Tuple[str, float]]]:
+        queries = normalize_rows(query_vectors)
+        if not len(self):
+            return [[] for _ in queries]
+        matrix = self._matrix()
+        dead = list(self.dead_rows)
+        k = min(k, len(self))
+        results = []
+        for start in range(0, len(queries), QUERY_BLOCK):
+            sims = queries[start:start + QUERY_BLOCK] @ matrix.T
+            if dead:
+                sims[:, dead] = -np.inf
+            top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+            top_sims = np.take_along_axis(sims, top, axis=1)
+            order = np.argsort(-top_sims, axis=1)
+            top, top_sims = np.take_along_axis(top, order, axis=1), np.take_along_axis(top_sims, order, axis=1)
+            results.extend([(self.ids[i], float(s)) for i, s in zip(row, row_sims)] for row, row_sims in zip(top, top_sims))
+        return results
+
+    def _save_data(self, path: str):
+        tmp = path + ".npy.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, np.ascontiguousarray(self._matrix(), dtype=np.float32))
+        # Replace rather than overwrite: workers still reading the old map keep a valid file
+        os.replace(tmp, path + ".npy")
+        self._load_data(path)
+
+    def _load_data(self, path: str) -> bool:
+        if not os.path.exists(path + ".npy"):
+            return False
+        matrix = np.load(path + ".npy", mmap_mode="r")
+        self._index = matrix if matrix.size else np.empty((0, self.dim), dtype=np.float32)
+        return True
+
+
+INDEX_KINDS = {
+    MatrixIndex.kind: MatrixIndex,
+    HNSWIndex.kind: HNSWIndex,
+    IVFIndex.kind: IVFIndex,
+    SQ8Index.kind: SQ8Index,
+    PQIndex.kind: PQIndex,
+}
+
+
+def create_ann_index(kind: str, dim: int) -> AnnIndex:
+    if kind not in INDEX_KINDS:
+        raise ValueError(f"Unknown ANN index kind '{kind}'. Choose one of: {', '.join(INDEX_KINDS)}")
+    return INDEX_KINDS[kind](dim)
+
+
+def index_path(uri: str, db_name: str, collection_name: str, kind: str) -> str:
+    """
+    Local path prefix for the index that belongs to a Mongo collection. A hash of the connection
+    URI keeps same-named collections of different deployments (dev and prod, say) apart.
+    """
+    deployment = hashlib.sha256((uri or "").encode()).hexdigest()[:12]
+    return os.path.join(ANN_INDEX_DIR, f"{db_name}.{collection_name}.{deployment}.{kind}")
@@ -0,0 +1,311 @@
+"""
+Headless HTTP API for the RAG engine.
+
+    uvicorn app.api:app --host 0.0.0.0 --port 8000
+
+Run from the chatbot_week3 directory, as a single worker process: embedding
+models, chat clients, FAISS collections and MongoDB stores are loaded once and
+shared by every request, so more processes would only hold more copies of them.
+
+    POST /ingest        multipart PDFs ("files") plus optional "store" and "collection" fields;
+                        adds or updates those files and never removes other documents; 409 when
+                        another process saved the FAISS collection meanwhile (nothing was saved)
+    POST /query         {"question", "messages"?, "store"?, "collection"?, "conversation_id"?}
+    POST /query/stream  same body, answered as server-sent events: meta, token..., done
+    GET  /stats         caches, re-ranker and per-stage latency of this process
+    GET  /health
+
+Queries and ingests each run under a concurrency limit with a bounded wait
+queue; once the queue is full, or a request has waited API_QUEUE_TIMEOUT
+seconds, the service answers 503 with Retry-After instead of piling up work.
+"""
+import asyncio
+import io
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from functools import partial
+from starlette.applications import Starlette
+from starlette.concurrency import iterate_in_threadpool
+from starlette.exceptions import HTTPException
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.types import Receive, Scope, Send
+from starlette.routing import Route
+from app.chat_manager import _answer_turn, _complete_turn, _prepare_turn, _source_attribution
+from app.chat_utils import get_shared_chat_model, stream_chat_model
+from app.context_assembler import ConversationMemory
+from app.engine_stats import collect_stats
+from app.ingestion import ingest_files
+from app.turn_pipeline import TurnTrace, in_thread, warm_up_in_background
+from app.vectorstore_utils import COLLECTION_NAME, CollectionConflict, open_faiss_collection, open_mongo_collection
+
+API_QUERY_CONCURRENCY = int(os.getenv("API_QUERY_CONCURRENCY", "8"))
+API_QUERY_QUEUE = int(os.getenv("API_QUERY_QUEUE", "32"))
+# Ingestion is CPU and memory heavy (extraction, embedding), so few run at once
+API_INGEST_CONCURRENCY = int(os.getenv("API_INGEST_CONCURRENCY", "1"))
+API_INGEST_QUEUE = int(os.getenv("API_INGEST_QUEUE", "4"))
+# Seconds a request may wait for a slot before it is turned away
+API_QUEUE_TIMEOUT = float(os.getenv("API_QUEUE_TIMEOUT", "30"))
+# Store used when a request names none: "faiss" or "mongo"
+API_DEFAULT_STORE = os.getenv("API_DEFAULT_STORE", "faiss")
+# Conversations whose rolling summary is kept server-side, least recently used dropped first
+API_MAX_CONVERSATIONS = int(os.getenv("API_MAX_CONVERSATIONS", "1000"))
+
+
+class ConcurrencyLimiter:
+    """
+    Lets at most `limit` requests run at once and up to `max_queue` more wait for a
+    slot, each for at most `timeout` seconds. Anything beyond that is rejected with
+    503 and a Retry-After hint, so an overloaded service sheds load early instead of
+    letting every request slow down.
+    """
+
+    def __init__(self, name: str, limit: int, max_queue: int, timeout: float = API_QUEUE_TIMEOUT):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    def _overloaded(self):
+        self.rejected += 1
+        return HTTPException(503, f"Too many concurrent {self.name} requests, retry shortly",
+                             headers={"Retry-After": str(max(1, round(self.timeout / 10)))})
+
+    async def acquire(self):
+        if self._semaphore.locked() and self.waiting >= self.max_queue:
+            raise self._overloaded()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise self._overloaded() from None
+        finally:
+            self.waiting -= 1
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        return {"limit": self.limit, "active": self.active, "waiting": self.waiting, "max_queue": self.max_queue,
+                "rejected": self.rejected}
+
+
+query_limiter = ConcurrencyLimiter("query", API_QUERY_CONCURRENCY, API_QUERY_QUEUE)
+ingest_limiter = ConcurrencyLimiter("ingest", API_INGEST_CONCURRENCY, API_INGEST_QUEUE)
+
+_conversations: "OrderedDict[str, ConversationMemory]" = OrderedDict()
+_conversations_lock = threading.Lock()
+
+
+def _memory(conversation_id):
+    """Rolling-summary memory of a conversation, or None for one-off questions."""
+    if not conversation_id:
+        return None
+    with _conversations_lock:
+        memory = _conversations.get(conversation_id)
+        if memory is None:
+            memory = _conversations[conversation_id] = ConversationMemory()
+        _conversations.move_to_end(conversation_id)
+        while len(_conversations) > API_MAX_CONVERSATIONS:
+            _conversations.popitem(last=False)
+    return memory
+
+
+def _open_store(store_type, collection, create):
+    """The shared store for a request, or None when a FAISS collection does not exist and `create` is False."""
+    store_type, collection = store_type or API_DEFAULT_STORE, collection or None
+    # Names come from remote clients and FAISS ones become directories: one safe path component only
+    if collection is not None and (not isinstance(collection, str) or not COLLECTION_NAME.fullmatch(collection)):
+        raise HTTPException(400, "'collection' may only contain letters, digits, '_' and '-'")
+    if store_type == "faiss":
+        try:
+            store = open_faiss_collection(collection, create=create)
+        except ValueError as e:
+            raise HTTPException(400, str(e)) from None
+    elif store_type == "mongo":
+        store = open_mongo_collection(collection_name=collection)
+    else:
+        raise HTTPException(400, f"Unknown store '{store_type}'. Choose one of: faiss, mongo")
+    return {"type": store_type, "store": store} if store is not None else None
+
+
+async def _query_body(request: Request):
+    try:
+        body = await request.json()
+    except ValueError:
+        raise HTTPException(400, "Request body must be JSON") from None
+    question = body.get("question") if isinstance(body, dict) else None
+    if not isinstance(question, str) or not question.strip():
+        raise HTTPException(400, "'question' is required")
+    # The question closes the history, as in the UI's message list
+    messages = body.get("messages") or [{"role": "user", "content": question}]
+    vectorstore = await in_thread(_open_store, body.get("store"), body.get("collection"), False)
+    return question, messages, vectorstore, _memory(body.get("conversation_id"))
+
+
+def _remember(memory, messages, answer):
+    if memory is not None:
+        memory.update_in_background(messages + [{"role": "assistant", "content": answer}])
+
+
+def _timings(plan, trace, **extra):
+    return {"stages": trace.stages, "critical_path": trace.critical_path(), "prompt_tokens": plan.token_counts,
+            "cached": bool(plan.cached), "retrieval_skipped": plan.retrieval_skipped, **extra}
+
+
+async def query(request: Request):
+    question, messages, vectorstore, memory = await _query_body(request)
+    async with query_limiter.slot():
+        trace = TurnTrace()
+        plan, answer, query_time = await _answer_turn(get_shared_chat_model(), messages, vectorstore, question,
+                                                      trace, memory)
+    _remember(memory, messages, answer)
+    return JSONResponse({
+        "answer": answer,
+        "sources": [source for _, source in plan.chunks],
+        "query_time": query_time,
+        **_timings(plan, trace),
+    })
+
+
+class SlotStreamingResponse(StreamingResponse):
+    """
+    Streaming response that returns its limiter slot when the response is over, however it
+    ends: streamed to completion, failed, cancelled by a client disconnect, or never started
+    because sending the headers failed. (The body generator's own `finally` only runs if the
+    generator was started.)
+    """
+
+    def __init__(self, content, limiter: ConcurrencyLimiter, **kwargs):
+        super().__init__(content, **kwargs)
+        self.limiter = limiter
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.limiter.release()
+
+
+def _event(name, data):
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+
+async def query_stream(request: Request):
+    question, messages, vectorstore, memory = await _query_body(request)
+    # Taken before the response starts, so a full queue can still be reported as 503;
+    # SlotStreamingResponse gives it back
+    await query_limiter.acquire()
+
+    async def events():
+        try:
+            trace = TurnTrace()
+            plan = await _prepare_turn(messages, vectorstore, question, trace, memory)
+            if plan.cached:
+                answer, query_time = plan.cached
+                trace.finish(cached=True)
+                yield _event("meta", _timings(plan, trace, query_time=query_time))
+                yield _event("token", {"text": answer})
+                yield _event("done", {"ttft": 0.0, "generation_time": 0.0})
+                _remember(memory, messages, answer)
+                return
+
+            query_time = trace.elapsed()
+            yield _event("meta", _timings(plan, trace, query_time=query_time))
+            parts, ttft = [], None
+            with trace.span("generate", deps=["assemble"]):
+                async for token in iterate_in_threadpool(stream_chat_model(get_shared_chat_model(),
+                                                                           plan.system_prompt)):
+                    if ttft is None:
+                        ttft = trace.elapsed()
+                    parts.append(token)
+                    yield _event("token", {"text": token})
+            generation = trace.stages["generate"]
+            ttft = ttft if ttft is not None else trace.elapsed()
+            attribution = _source_attribution(plan.chunks)
+            parts.append(attribution)
+            yield _event("token", {"text": attribution})
+            answer = "".join(parts)
+            _complete_turn(plan, trace, answer, query_time, ttft=ttft)
+            yield _event("done", {"ttft": ttft, "generation_time": generation["end"] - generation["start"],
+                                  "critical_path": trace.critical_path(), "stages": trace.stages})
+            _remember(memory, messages, answer)
+        except Exception as e:
+            # Headers are already sent, so errors travel in-band
+            yield _event("error", {"detail": str(e)})
+
+    return SlotStreamingResponse(events(), query_limiter, media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+class UploadedPDF(io.BytesIO):
+    """An uploaded file with the `name` ingestion keys documents by, like Streamlit's UploadedFile."""
+
+    def __init__(self, name: str, data: bytes):
+        super().__init__(data)
+        self.name = name
+
+
+async def ingest(request: Request):
+    async with ingest_limiter.slot():
+        form = await request.form()
+        try:
+            files = [UploadedPDF(upload.filename, await upload.read()) for upload in form.getlist("files")
+                     if hasattr(upload, "filename")]
+            if not files:
+                raise HTTPException(400, "Attach one or more PDFs as 'files'")
+            vectorstore = await in_thread(_open_store, form.get("store"), form.get("collection"), True)
+        finally:
+            await form.close()
+        # The collection is shared: an upload must not delete the documents other clients added
+        try:
+            stats = await in_thread(partial(ingest_files, files, vectorstore["store"], remove_missing=False))
+        except CollectionConflict as e:
+            raise HTTPException(409, str(e)) from None
+    return JSONResponse({"store": vectorstore["type"], **stats})
+
+
+async def stats(request: Request):
+    return JSONResponse({**collect_stats(), "limits": {"query": query_limiter.stats(),
+                                                       "ingest": ingest_limiter.stats()}})
+
+
+async def health(request: Request):
+    return JSONResponse({"status": "ok"})
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Start loading the embedding model now rather than with the first question
+    warm_up_in_background()
+    yield
+
+
+async def http_error(request: Request, exc: HTTPException):
+    return JSONResponse({"detail": exc.detail}, status_code=exc.status_code, headers=exc.headers)
+
+
+app = Starlette(lifespan=lifespan, exception_handlers={HTTPException: http_error}, routes=[
+    Route("/ingest", ingest, methods=["POST"]),
+    Route("/query", query, methods=["POST"]),
+    Route("/query/stream", query_stream, methods=["POST"]),
+    Route("/stats", stats, methods=["GET"]),
+    Route("/health", health, methods=["GET"]),
+])
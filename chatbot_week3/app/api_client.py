@@ -0,0 +1,98 @@
+import json
+import os
+import threading
+import httpx
+
+# Base URL of a running `app.api` service; when set, the UI sends ingestion and questions
+# there instead of running the RAG pipeline in the Streamlit process
+RAG_API_URL = os.getenv("RAG_API_URL", "").rstrip("/")
+RAG_API_TIMEOUT = float(os.getenv("RAG_API_TIMEOUT", "300"))
+
+_client = None
+_lock = threading.Lock()
+
+
+class ServiceBusy(RuntimeError):
+    """The service turned the request away (503); retry after `retry_after` seconds."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"The RAG service is busy, retry in {retry_after:.0f} s")
+        self.retry_after = retry_after
+
+
+def _http() -> httpx.Client:
+    # One pooled client for every session of the UI process
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = httpx.Client(base_url=RAG_API_URL, timeout=httpx.Timeout(RAG_API_TIMEOUT, connect=5.0))
+    return _client
+
+
+def _check(response: httpx.Response):
+    if response.status_code == 503:
+        raise ServiceBusy(float(response.headers.get("Retry-After", "1")))
+    if response.is_error:
+        response.read()
+        try:
+            detail = response.json().get("detail", response.text)
+        except ValueError:
+            detail = response.text
+        raise RuntimeError(f"RAG service error {response.status_code}: {detail}")
+
+
+def _events(response: httpx.Response):
+    """(event, data) pairs of a server-sent event stream."""
+    name, data = "message", []
+    for line in response.iter_lines():
+        if not line:
+            if data:
+                yield name, json.loads("\n".join(data))
+            name, data = "message", []
+        elif line.startswith("event:"):
+            name = line[6:].strip()
+        elif line.startswith("data:"):
+            data.append(line[5:].strip())
+
+
+def stream_query(messages, prompt, vectorstore, turn_timings: dict, conversation_id: str = None):
+    """
+    `stream_response` served by the API: yields the answer as it arrives and fills
+    `turn_timings` with the same keys. `vectorstore` is the {"type", "collection"}
+    the session points at, or None for web-only answers.
+    """
+    body = {
+        "question": prompt,
+        "messages": [{"role": m["role"], "content": m["content"]} for m in messages],
+        "conversation_id": conversation_id,
+    }
+    if vectorstore:
+        body.update(store=vectorstore["type"], collection=vectorstore.get("collection"))
+    with _http().stream("POST", "/query/stream", json=body) as response:
+        _check(response)
+        for event, data in _events(response):
+            if event == "token":
+                yield data["text"]
+            elif event == "error":
+                raise RuntimeError(f"RAG service error: {data['detail']}")
+            else:  # "meta" before the first token, "done" after the last
+                turn_timings.update(data)
+
+
+def ingest(files, store_type: str, collection: str = None):
+    """Upload `files` (objects with `.name` and `getvalue()`) into a collection; returns the ingestion stats."""
+    uploads = [("files", (f.name, f.getvalue(), "application/pdf")) for f in files]
+    data = {"store": store_type}
+    if collection:
+        data["collection"] = collection
+    response = _http().post("/ingest", files=uploads, data=data)
+    _check(response)
+    return response.json()
+
+
+def get_stats():
+    """The service's cache, re-ranker and stage latency figures (see `app.api.collect_stats`)."""
+    response = _http().get("/stats")
+    _check(response)
+    return response.json()
@@ -0,0 +1,218 @@
+"""
+Ingest a directory tree of PDFs into a FAISS collection or a MongoDB collection, without the UI.
+
+    python -m app.bulk_ingest ./manuals --faiss .faiss_collections/manuals
+    python -m app.bulk_ingest ./manuals --mongo manuals --mongo-uri mongodb://localhost --mongo-db rag
+
+Run from the chatbot_week3 directory. Files are read from disk one at a time as
+extraction reaches them, and go through the same pipeline as uploads
+(`ingest_files`): parallel extraction, batched embedding, content-hash dedup.
+Sources are named by their path relative to the root, so citations stay unique.
+
+Work is done in groups of --checkpoint-every files. After a group, once at
+least --checkpoint-interval seconds have passed since the last checkpoint (and
+after the last group), the store is persisted and a checkpoint manifest records
+the size and mtime of every file done; an interrupted run started again with
+the same arguments skips those files without reading them. FAISS collections
+are saved atomically (see FaissVectorStore.save), so a run killed mid-save
+resumes from the previous checkpoint. Saving rewrites the whole index, which is
+why it is rate-limited rather than done after every group. A file that fails to
+extract is recorded in the manifest and the run goes on; it is retried on the
+next run.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Dict, List, Tuple
+from app.chunking import CHUNKING
+from app.embeddings import EMBEDDING_MODEL
+from app.faiss_vectorstore import FaissVectorStore
+from app.ingestion import BATCH_SIZE, ingest_files
+from app.vectorstore_utils import MONGO_DB, create_mongo_store
+
+CHECKPOINT_EVERY = 1000
+# Minimum seconds between checkpoints: each one rewrites the whole FAISS index
+CHECKPOINT_INTERVAL = 300
+STAT_KEYS = ("files_skipped", "files_processed", "chunks_added")
+
+
+class PdfPath:
+    """A PDF on disk with the `.name`/`getvalue()` interface ingestion expects; bytes are read on demand."""
+
+    def __init__(self, path: str, name: str):
+        self.path = path
+        self.name = name
+
+    def getvalue(self) -> bytes:
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def signature(self) -> List[int]:
+        stat = os.stat(self.path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+
+def find_pdfs(root: str) -> List[PdfPath]:
+    """Every *.pdf under `root`, in a stable order, named by their path relative to it."""
+    found = []
+    for directory, subdirs, files in os.walk(root):
+        subdirs.sort()
+        for file_name in sorted(files):
+            if file_name.lower().endswith(".pdf"):
+                path = os.path.join(directory, file_name)
+                found.append(PdfPath(path, os.path.relpath(path, root).replace(os.sep, "/")))
+    return found
+
+
+class Checkpoint:
+    """
+    JSON manifest of the files a bulk run has finished, written atomically after
+    each group. It only applies to the same root, target, embedding model and
+    chunking; otherwise the run starts from scratch (the store still skips
+    unchanged files by content hash).
+    """
+
+    def __init__(self, path: str, identity: dict):
+        self.path = path
+        self.identity = identity
+        self.files: Dict[str, List[int]] = {}
+        self.failed: Dict[str, str] = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            if saved.get("identity") == identity:
+                self.files = saved.get("files", {})
+                self.failed = saved.get("failed", {})
+
+    def is_done(self, pdf: PdfPath) -> bool:
+        return self.files.get(pdf.name) == pdf.signature()
+
+    def record(self, done: List[PdfPath], failed: Dict[str, str]):
+        for pdf in done:
+            self.files[pdf.name] = pdf.signature()
+            self.failed.pop(pdf.name, None)
+        self.failed.update(failed)
+
+    def forget(self, names):
+        for name in names:
+            self.files.pop(name, None)
+            self.failed.pop(name, None)
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"identity": self.identity, "files": self.files, "failed": self.failed}, f)
+        os.replace(tmp_path, self.path)
+
+
+def _open_store(args):
+    if args.faiss:
+        return FaissVectorStore.load(args.faiss) or FaissVectorStore(embedding_model_name=EMBEDDING_MODEL,
+                                                                      path=args.faiss)
+    return create_mongo_store(args.mongo_uri, args.mongo_db, args.mongo)
+
+
+def _ingest_group(group: List[PdfPath], store, args) -> Tuple[Dict[str, int], Dict[str, str]]:
+    """Ingest one group; if it fails, retry file by file so one bad PDF only costs itself."""
+    options = dict(batch_size=args.batch_size, max_workers=args.workers, remove_missing=False, flush=False)
+    try:
+        return ingest_files(group, store, **options), {}
+    except Exception as error:
+        if len(group) == 1:
+            return dict.fromkeys(STAT_KEYS, 0), {group[0].name: f"{type(error).__name__}: {error}"}
+    totals, failed = dict.fromkeys(STAT_KEYS, 0), {}
+    for pdf in group:
+        try:
+            stats = ingest_files([pdf], store, **options)
+        except Exception as error:
+            failed[pdf.name] = f"{type(error).__name__}: {error}"
+            last_error = error
+            continue
+        for key in STAT_KEYS:
+            totals[key] += stats[key]
+    if len(failed) == len(group):
+        raise last_error  # nothing works: the store or the model is at fault, not the files
+    return totals, failed
+
+
+def bulk_ingest(args) -> Dict[str, int]:
+    pdfs = find_pdfs(args.root)
+    target = {"faiss": os.path.abspath(args.faiss)} if args.faiss else \
+        {"mongo": args.mongo, "db": args.mongo_db or MONGO_DB}
+    checkpoint = Checkpoint(args.checkpoint, {"root": os.path.abspath(args.root), "target": target,
+                                              "embedding_model": EMBEDDING_MODEL, "chunking": CHUNKING})
+    todo = [pdf for pdf in pdfs if not checkpoint.is_done(pdf)]
+    print(f"{len(pdfs)} PDFs under {args.root}, {len(pdfs) - len(todo)} already done per {args.checkpoint}",
+          file=sys.stderr, flush=True)
+
+    store = _open_store(args)
+    totals = dict.fromkeys(STAT_KEYS, 0)
+    totals["files_failed"] = 0
+    start = last_checkpoint = time.perf_counter()
+    for group_start in range(0, len(todo), args.checkpoint_every):
+        group = todo[group_start:group_start + args.checkpoint_every]
+        stats, failed = _ingest_group(group, store, args)
+        # Files only count as done once the store holding them is on disk
+        checkpoint.record([pdf for pdf in group if pdf.name not in failed], failed)
+        last_group = group_start + len(group) >= len(todo)
+        if last_group or time.perf_counter() - last_checkpoint >= args.checkpoint_interval:
+            store.flush_index()
+            checkpoint.save()
+            last_checkpoint = time.perf_counter()
+        for key in STAT_KEYS:
+            totals[key] += stats[key]
+        totals["files_failed"] += len(failed)
+
+        done = group_start + len(group)
+        rate = done / (time.perf_counter() - start)
+        print(f"[{done}/{len(todo)}] {totals['chunks_added']} chunks added, {totals['files_failed']} failed, "
+              f"{rate:.1f} files/s, ETA {(len(todo) - done) / rate / 60:.0f} min", file=sys.stderr, flush=True)
+        for name, error in failed.items():
+            print(f"  failed: {name}: {error}", file=sys.stderr, flush=True)
+
+    if args.prune:
+        present = {pdf.name for pdf in pdfs}
+        removed = [source for source in store.file_hashes() if source not in present]
+        for source in removed:
+            store.delete_source(source)
+        store.flush_index()
+        checkpoint.forget(set(checkpoint.files) - present)
+        checkpoint.save()
+        totals["files_removed"] = len(removed)
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("root", help="directory searched recursively for *.pdf")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--faiss", metavar="DIR", help="FAISS collection directory (created if missing)")
+    target.add_argument("--mongo", metavar="COLLECTION", help="MongoDB collection")
+    parser.add_argument("--mongo-uri", help="default: MONGO_URI")
+    parser.add_argument("--mongo-db", help="default: MONGO_DB")
+    parser.add_argument("--checkpoint", help="checkpoint manifest (default: checkpoint.json in the FAISS "
+                                             "directory, or .ingest-<db>.<collection>.json for MongoDB)")
+    parser.add_argument("--checkpoint-every", type=int, default=CHECKPOINT_EVERY,
+                        help="files per group; checkpoints are taken between groups")
+    parser.add_argument("--checkpoint-interval", type=float, default=CHECKPOINT_INTERVAL, metavar="SECONDS",
+                        help="minimum time between checkpoints (store saved, manifest written)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="chunks embedded per forward pass")
+    parser.add_argument("--workers", type=int, default=None, help="PDF extraction processes (default: PDF_WORKERS "
+                                                                 "or the CPU count)")
+    parser.add_argument("--prune", action="store_true",
+                        help="afterwards, delete sources in the store that are no longer under root")
+    args = parser.parse_args(argv)
+    if args.checkpoint is None:
+        args.checkpoint = os.path.join(args.faiss, "checkpoint.json") if args.faiss else \
+            f".ingest-{args.mongo_db or MONGO_DB}.{args.mongo}.json"
+
+    totals = bulk_ingest(args)
+    print(json.dumps(totals))
+    return 1 if totals["files_failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
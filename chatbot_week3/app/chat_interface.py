@@ -1,6 +1,8 @@
 import streamlit as st
+import httpx
 import time
-from app.chat_manager import get_response
+from app.api_client import RAG_API_URL, ServiceBusy, stream_query
+from app.state import session_chat_model, session_histogram
 
 def render_chat():
     st.subheader("Chat with Your Documents (or the Web)")
@@ -14,6 +16,10 @@ def render_chat():
     # Chat input box
     if prompt := st.chat_input("Ask a question..."):
         _handle_user_input(prompt)
+    elif not RAG_API_URL:
+        # The page is up: load the embedding model while the user types the first question
+        from app.turn_pipeline import warm_up_in_background
+        warm_up_in_background()
 
 
 def _handle_user_input(prompt):
@@ -33,29 +39,62 @@ def _handle_user_input(prompt):
 
     # Generate assistant response
     with st.chat_message("assistant"):
+        turn_timings = {}
+        # Tokens are rendered as they arrive; the spinner only covers retrieval
         with st.spinner("Thinking..."):
-            # Check cache first
-            if prompt in st.session_state.query_cache:
-                response, query_time = st.session_state.query_cache[prompt]
+            if RAG_API_URL:
+                # Thin client: the service keeps the conversation's memory under this id
+                stream = stream_query(st.session_state.messages, prompt, st.session_state.vectorstore,
+                                      turn_timings, st.session_state.conversation_id)
             else:
-                # Pass full history (including previous assistant messages)
-                response, query_time = get_response(
-                    st.session_state.chat_model,
+                # The RAG engine (embeddings, stores, LLM client) is imported with the first question
+                from app.chat_manager import stream_response
+                stream = stream_response(
+                    session_chat_model(),
                     st.session_state.messages,  # Now includes all past conversation
-                    st.session_state.vectorstore,
-                    prompt
+                    _open_vectorstore(),
+                    prompt,
+                    turn_timings,
+                    st.session_state.conversation_memory,
                 )
-                st.session_state.query_cache[prompt] = (response, query_time)
+            try:
+                first_token = next(stream, "")
+            except ServiceBusy as e:
+                st.warning(str(e))
+                st.session_state.messages.pop()  # let the question be asked again
+                return
+            except (httpx.HTTPError, RuntimeError) as e:
+                _report_failure(e)
+                return
+        try:
+            response = st.write_stream(_prepend(first_token, stream))
+        except (httpx.HTTPError, RuntimeError) as e:  # e.g. the service dropped the stream mid-answer
+            _report_failure(e)
+            return
+        query_time = turn_timings["query_time"]
 
-            # Record query time per store type
-            if st.session_state.vectorstore:
-                store_type = st.session_state.vectorstore["type"]
-                st.session_state.timings[store_type].append(query_time)
+        # Record query time per store type
+        if st.session_state.vectorstore:
+            session_histogram(st.session_state.vectorstore["type"]).record(query_time)
+        if not turn_timings["cached"]:
+            session_histogram("ttft").record(turn_timings["ttft"])
+            session_histogram("generation").record(turn_timings["generation_time"])
+        st.session_state.last_turn = turn_timings
 
-            # Display assistant response
-            st.markdown(f"**Query time:** {query_time:.3f} seconds")
-            st.markdown(response)
-            st.caption(timestamp)
+        st.markdown(f"**Query time:** {query_time:.3f} seconds")
+        if turn_timings.get("retrieval_skipped"):
+            st.warning("Searching your documents took too long, so this answer does not use them. "
+                       "Ask again to include them.")
+        if turn_timings["cached"]:
+            st.caption("Answered from cache")
+        else:
+            st.caption(f"First token after {turn_timings['ttft']:.3f} s, "
+                       f"generation {turn_timings['generation_time']:.3f} s")
+            st.caption(f"Critical path: {_format_critical_path(turn_timings)}")
+            tokens = turn_timings["prompt_tokens"]
+            st.caption(f"Prompt: {tokens['total']} tokens (history {tokens['history']}, summary {tokens['summary']}, "
+                       f"documents {tokens['documents']})")
+        st.caption(timestamp)
 
     # Add assistant message to history after showing it
     st.session_state.messages.append({
@@ -63,3 +102,38 @@ def _handle_user_input(prompt):
         "content": response,
         "timestamp": timestamp
     })
+    # Fold turns that left the verbatim window into the rolling summary, off the request path
+    if not RAG_API_URL:
+        st.session_state.conversation_memory.update_in_background(st.session_state.messages)
+
+
+def _report_failure(error):
+    # Connection errors, service-side failures and 5xx replies end the turn, not the app
+    st.error(f"Could not answer: {error}")
+    st.session_state.messages.pop()  # let the question be asked again
+
+
+def _open_vectorstore():
+    # A collection picked in the sidebar is only named until it is first queried
+    vectorstore = st.session_state.vectorstore
+    if vectorstore and "store" not in vectorstore:
+        from app.vectorstore_utils import open_faiss_collection
+        store = open_faiss_collection(vectorstore["collection"], create=False)
+        if store is None:
+            return None
+        vectorstore = st.session_state.vectorstore = {**vectorstore, "store": store}
+    return vectorstore
+
+
+def _prepend(first, rest):
+    yield first
+    yield from rest
+
+
+def _format_critical_path(turn_timings):
+    stages = turn_timings["stages"]
+    return " → ".join(
+        f"{name} {stages[name]['end'] - stages[name]['start']:.2f}s"
+        + ("" if stages[name]["status"] == "ok" else f" ({stages[name]['status']})")
+        for name in turn_timings["critical_path"]
+    )
@@ -1,40 +1,60 @@
-import time
-import streamlit as st
-from app.search_utils import search_internet
-from app.summarization_utils import summarize_context
-from app.chat_utils import ask_chat_model
-from sentence_transformers import SentenceTransformer, util
+import asyncio
 import hashlib
+import os
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from app.search_utils import SPECULATIVE_SEARCH, start_search
+from app.summarization_utils import summarize_contexts
+from app.chat_utils import ask_chat_model, stream_chat_model
+from app.embeddings import EMBEDDING_MODEL, get_embeddings, is_model_loaded, load_model
+from app.semantic_cache import answer_cache
+from app.reranker import RERANK_CANDIDATES, get_reranker
+from app.context_assembler import RECENT_MESSAGES, SOURCES_MARKER, ConversationMemory, assemble_context, strip_sources
+from app.tokens import count_tokens
+from app.turn_pipeline import TurnTrace, in_thread, run_stage, run_turn
 
-# Load embedding model once
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+# Chunks passed on to summarization and the prompt
+TOP_K = int(os.getenv("TOP_K", "3"))
 
 
-def get_cache_key(prompt, vectorstore):
+def get_corpus_key(vectorstore):
     """
-    Generate a unique cache key based on:
-    - user prompt
-    - vectorstore state (documents uploaded or not)
+    Key identifying the document set answers were generated from: the store's
+    name plus its generation counter, or "no_docs" when nothing is uploaded.
+    Reading it never scans the store.
     """
-    doc_hash = "no_docs"
+    if not vectorstore:
+        return "no_docs"
+    store = vectorstore["store"]
+    return f"{vectorstore['type']}:{store.name}:{store.version}"
+
+
+def get_answer_cache_key(vectorstore, messages, memory: ConversationMemory = None):
+    """
+    Answer cache key of a question: the corpus key, plus a hash of the conversation before it
+    (the verbatim recent turns and the rolling summary) unless it is the first question.
+    Standalone questions are shared across conversations; a follow-up like "why?" only hits
+    an answer given in the same context.
+    """
+    corpus_key = get_corpus_key(vectorstore)
+    history = messages[:-1][-RECENT_MESSAGES:]
+    summary = memory.summary if memory else ""
+    if not history and not summary:
+        return corpus_key
+    context = hashlib.sha256(summary.encode())
+    for message in history:
+        context.update(f"\0{message['role']}\0{strip_sources(message['content'])}".encode())
+    return f"{corpus_key}:{context.hexdigest()[:16]}"
+
+
+def _warm_up(vectorstore):
+    load_model(EMBEDDING_MODEL)
     if vectorstore:
-        if vectorstore["type"] == "faiss":
-            try:
-                all_ids = "".join(vectorstore["store"].docstore._dict.keys())
-                doc_hash = hashlib.md5(all_ids.encode()).hexdigest()
-            except AttributeError:
-                doc_hash = "no_docs"
-        elif vectorstore["type"] == "mongo":
-            docs = list(vectorstore["store"].collection.find({}, {"_id": 1}))
-            if docs:
-                all_ids = "".join([str(d["_id"]) for d in docs])
-                doc_hash = hashlib.md5(all_ids.encode()).hexdigest()
-    return f"{hashlib.md5(prompt.encode()).hexdigest()}_{doc_hash}"
+        vectorstore["store"].warm_up()
 
 
-def format_conversation(messages):
-    """Format conversation history into Q&A style string."""
-    return "\n".join(f"{msg['role'].capitalize()}: {msg['content']}" for msg in messages)
+def _embed_prompt(prompt):
+    return get_embeddings(EMBEDDING_MODEL).embed_query(prompt)
 
 
 def build_system_prompt(history, docs, question):
@@ -50,76 +70,236 @@ User Question: {question}
 Answer:"""
 
 
-def get_response(chat_model, messages, vectorstore, prompt):
-    """
-    Document-first retrieval with web fallback:
-    - Handles mid-conversation document uploads
-    - Maintains previous chat history
-    - Caches answers per prompt + document state
-    """
+def _has_docs(vectorstore):
+    # Both stores track their size, so this is constant time
+    return bool(vectorstore) and len(vectorstore["store"]) > 0
 
-    if 'query_cache' not in st.session_state:
-        st.session_state.query_cache = {}
 
-    # 1️⃣ Check if documents exist
-    has_docs = False
-    if vectorstore:
-        if vectorstore["type"] == "faiss":
-            has_docs = vectorstore["store"].index.ntotal > 0
-        elif vectorstore["type"] == "mongo":
-            has_docs = vectorstore["store"].collection.count_documents({}) > 0
+def _corpus_state(vectorstore, messages, memory):
+    # The size and version of a Mongo store are each a round trip (a FAISS collection may reload
+    # from disk), so they are read off the event loop, which the API shares between requests
+    return _has_docs(vectorstore), get_answer_cache_key(vectorstore, messages, memory)
+
+
+class TurnPlan(NamedTuple):
+    system_prompt: str
+    chunks: List[Tuple[str, str]]  # (context text, source) pairs the answer is based on
+    cached: Optional[Tuple[str, float]]  # (answer, query_time) when the semantic cache answered
+    query_vector: Optional[List[float]]
+    cache_key: str  # see get_answer_cache_key
+    summary_calls: List[float]
+    token_counts: Dict[str, int]  # prompt tokens per section, see assemble_context
+    retrieval_skipped: bool = False  # the documents were not searched in time; tell the user
+
+
+def _cite(metadata):
+    """Source label for a chunk: its file and, when known, the pages it came from."""
+    source = metadata.get("source", "from your document")
+    page, page_end = metadata.get("page"), metadata.get("page_end")
+    if page is None:
+        return source
+    return f"{source} (pp. {page}-{page_end})" if page_end else f"{source} (p. {page})"
+
+
+def _retrieve(vectorstore, prompt, query_vector, k=TOP_K):
+    # Both stores return {text, metadata, score, id} dicts, score being the cosine similarity to the
+    # query (plus rrf_score in hybrid mode)
+    if vectorstore["type"] == "faiss":
+        from app.vectorstore_utils import retrieve_relevant_docs_faiss
+        return retrieve_relevant_docs_faiss(vectorstore["store"], prompt, k=k, query_embedding=query_vector)
+    elif vectorstore["type"] == "mongo":
+        from app.vectorstore_utils import retrieve_relevant_docs_mongo
+        return retrieve_relevant_docs_mongo(vectorstore["store"], prompt, k=k, query_embedding=query_vector)
+    return []
+
+
+def _web_search(trace, prompt):
+    # A failed or slow search leaves the answer without web context instead of failing the turn
+    return run_stage(trace, "web_search", asyncio.wrap_future(start_search(prompt)), deps=["embed", "cache_lookup"],
+                     default=[], tolerate_errors=True)
+
+
+async def _prepare_turn(messages, vectorstore, prompt, trace: TurnTrace,
+                        memory: ConversationMemory = None) -> TurnPlan:
+    """
+    Everything before the LLM call, with independent stages overlapped: once the
+    answer cache has missed, retrieval and the (speculative) web search start
+    together; re-ranking and summarization follow retrieval. Each stage has a
+    deadline (see turn_pipeline). History and context are then fitted into the
+    token budget.
+    """
+    has_docs, cache_key = await in_thread(_corpus_state, vectorstore, messages, memory)
 
-    # 2️⃣ Generate cache key
-    cache_key = get_cache_key(prompt, vectorstore)
+    # 0️⃣ On a cold process, load the embedding model and the store's index first: loading has no
+    # deadline, so it cannot make the embed or retrieve stage time out and skip the documents
+    embed_deps = []
+    if not is_model_loaded(EMBEDDING_MODEL) or (has_docs and not vectorstore["store"].is_warm):
+        await run_stage(trace, "warm_up", in_thread(_warm_up, vectorstore if has_docs else None))
+        embed_deps = ["warm_up"]
 
-    # 3️⃣ Return cached response if exists
-    if cache_key in st.session_state.query_cache:
-        cached_response, cached_time = st.session_state.query_cache[cache_key]
-        return cached_response, cached_time
+    # 1️⃣ Embed the question
+    query_vector = await run_stage(trace, "embed", in_thread(_embed_prompt, prompt), deps=embed_deps)
 
-    start_time = time.time()
-    summarized_chunks = []
+    # 2️⃣ Look up a semantically similar question asked against the same documents and context
+    if query_vector is not None:
+        with trace.span("cache_lookup", deps=["embed"]):
+            cached = answer_cache.lookup(query_vector, cache_key)
+        if cached:
+            return TurnPlan("", [], cached, query_vector, cache_key, [], {})
 
-    # 4️⃣ Retrieve document chunks first
+    # 3️⃣ Retrieve document chunks, searching the web at the same time if it may be needed
+    search = _web_search(trace, prompt) if SPECULATIVE_SEARCH or not has_docs else None
+    search = asyncio.ensure_future(search) if search else None
+    chunks, call_times, context_stage, retrieval_skipped = [], [], "embed", False
+    reranker = get_reranker()
     if has_docs:
-        relevant_docs = []
-        if vectorstore["type"] == "faiss":
-            from app.vectorstore_utils import retrieve_relevant_docs_faiss
-            relevant_docs = retrieve_relevant_docs_faiss(vectorstore["store"], prompt)
-        elif vectorstore["type"] == "mongo":
-            from app.vectorstore_utils import retrieve_relevant_docs_mongo
-            relevant_docs = retrieve_relevant_docs_mongo(vectorstore["store"], prompt, k=3)
-
-        # Summarize each chunk and keep source
-        for doc in relevant_docs:
-            text = doc.page_content.strip()
-            source = doc.metadata.get("source", "from your document")
-            if text:
-                summary = summarize_context(text)
-                summarized_chunks.append((summary, source))
+        # With a re-ranker, over-fetch candidates for it to choose the best TOP_K from
+        k = max(RERANK_CANDIDATES, TOP_K) if reranker else TOP_K
+        relevant_docs = await run_stage(trace, "retrieve", in_thread(_retrieve, vectorstore, prompt, query_vector, k),
+                                        deps=["embed", "cache_lookup"], default=[])
+        context_stage = "retrieve"
+        retrieval_skipped = trace.stages["retrieve"]["status"] == "timeout"
+        if reranker and relevant_docs:
+            relevant_docs = await run_stage(trace, "rerank", in_thread(reranker.rerank, prompt, relevant_docs, TOP_K),
+                                            deps=["retrieve"], default=relevant_docs[:TOP_K], tolerate_errors=True)
+            context_stage = "rerank"
+        chunks = [(doc["text"].strip(), _cite(doc["metadata"])) for doc in relevant_docs]
+        chunks = [(text, source) for text, source in chunks if text]
+
+    # 4️⃣ Summarize all chunks concurrently and keep source
+    if chunks:
+        texts = [text for text, _ in chunks]
+        summaries = await run_stage(trace, "summarize", in_thread(summarize_contexts, texts, call_times),
+                                    deps=[context_stage])
+        context_stage = "summarize"
+        # Past the deadline the raw chunks are used rather than keeping the user waiting
+        chunks = [(summary, source) for summary, (_, source) in zip(summaries or texts, chunks)]
+        if search is not None:
+            search.cancel()
 
     # 5️⃣ Only fallback to web search if no documents found
-    if not summarized_chunks:
-        search_results = search_internet(prompt)
-        for r in search_results:
-            text = f"{r['title']}: {r['snippet']}"
-            source = r['link']
+    if not chunks:
+        for r in await (search or asyncio.ensure_future(_web_search(trace, prompt))):
+            chunks.append((f"{r['title']}: {r['snippet']}", r['link']))
+        context_stage = "web_search"
+
+    # 6️⃣ Fit recent turns, the rolling summary and the most relevant context into the token budget
+    with trace.span("assemble", deps=[context_stage]):
+        history, chunks, token_counts = assemble_context(
+            messages[:-1], chunks, prompt, memory, overhead_tokens=count_tokens(build_system_prompt("", "", "")))
+        context_text = "\n\n".join([f"{text} (Source: {source})" for text, source in chunks])
+        system_prompt = build_system_prompt(history, context_text, prompt)
+    return TurnPlan(system_prompt, chunks, None, query_vector, cache_key, call_times, token_counts,
+                    retrieval_skipped)
+
+
+def prepare_turn(messages, vectorstore, prompt, memory: ConversationMemory = None):
+    """Run `_prepare_turn` from synchronous code; returns (TurnPlan, TurnTrace)."""
+    trace = TurnTrace()
+    plan = run_turn(_prepare_turn(messages, vectorstore, prompt, trace, memory))
+    return plan, trace
+
+
+def _record_turn(plan: TurnPlan, trace: TurnTrace):
+    # Session-wide timings are only touched from the script thread, never from stage workers
+    if plan.summary_calls:
+        from app.state import session_histogram  # Streamlit is only needed when called from the UI
+        calls = session_histogram("summary_calls")
+        for seconds in plan.summary_calls:
+            calls.record(seconds)
+        summarize = trace.stages["summarize"]
+        session_histogram("summary_total").record(summarize["end"] - summarize["start"])
+
 
-    # 6️⃣ Build system prompt
-    context_text = "\n\n".join([f"{text} (Source: {source})" for text, source in summarized_chunks])
-    history = format_conversation(messages[:-1])
-    system_prompt = build_system_prompt(history, context_text, prompt)
+def _source_attribution(summarized_chunks):
+    return SOURCES_MARKER + "\n" + "\n".join([f"- {source}" for _, source in summarized_chunks])
 
-    # 7️⃣ Call chat model
-    response = ask_chat_model(chat_model, system_prompt)
 
-    # 8️⃣ Append source attribution
-    source_attribution = "Sources used in answer:\n" + "\n".join([f"- {source}" for _, source in summarized_chunks])
-    response += f"\n\n---\n{source_attribution}"
+def _complete_turn(plan: TurnPlan, trace: TurnTrace, response: str, query_time: float, **attributes):
+    """Cache a freshly generated answer and close the turn's trace."""
+    # An answer given without the documents is not worth repeating once they can be searched
+    if plan.query_vector is not None and not plan.retrieval_skipped:
+        answer_cache.store(plan.query_vector, plan.cache_key, response, query_time)
+    trace.finish(cached=False, prompt_tokens=plan.token_counts.get("total", 0), **attributes)
 
-    # 9️⃣ Cache response
-    end_time = time.time()
-    query_time = end_time - start_time
-    st.session_state.query_cache[cache_key] = (response, query_time)
 
+async def _answer_turn(chat_model, messages, vectorstore, prompt, trace: TurnTrace,
+                       memory: ConversationMemory = None) -> Tuple[TurnPlan, str, float]:
+    """A whole non-streaming turn on the running event loop; returns (plan, response, query_time)."""
+    plan = await _prepare_turn(messages, vectorstore, prompt, trace, memory)
+    if plan.cached:
+        trace.finish(cached=True)
+        return (plan, *plan.cached)
+
+    with trace.span("generate", deps=["assemble"]):
+        response = await in_thread(ask_chat_model, chat_model, plan.system_prompt)
+    response += _source_attribution(plan.chunks)
+    query_time = trace.elapsed()
+    _complete_turn(plan, trace, response, query_time)
+    return plan, response, query_time
+
+
+def get_response(chat_model, messages, vectorstore, prompt, memory: ConversationMemory = None):
+    """
+    Document-first retrieval with web fallback:
+    - Handles mid-conversation document uploads
+    - Maintains previous chat history (recent turns verbatim, older ones via `memory`'s summary)
+    - Keeps the prompt within CONTEXT_TOKEN_BUDGET
+    - Caches answers per similar prompt + document state, shared across sessions
+    """
+
+    # Embed, check the answer cache, retrieve, summarize, call the chat model and cache the answer
+    trace = TurnTrace()
+    plan, response, query_time = run_turn(_answer_turn(chat_model, messages, vectorstore, prompt, trace, memory))
+    if not plan.cached:
+        _record_turn(plan, trace)
     return response, query_time
+
+
+def stream_response(chat_model, messages, vectorstore, prompt, turn_timings: dict,
+                    memory: ConversationMemory = None):
+    """
+    Streaming variant of `get_response`: a generator that yields the answer as the
+    model produces it (source attribution last), for use with `st.write_stream`.
+
+    Fills `turn_timings` with:
+    - query_time: seconds until the prompt was ready (embedding, retrieval, summarization)
+    - ttft: seconds from the start of the turn to the first answer token
+    - generation_time: seconds from sending the prompt to the last token
+    - cached: whether the answer came from the semantic cache
+    - stages / critical_path: per-stage timings of the turn (see TurnTrace)
+    - prompt_tokens: prompt tokens per section (see assemble_context)
+    - retrieval_skipped: whether the documents could not be searched in time
+    """
+
+    plan, trace = prepare_turn(messages, vectorstore, prompt, memory)
+    turn_timings.update(stages=trace.stages, critical_path=trace.critical_path(), prompt_tokens=plan.token_counts,
+                        retrieval_skipped=plan.retrieval_skipped)
+    if plan.cached:
+        cached_response, cached_time = plan.cached
+        turn_timings.update(query_time=cached_time, ttft=0.0, generation_time=0.0, cached=True)
+        trace.finish(cached=True)
+        yield cached_response
+        return
+
+    _record_turn(plan, trace)
+    turn_timings["query_time"] = trace.elapsed()
+    turn_timings["cached"] = False
+
+    generation_start = time.perf_counter()
+    parts = []
+    for token in stream_chat_model(chat_model, plan.system_prompt):
+        if not parts:
+            turn_timings["ttft"] = trace.elapsed()
+        parts.append(token)
+        yield token
+    trace.record("generate", generation_start, time.perf_counter(), deps=["assemble"])
+    turn_timings["generation_time"] = time.perf_counter() - generation_start
+    turn_timings.setdefault("ttft", turn_timings["query_time"] + turn_timings["generation_time"])
+    turn_timings["critical_path"] = trace.critical_path()
+
+    attribution = _source_attribution(plan.chunks)
+    parts.append(attribution)
+    yield attribution
+
+    _complete_turn(plan, trace, "".join(parts), turn_timings["query_time"], ttft=turn_timings["ttft"])
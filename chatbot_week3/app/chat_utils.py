@@ -1,12 +1,19 @@
-from euriai.langchain import create_chat_model
-from dotenv import load_dotenv
 import os
+import threading
 
-load_dotenv() 
 API_KEY = os.getenv("EURI_API_KEY")
 MODEL = "gpt-4.1-nano"
 TEMPERATURE = 0.7
 
+# Shared clients (one per API key) so helper calls reuse the same connection pool
+_shared_models = {}
+_lock = threading.Lock()
+
+def create_chat_model(**kwargs):
+    # The euriai client (and the LangChain stack under it) is imported with the first model
+    from euriai.langchain import create_chat_model
+    return create_chat_model(**kwargs)
+
 def get_chat_model(api_key: str = None):
     return create_chat_model(
         api_key=api_key or API_KEY,
@@ -14,6 +21,21 @@ def get_chat_model(api_key: str = None):
         temperature=TEMPERATURE
     )
 
+def get_shared_chat_model(api_key: str = None):
+    """Process-wide chat client for background calls such as summarization."""
+    key = api_key or API_KEY
+    if key not in _shared_models:
+        with _lock:
+            if key not in _shared_models:
+                _shared_models[key] = get_chat_model(key)
+    return _shared_models[key]
+
 def ask_chat_model(chat_model, prompt: str):
     response = chat_model.invoke(prompt)
     return response.content
+
+def stream_chat_model(chat_model, prompt: str):
+    """Yield the completion piece by piece as the model produces it."""
+    for chunk in chat_model.stream(prompt):
+        if chunk.content:
+            yield chunk.content
@@ -1,28 +1,235 @@
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import hashlib
+import os
+import re
+from bisect import bisect_right
+from itertools import accumulate
+from typing import List, NamedTuple, Tuple
+from app.pdf_utils import extract_pages_parallel
+from app.tokens import count_tokens
 
-def chunk_pdf_texts(uploaded_files, extract_text_fn):
+# Chunk sizes are measured in CHUNK_UNIT: "tokens" (the tokenizer of app.tokens) or "chars"
+CHUNK_UNIT = os.getenv("CHUNK_UNIT", "tokens")
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "256"))
+# Trailing paragraphs repeated at the start of the next chunk, when a section spans several chunks
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "32"))
+# Everything that decides chunk boundaries; stores re-chunk their files when it changes
+CHUNKING = {"chunker": "structured", "unit": CHUNK_UNIT, "size": CHUNK_SIZE, "overlap": CHUNK_OVERLAP}
+
+HEADING_MAX_CHARS = 80
+_NUMBERED_HEADING = re.compile(r"^(?:\d+(?:\.\d+)*\.?|[IVXLC]+\.|[A-Z]\.|(?:chapter|section|part)\s+\w+)\s+\S",
+                               re.IGNORECASE)
+_MINOR_WORDS = {"a", "an", "and", "as", "at", "by", "for", "in", "of", "on", "or", "the", "to", "vs", "with"}
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_WORD = re.compile(r"\S+")
+
+
+def chunk_id(source: str, text: str) -> str:
+    """Stable id for a chunk: the same text from the same file always maps to the same id."""
+    return hashlib.sha256(f"{source}\0{text}".encode()).hexdigest()[:32]
+
+
+def chunk_length(text: str) -> int:
+    return count_tokens(text) if CHUNK_UNIT == "tokens" else len(text)
+
+
+def is_heading(line: str) -> bool:
+    """Heuristic for text extracted from PDFs: a short line that is numbered, ALL CAPS or Title Case."""
+    line = line.strip()
+    if not line or len(line) > HEADING_MAX_CHARS or line[-1] in ".,;":
+        return False
+    if _NUMBERED_HEADING.match(line):
+        return True
+    letters = [c for c in line if c.isalpha()]
+    if len(letters) < 3:
+        return False
+    if all(c.isupper() for c in letters):
+        return True
+    words = line.split()
+    return len(words) <= 10 and words[0][0].isupper() and all(
+        w[0].isupper() or not w[0].isalpha() or w.lower() in _MINOR_WORDS for w in words)
+
+
+class Block(NamedTuple):
+    start: int  # character offsets in the file's joined page text
+    end: int
+    page: int  # 1-based
+    heading: bool
+
+
+def _page_blocks(text: str, offset: int, page: int) -> List[Block]:
+    """Headings (one line each) and paragraphs (runs of lines up to a blank line or heading) of one page."""
+    blocks = []
+    para_start = para_end = None
+    pos = 0
+    for line in text.splitlines(keepends=True):
+        line_start, pos = pos, pos + len(line)
+        stripped = line.strip()
+        if stripped and not is_heading(stripped):
+            if para_start is None:
+                para_start = line_start + len(line) - len(line.lstrip())
+            para_end = line_start + len(line.rstrip())
+            continue
+        if para_start is not None:
+            blocks.append(Block(offset + para_start, offset + para_end, page, False))
+            para_start = None
+        if stripped:
+            start = line_start + len(line) - len(line.lstrip())
+            blocks.append(Block(offset + start, offset + start + len(stripped), page, True))
+    if para_start is not None:
+        blocks.append(Block(offset + para_start, offset + para_end, page, False))
+    return blocks
+
+
+def _split_block(text: str, block: Block, max_size: int) -> List[Block]:
+    """Break a paragraph longer than `max_size` at sentence ends, and over-long sentences at word boundaries."""
+    body = text[block.start:block.end]
+    pieces, start = [], 0
+    for match in _SENTENCE_END.finditer(body):
+        pieces.append((start, match.start()))
+        start = match.end()
+    pieces.append((start, len(body)))
+
+    blocks = []
+    for start, end in pieces:
+        if chunk_length(body[start:end]) <= max_size:
+            blocks.append(Block(block.start + start, block.start + end, block.page, False))
+            continue
+        # Windows of words, sized by a per-word estimate so each sentence is only measured once
+        words = [(start + m.start(), start + m.end()) for m in _WORD.finditer(body, start, end)]
+        per_word = chunk_length(body[start:end]) / len(words)
+        step = max(int(max_size / per_word), 1)
+        for i in range(0, len(words), step):
+            window = words[i:i + step]
+            blocks.append(Block(block.start + window[0][0], block.start + window[-1][1], block.page, False))
+    return blocks
+
+
+def _pack(blocks: List[Block], sizes: List[int], size: int, overlap: int) -> List[Tuple[int, int]]:
+    """
+    Group consecutive blocks into chunks of at most `size`, as (first, last) block index pairs.
+
+    A heading always opens a new chunk. When a section is cut because the chunk is
+    full, the next chunk repeats its trailing paragraphs, up to `overlap`.
+    """
+    groups = []
+    current, current_size = [], 0
+    for i, (block, block_size) in enumerate(zip(blocks, sizes)):
+        if current and block.heading and not all(blocks[j].heading for j in current):
+            groups.append((current[0], current[-1]))
+            current, current_size = [], 0
+        elif current and current_size + block_size > size:
+            groups.append((current[0], current[-1]))
+            carry, carried = [], 0
+            for j in reversed(current):
+                if blocks[j].heading or carried + sizes[j] > overlap:
+                    break
+                carry.insert(0, j)
+                carried += sizes[j]
+            if carried + block_size > size:
+                carry, carried = [], 0
+            current, current_size = carry, carried
+        current.append(i)
+        current_size += block_size
+    if current:
+        groups.append((current[0], current[-1]))
+    return groups
+
+
+class ChunkedFile(NamedTuple):
+    texts: List[str]
+    metadatas: List[dict]
+    # Offset at which each page starts in the file's text: with a chunk's "start"/"end",
+    # the chunk-to-page lookup table (see `page_range`)
+    page_starts: List[int]
+
+
+def page_range(page_starts: List[int], start: int, end: int) -> Tuple[int, int]:
+    """First and last 1-based page covered by the characters [start, end) of a file."""
+    return bisect_right(page_starts, start), bisect_right(page_starts, max(end - 1, start))
+
+
+def chunk_file(name: str, pages: List[str], size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> ChunkedFile:
+    """
+    Split one file's pages into chunks along its structure: headings start new chunks,
+    paragraphs are kept whole where they fit and long ones are split at sentences.
+
+    Each chunk's metadata is {"source", "page", "start", "end"}, plus "page_end" when it
+    runs onto later pages and "section" (the heading it falls under) when there is one.
+    "start"/"end" are character offsets into the concatenated page text.
+    """
+    text = "".join(pages)
+    page_starts = [0, *accumulate(len(p) for p in pages)][:-1]
+    blocks = []
+    for page, (page_text, offset) in enumerate(zip(pages, page_starts), start=1):
+        blocks.extend(_page_blocks(page_text, offset, page))
+
+    sized_blocks, sizes = [], []
+    for block in blocks:
+        block_size = chunk_length(text[block.start:block.end])
+        if block_size > size and not block.heading:
+            for piece in _split_block(text, block, size):
+                sized_blocks.append(piece)
+                sizes.append(chunk_length(text[piece.start:piece.end]))
+        else:
+            sized_blocks.append(block)
+            sizes.append(block_size)
+
+    texts, metadatas = [], []
+    section, scanned = None, 0
+    for first, last in _pack(sized_blocks, sizes, size, overlap):
+        # Latest heading at or before the chunk's first block
+        for block in sized_blocks[scanned:first + 1]:
+            if block.heading:
+                section = text[block.start:block.end]
+        scanned = max(scanned, first + 1)
+        start, end = sized_blocks[first].start, sized_blocks[last].end
+        metadata = {"source": name, "page": sized_blocks[first].page, "start": start, "end": end}
+        if sized_blocks[last].page != metadata["page"]:
+            metadata["page_end"] = sized_blocks[last].page
+        if section:
+            metadata["section"] = section
+        texts.append(text[start:end])
+        metadatas.append(metadata)
+    return ChunkedFile(texts, metadatas, page_starts)
+
+
+def chunk_pdf_pages(file_pages):
+    """
+    Split already extracted pages into chunks (see `chunk_file`).
+
+    Args:
+        file_pages (list): (file_name, [page_text, ...]) pairs, e.g. from `extract_pages_parallel`.
+
+    Returns:
+        all_chunks (list of str): Text chunks from all files.
+        all_metadatas (list of dict): Page, character offsets and section per chunk.
+    """
+    all_chunks = []
+    all_metadatas = []
+    for name, pages in file_pages:
+        chunked = chunk_file(name, pages)
+        all_chunks.extend(chunked.texts)
+        all_metadatas.extend(chunked.metadatas)
+    return all_chunks, all_metadatas
+
+
+def chunk_pdf_texts(uploaded_files, extract_text_fn=None, progress_callback=None):
     """
     Given a list of uploaded PDF files and a text extraction function,
     extract text from each file, split into chunks, and return chunks and metadata.
-    
+
     Args:
         uploaded_files (list): List of uploaded file objects.
         extract_text_fn (callable): Function to extract text from a single PDF file.
-        
+            When omitted, files are extracted in parallel and chunks keep their page number.
+        progress_callback (callable): Per-file progress hook for parallel extraction,
+            called as (file_name, files_done, files_total).
+
     Returns:
         all_chunks (list of str): Text chunks from all files.
         all_metadatas (list of dict): Corresponding metadata for each chunk.
     """
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        length_function=len,
-    )
-    all_chunks = []
-    all_metadatas = []
-    for file in uploaded_files:
-        text = extract_text_fn(file)
-        chunks = text_splitter.split_text(text)
-        all_chunks.extend(chunks)
-        all_metadatas.extend([{"source": file.name}] * len(chunks))
-    return all_chunks, all_metadatas
+    if extract_text_fn is None:
+        return chunk_pdf_pages(extract_pages_parallel(uploaded_files, progress_callback))
+    # Without page boundaries the whole text counts as page 1
+    return chunk_pdf_pages([(file.name, [extract_text_fn(file)]) for file in uploaded_files])
@@ -0,0 +1,127 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+from app.chat_utils import ask_chat_model, get_shared_chat_model
+from app.tokens import count_tokens, truncate_tokens
+
+# Token budget for the whole system prompt (instructions, history, documents and question)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "4000"))
+# Share of what is left after instructions and question that history may use
+HISTORY_SHARE = float(os.getenv("HISTORY_SHARE", "0.3"))
+# Most recent messages kept verbatim; older ones are folded into the rolling summary
+RECENT_MESSAGES = int(os.getenv("RECENT_MESSAGES", "6"))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "300"))
+# A chunk cut to fit the budget is only worth including if this much of it remains
+MIN_CHUNK_TOKENS = 64
+
+# Appended to every answer; stripped again before the answer goes back into a prompt
+SOURCES_MARKER = "\n\n---\nSources used in answer:"
+# Opens the history section when earlier messages have been summarized
+SUMMARY_PREFIX = "Summary of earlier conversation: "
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="memory")
+
+
+def strip_sources(content: str) -> str:
+    return content.split(SOURCES_MARKER, 1)[0]
+
+
+def _format_message(message) -> str:
+    return f"{message['role'].capitalize()}: {strip_sources(message['content'])}"
+
+
+class ConversationMemory:
+    """
+    Rolling summary of the messages that have aged out of the verbatim window.
+
+    Updates are incremental: each one folds only the messages that left the window
+    since the previous update into the existing summary, with one LLM call, and is
+    meant to run in the background after a turn so it never delays an answer.
+    """
+
+    def __init__(self, recent_messages: int = RECENT_MESSAGES):
+        self.recent_messages = recent_messages
+        self.summary = ""
+        self.summarized = 0  # number of leading messages folded into `summary`
+        self._lock = threading.Lock()
+        self._pending = None
+
+    def update(self, messages):
+        with self._lock:
+            upto = max(len(messages) - self.recent_messages, 0)
+            if upto <= self.summarized:
+                return
+            new_lines = "\n".join(_format_message(m) for m in messages[self.summarized:upto])
+            prompt = (
+                f"Update the running summary of a conversation with the new messages below. Keep names, "
+                f"numbers and open questions; stay under {SUMMARY_MAX_TOKENS} tokens.\n\n"
+                f"Current summary:\n{self.summary or '(empty)'}\n\nNew messages:\n{new_lines}\n\nUpdated summary:"
+            )
+            summary = ask_chat_model(get_shared_chat_model(), prompt).strip()
+            self.summary = truncate_tokens(summary, SUMMARY_MAX_TOKENS)
+            self.summarized = upto
+
+    def update_in_background(self, messages):
+        # One update at a time per conversation; a later call catches up on anything skipped
+        if self._pending is None or self._pending.done():
+            self._pending = _executor.submit(self.update, list(messages))
+
+
+def assemble_context(history_messages, chunks: List[Tuple[str, str]], question: str,
+                     memory: ConversationMemory = None, budget: int = CONTEXT_TOKEN_BUDGET,
+                     overhead_tokens: int = 0) -> Tuple[str, List[Tuple[str, str]], Dict[str, int]]:
+    """
+    Fit conversation history and retrieved chunks into a token budget.
+
+    History gets at most HISTORY_SHARE of what the instructions (`overhead_tokens`)
+    and question leave: the newest messages not yet summarized, verbatim and without
+    their source lists, then as much of the rolling summary as still fits. Chunks
+    (already ordered by relevance) are packed into the rest, the last one cut short
+    if enough of it fits.
+
+    Returns:
+        history_text (str), packed chunks ([(text, source)]), and token counts per
+        prompt section: instructions, question, history, summary, documents, total.
+    """
+    counts = {"instructions": overhead_tokens, "question": count_tokens(question)}
+    remaining = max(budget - overhead_tokens - counts["question"], 0)
+
+    # Newest first, so the latest exchanges survive when history is over budget
+    history_budget = int(remaining * HISTORY_SHARE)
+    unsummarized = history_messages[memory.summarized:] if memory else history_messages
+    lines, history_tokens = [], 0
+    for message in reversed(unsummarized):
+        line = _format_message(message)
+        tokens = count_tokens(line) + 1
+        if history_tokens + tokens > history_budget:
+            break
+        lines.append(line)
+        history_tokens += tokens
+    lines.reverse()
+    # The summary line is budgeted with its prefix and newline, as it appears in the prompt
+    summary_room = history_budget - history_tokens - count_tokens(SUMMARY_PREFIX) - 1
+    summary = ""
+    if memory and memory.summary and summary_room > 0:
+        summary = truncate_tokens(memory.summary, summary_room)
+    summary_line = [SUMMARY_PREFIX + summary] if summary else []
+    summary_tokens = count_tokens(summary_line[0]) + 1 if summary else 0
+    history_text = "\n".join(summary_line + lines)
+
+    documents_budget = remaining - history_tokens - summary_tokens
+    packed, documents_tokens = [], 0
+    for text, source in chunks:
+        suffix_tokens = count_tokens(f" (Source: {source})") + 2
+        tokens = count_tokens(text) + suffix_tokens
+        if documents_tokens + tokens > documents_budget:
+            room = documents_budget - documents_tokens - suffix_tokens
+            if room >= MIN_CHUNK_TOKENS:
+                packed.append((truncate_tokens(text, room), source))
+                documents_tokens += room + suffix_tokens
+            break
+        packed.append((text, source))
+        documents_tokens += tokens
+
+    counts.update(history=history_tokens, summary=summary_tokens, documents=documents_tokens)
+    counts["total"] = sum(counts[k] for k in ("instructions", "question", "history", "summary", "documents"))
+    return history_text, packed, counts
@@ -1,23 +1,71 @@
 import streamlit as st
-from app.pdf_utils import extract_text_from_pdf
-from app.chunking import chunk_pdf_texts
-from app.vectorstore_utils import create_faiss_index, create_mongo_store, upsert_texts_to_mongo
+import httpx
+from app.api_client import RAG_API_URL, ServiceBusy, ingest
+from app.vectorstore_utils import FAISS_COLLECTION, CollectionConflict, open_faiss_collection, open_mongo_collection
 
 def process_uploaded_documents(uploaded_files):
-    all_chunks, all_metadatas = chunk_pdf_texts(uploaded_files, extract_text_from_pdf)
+    if RAG_API_URL:
+        _process_with_service(uploaded_files)
+        return
+
+    from app.ingestion import ingest_files  # PDF extraction and chunking load with the first upload
 
     if st.session_state.store_type == "faiss":
-        vectorstore = create_faiss_index(all_chunks)
-        st.session_state.vectorstore = {"type": "faiss", "store": vectorstore}
-        st.success("FAISS index created in-memory.")
+        # Update the named on-disk collection so unchanged files are not re-embedded
+        collection = st.session_state.get("faiss_collection_input") or FAISS_COLLECTION
+        try:
+            store = open_faiss_collection(collection)
+        except ValueError as e:
+            st.error(str(e))
+            return
+        st.session_state.vectorstore = {"type": "faiss", "collection": collection, "store": store}
     else:
         mongo_uri = st.session_state.get("mongo_uri_input")
         mongo_db = st.session_state.get("mongo_db_input")
         mongo_collection = st.session_state.get("mongo_collection_input")
-        mongo_store = create_mongo_store(mongo_uri, mongo_db, mongo_collection)
-        mongo_store.clear_collection()
-        upsert_texts_to_mongo(mongo_store, all_chunks, all_metadatas)
-        st.session_state.vectorstore = {"type": "mongo", "store": mongo_store}
-        st.success(f"Uploaded {len(all_chunks)} chunks to MongoDB.")
+        store = open_mongo_collection(mongo_uri, mongo_db, mongo_collection)
+        st.session_state.vectorstore = {"type": "mongo", "store": store}
+
+    progress = st.progress(0.0, text="Processing documents...")
+
+    def report_progress(chunks_done, files_done, files_total):
+        progress.progress(files_done / files_total, text=f"Indexed {chunks_done} new chunks ({files_done}/{files_total} files)")
+
+    # Collections are shared by every session: an upload adds or updates its files and leaves
+    # the other documents alone; removing one is the explicit `delete_documents`
+    try:
+        stats = ingest_files(uploaded_files, store, progress_callback=report_progress, remove_missing=False)
+    except CollectionConflict as e:
+        st.error(str(e))
+        return
+    finally:
+        progress.empty()
+    _report(stats)
+
+def _process_with_service(uploaded_files):
+    # The service owns the stores; the session only remembers which collection to query
+    store_type = st.session_state.store_type
+    collection = st.session_state.get(f"{store_type}_collection_input") or None
+    try:
+        stats = ingest(uploaded_files, store_type, collection)
+    except ServiceBusy as e:
+        st.warning(str(e))
+        return
+    except (httpx.HTTPError, RuntimeError) as e:
+        st.error(f"Could not process the documents: {e}")
+        return
+    st.session_state.vectorstore = {"type": store_type, "collection": collection}
+    _report(stats)
+
+def delete_documents(store, sources):
+    for source in sources:
+        store.delete_source(source)
+    store.flush_index()
 
+def _report(stats):
+    removed = f", {stats['files_removed']} removed" if stats.get("files_removed") else ""
+    st.success(
+        f"Added {stats['chunks_added']} chunks from {stats['files_processed']} new or changed file(s); "
+        f"{stats['files_skipped']} unchanged{removed}."
+    )
     st.balloons()
@@ -0,0 +1,82 @@
+import threading
+from typing import TYPE_CHECKING, List
+from langchain_core.embeddings import Embeddings
+from app.embedding_cache import EmbeddingCache, get_embedding_cache
+
+if TYPE_CHECKING:
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+EMBEDDING_MODEL = "sentence-transformers/all-mpnet-base-v2"
+
+# Process-wide registry: one loaded model per name, shared by every session and store
+_models = {}
+_embeddings = {}
+_lock = threading.Lock()
+
+
+def _load_model(model_name: str) -> "HuggingFaceEmbeddings":
+    model = _models.get(model_name)
+    if model is None:
+        with _lock:
+            model = _models.get(model_name)
+            if model is None:
+                # sentence-transformers (and torch) are imported here, when a model is first needed
+                from langchain_community.embeddings import HuggingFaceEmbeddings
+                model = HuggingFaceEmbeddings(model_name=model_name)
+                _models[model_name] = model
+    return model
+
+
+def load_model(model_name: str = EMBEDDING_MODEL):
+    """Load `model_name` into the registry now, e.g. before a deadline-bound stage needs it."""
+    _load_model(model_name)
+
+
+def is_model_loaded(model_name: str = EMBEDDING_MODEL) -> bool:
+    return model_name in _models
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings that consult the on-disk cache first and only run the model on misses.
+    The model itself is loaded on the first miss, so a fully cached corpus never loads it.
+    """
+
+    def __init__(self, model_name: str, cache: EmbeddingCache = None):
+        self.model_name = model_name
+        self.cache = cache
+
+    @property
+    def model(self) -> "HuggingFaceEmbeddings":
+        return _load_model(self.model_name)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.cache is None:
+            return self.model.embed_documents(texts)
+        vectors = self.cache.get_many(self.model_name, texts)
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            # Embed each distinct missing text once
+            missing_texts = list(dict.fromkeys(texts[i] for i in missing))
+            computed = dict(zip(missing_texts, self.model.embed_documents(missing_texts)))
+            self.cache.put_many(self.model_name, missing_texts, [computed[t] for t in missing_texts])
+            for i in missing:
+                vectors[i] = computed[texts[i]]
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        # HuggingFaceEmbeddings embeds queries and documents the same way, so they share entries
+        return self.embed_documents([text])[0]
+
+
+def get_embeddings(model_name: str = EMBEDDING_MODEL) -> CachedEmbeddings:
+    """Return the shared embeddings object for `model_name`; the model loads on first use."""
+    embeddings = _embeddings.get(model_name)
+    if embeddings is None:
+        cache = get_embedding_cache()
+        with _lock:
+            embeddings = _embeddings.get(model_name)
+            if embeddings is None:
+                embeddings = CachedEmbeddings(model_name, cache)
+                _embeddings[model_name] = embeddings
+    return embeddings
@@ -0,0 +1,25 @@
+from typing import Any, Dict
+from app.embedding_cache import get_embedding_cache
+from app.reranker import get_reranker
+from app.search_utils import get_search_client
+from app.semantic_cache import answer_cache
+from app.tracing import stage_latencies
+
+
+def collect_stats() -> Dict[str, Any]:
+    """
+    Cache, re-ranker and stage latency figures of this process, as shown in the UI
+    sidebar and served by the API. Only light modules are imported, so the figures
+    can be shown before any model or store is loaded.
+    """
+    stats = {"answer_cache": answer_cache.stats(), "stages": stage_latencies()}
+    embedding_cache = get_embedding_cache()
+    if embedding_cache is not None:
+        stats["embedding_cache"] = embedding_cache.stats()
+    search_cache = get_search_client().cache
+    if search_cache is not None:
+        stats["search_cache"] = search_cache.stats()
+    reranker = get_reranker()
+    if reranker is not None:
+        stats["reranker"] = {**reranker.stats(), "budget": reranker.budget}
+    return stats
@@ -0,0 +1,488 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import List, Dict, Any
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from app.ann_index import PQIndex, SQ8Index
+from app.chunking import CHUNKING, chunk_id
+from app.embeddings import EMBEDDING_MODEL, get_embeddings
+from app.lexical_index import HYBRID_CANDIDATE_FACTOR, LexicalIndex, reciprocal_rank_fusion
+from app.vector_codec import RERANK_FACTOR, VECTOR_ENCODING, VECTOR_RERANK
+from app.vectorstore_utils import CollectionConflict
+
+try:
+    import fcntl
+except ImportError:  # Windows: saves still check the generation, without serializing the check
+    fcntl = None
+
+MANIFEST_FILE = "manifest.json"
+LEXICAL_FILE = "lexical"
+FULL_PRECISION_FILE = "full.faiss"
+# Names the generation directory holding the collection's current files
+CURRENT_FILE = "CURRENT"
+GENERATION_PREFIX = "gen-"
+# Held while a save compares and switches CURRENT, so two processes cannot both switch from one generation
+LOCK_FILE = "LOCK"
+DATA_FILES = ("index.faiss", "index.pkl", LEXICAL_FILE + ".npz", FULL_PRECISION_FILE, MANIFEST_FILE)
+# Vectors collected before a new collection's quantizer is trained, per encoding; encodings
+# not listed need no training sample
+QUANTIZER_TRAIN_SIZE = {"int8": SQ8Index.TRAIN_SIZE, "pq": PQIndex.MIN_TRAIN}
+
+logger = logging.getLogger(__name__)
+
+
+def _new_faiss_index(vectors: np.ndarray, encoding: str):
+    """
+    L2 index holding `encoding` codes: "float32" (flat), "float16"/"int8" (scalar quantization)
+    or "pq". Quantizers are trained on `vectors`, the store's first QUANTIZER_TRAIN_SIZE vectors
+    (or all of them, if it is read or saved before it has that many); "pq" needs PQIndex.MIN_TRAIN
+    of them and uses int8 otherwise.
+    """
+    dim = vectors.shape[1]
+    m = dim // PQIndex.SUBVECTOR_DIM
+    if encoding == "float32":
+        return faiss.IndexFlatL2(dim)
+    if encoding == "float16":
+        index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16)
+    elif encoding == "pq" and len(vectors) >= PQIndex.MIN_TRAIN and m and dim % m == 0:
+        index = faiss.IndexPQ(dim, m, 8)
+    elif encoding in ("int8", "pq"):
+        if encoding == "pq":
+            logger.warning("PQ needs %d training vectors, got %d: the collection stores int8 codes instead",
+                           PQIndex.MIN_TRAIN, len(vectors))
+        elif len(vectors) < QUANTIZER_TRAIN_SIZE["int8"]:
+            logger.info("int8 ranges trained on %d vectors", len(vectors))
+        index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit)
+    else:
+        raise ValueError(f"Unknown vector encoding '{encoding}'. Choose one of: float32, float16, int8, pq")
+    index.train(vectors)
+    return index
+
+
+def _generation_name(path: str):
+    # None for a collection never saved, or saved before generations were introduced
+    try:
+        with open(os.path.join(path, CURRENT_FILE)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def _current_stamp(path: str):
+    # Changes whenever CURRENT is replaced; a stat is much cheaper than reading the file
+    try:
+        stat = os.stat(os.path.join(path, CURRENT_FILE))
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def _generation_dir(path: str, generation) -> str:
+    # Collections saved before generations were introduced keep their files directly in `path`
+    return os.path.join(path, generation) if generation else path
+
+
+@contextmanager
+def _save_lock(path: str):
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(path, LOCK_FILE), "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _remove_old_generations(path: str, keep: set):
+    # The previous generation is kept for readers in other processes that resolved CURRENT just before
+    # the switch; older ones, half-written ones from an interrupted save and pre-generation files go
+    for entry in os.listdir(path):
+        if entry.startswith(GENERATION_PREFIX) and entry not in keep:
+            shutil.rmtree(os.path.join(path, entry), ignore_errors=True)
+        elif entry in DATA_FILES:
+            os.remove(os.path.join(path, entry))
+
+
+class FaissVectorStore:
+    """
+    FAISS store with the same ingestion/retrieval interface as MongoVectorStore.
+    Chunks are keyed by content hash, so re-ingesting unchanged text is a no-op.
+
+    With a `path` the store is a named on-disk collection: `index.faiss` and
+    `index.pkl` (the LangChain docstore) plus `manifest.json` recording the
+    embedding model, chunking parameters and per-file hashes, and `lexical.npz`
+    (the BM25 index used for hybrid retrieval). Each save writes these into a
+    new generation directory and then points `CURRENT` at it with an atomic
+    rename, so a crash mid-save leaves the previous generation in place.
+    Other processes (bulk ingestion, a second worker) may save the same
+    collection: a copy without unsaved changes reloads when CURRENT moves on,
+    and a save from a copy that has fallen behind raises CollectionConflict
+    rather than overwrite the newer generation.
+
+    `vector_encoding` picks the FAISS index built for a new collection; a loaded
+    collection keeps the index type it was saved with. With `rerank` a quantized
+    collection also keeps a flat float32 index (`full.faiss`, same row order) used
+    to re-score the top candidates.
+    """
+
+    def __init__(self, embedding_model_name: str = EMBEDDING_MODEL, path: str = None,
+                 vector_encoding: str = VECTOR_ENCODING, rerank: bool = VECTOR_RERANK):
+        self.embedding_model_name = embedding_model_name
+        self.path = path
+        self.vector_encoding = vector_encoding
+        self.rerank = rerank
+        self.store: FAISS = None
+        self._full = None  # float32 copies for re-ranking, row-aligned with self.store.index
+        # (text_embeddings, metadatas, ids) batches held until the quantizer has a training sample
+        self._untrained = []
+        self.ids = set()
+        self.lexical = LexicalIndex()
+        # source name -> {"hash": file content hash, "chunk_ids": [...]}
+        self.files: Dict[str, Dict[str, Any]] = {}
+        # Generation counter: bumped on every change to the indexed chunks
+        self.version = 0
+        # Generation directory this copy was loaded from or last saved to
+        self.generation = None
+        self._stamp = None  # _current_stamp when `generation` was last checked
+        # (version, chunk id -> index row), built on demand for hybrid hits the dense search missed
+        self._row_lookup = None
+        self.name = path or f"memory-{uuid.uuid4().hex[:8]}"
+        self._dirty = False
+        # Sessions share one store per collection: writes and searches must not interleave
+        self._lock = threading.RLock()
+
+    @classmethod
+    def load(cls, path: str):
+        """Open the collection saved at `path`, or return None if there is none."""
+        stamp = _current_stamp(path)
+        generation = _generation_name(path)
+        data_dir = _generation_dir(path, generation)
+        manifest_path = os.path.join(data_dir, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        # Collections saved before encodings were selectable use a flat float32 index
+        store = cls(embedding_model_name=manifest["embedding_model"], path=path,
+                    vector_encoding=manifest.get("vector_encoding", "float32"), rerank=manifest.get("rerank", False))
+        store.files = manifest.get("files", {})
+        store.generation, store._stamp = generation, stamp
+        store.version = manifest.get("version", 0)
+        if manifest.get("chunking") != CHUNKING:
+            # Chunking changed since this collection was built: force every file to be re-chunked
+            # (its old chunks are replaced as each file is re-ingested)
+            for entry in store.files.values():
+                entry["hash"] = None
+        if os.path.exists(os.path.join(data_dir, "index.faiss")):
+            # The docstore pickle was written by this app, so deserializing it is safe
+            store.store = FAISS.load_local(data_dir, store.embedder, allow_dangerous_deserialization=True)
+            store.ids = set(store.store.index_to_docstore_id.values())
+            if os.path.exists(os.path.join(data_dir, FULL_PRECISION_FILE)):
+                store._full = faiss.read_index(os.path.join(data_dir, FULL_PRECISION_FILE))
+            lexical = LexicalIndex.load(os.path.join(data_dir, LEXICAL_FILE))
+            if lexical is None or lexical.version != store.version:
+                # Collections saved before hybrid retrieval: index the stored chunk texts once
+                lexical = LexicalIndex()
+                ids = list(store.ids)
+                lexical.add(ids, [store.store.docstore.search(doc_id).page_content for doc_id in ids])
+                store._dirty = True
+            store.lexical = lexical
+        return store
+
+    def refresh(self):
+        """Reload the collection if another process saved it since, unless this copy has unsaved changes."""
+        if self.path is None:
+            return
+        with self._lock:
+            stamp = _current_stamp(self.path)
+            if self._dirty or stamp == self._stamp:
+                return
+            if _generation_name(self.path) == self.generation:
+                self._stamp = stamp
+                return
+            fresh = type(self).load(self.path)
+            if fresh is not None:
+                fresh._lock = self._lock
+                self.__dict__.update(fresh.__dict__)
+
+    def save(self):
+        self._index_untrained()
+        if self.path is None:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        with _save_lock(self.path):
+            self._save_generation()
+
+    def _save_generation(self):
+        previous = _generation_name(self.path)
+        if previous != self.generation:
+            # Writing now would drop whatever the other process saved: drop this copy's changes instead
+            self._dirty = False
+            self.refresh()
+            raise CollectionConflict(f"{self.path} was saved by another process while it was being changed here; "
+                                     "the changes were not saved, run the ingestion again")
+        generation = f"{GENERATION_PREFIX}{self.version}-{uuid.uuid4().hex[:8]}"
+        data_dir = os.path.join(self.path, generation)
+        os.makedirs(data_dir)
+        if self.store is not None and self.ids:
+            self.store.save_local(data_dir)
+            if self._full is not None:
+                faiss.write_index(self._full, os.path.join(data_dir, FULL_PRECISION_FILE))
+            self.lexical.version = self.version
+            self.lexical.save(os.path.join(data_dir, LEXICAL_FILE))
+        manifest = {
+            "embedding_model": self.embedding_model_name,
+            "chunking": CHUNKING,
+            "vector_encoding": self.vector_encoding,
+            "rerank": self.rerank,
+            "files": self.files,
+            "version": self.version,
+        }
+        with open(os.path.join(data_dir, MANIFEST_FILE), "w") as f:
+            json.dump(manifest, f)
+        # The switch to the new generation is this one rename; until then readers see the previous one
+        tmp = os.path.join(self.path, CURRENT_FILE + ".tmp")
+        with open(tmp, "w") as f:
+            f.write(generation)
+        os.replace(tmp, os.path.join(self.path, CURRENT_FILE))
+        self.generation, self._stamp = generation, _current_stamp(self.path)
+        _remove_old_generations(self.path, keep={generation, previous})
+
+    @property
+    def embedder(self):
+        return get_embeddings(self.embedding_model_name)
+
+    def __len__(self):
+        self.refresh()
+        return len(self.ids)
+
+    def _touch(self):
+        self.version += 1
+        self._dirty = True
+
+    def clear_collection(self):
+        with self._lock:
+            self.refresh()
+            self.store = None
+            self._full = None
+            self._untrained = []
+            self.ids = set()
+            self.lexical = LexicalIndex()
+            self.files = {}
+            self._touch()
+            self.flush_index()
+
+    def upsert_texts(self, texts: List[str], metadatas: List[Dict[str, Any]] = None):
+        """Compute embeddings and add documents. Chunks already stored (same content hash) are skipped."""
+        metadatas = metadatas or [{} for _ in texts]
+        ids = [chunk_id(m.get("source", ""), t) for t, m in zip(texts, metadatas)]
+        new = [i for i, doc_id in enumerate(ids) if doc_id not in self.ids]
+        texts, metadatas, ids = [texts[i] for i in new], [metadatas[i] for i in new], [ids[i] for i in new]
+        embeddings = self.embedder.embed_documents(texts) if texts else []
+        added = self.add_embeddings(texts, embeddings, metadatas, ids)
+        self.flush_index()
+        return added
+
+    def add_embeddings(self, texts: List[str], embeddings: List[List[float]], metadatas: List[Dict[str, Any]] = None,
+                       ids: List[str] = None):
+        """
+        Add pre-computed embeddings. A new quantized collection holds them until it has
+        QUANTIZER_TRAIN_SIZE vectors to train its index on, or until it is read or saved.
+        """
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [chunk_id(m.get("source", ""), t) for t, m in zip(texts, metadatas)]
+        with self._lock:
+            self.refresh()
+            keep, batch = [], set()
+            for i, doc_id in enumerate(ids):
+                if doc_id not in self.ids and doc_id not in batch:
+                    batch.add(doc_id)
+                    keep.append(i)
+            if not keep:
+                return 0
+            text_embeddings = [(texts[i], embeddings[i]) for i in keep]
+            metadatas = [metadatas[i] for i in keep]
+            ids = [ids[i] for i in keep]
+            self._untrained.append((text_embeddings, metadatas, ids))
+            if self.store is not None or len(self.ids) + len(ids) >= QUANTIZER_TRAIN_SIZE.get(self.vector_encoding, 0):
+                self._index_untrained()
+            self.ids.update(ids)
+            self.lexical.add(ids, [text for text, _ in text_embeddings])
+            self._touch()
+        return len(ids)
+
+    def _index_untrained(self):
+        # Add the held batches, creating (and training) the FAISS index on all of them if there is none yet
+        if not self._untrained:
+            return
+        text_embeddings = [pair for batch, _, _ in self._untrained for pair in batch]
+        metadatas = [metadata for _, batch, _ in self._untrained for metadata in batch]
+        ids = [doc_id for _, _, batch in self._untrained for doc_id in batch]
+        self._untrained = []
+        vectors = np.array([emb for _, emb in text_embeddings], dtype=np.float32)
+        if self.store is None:
+            self.store = FAISS(
+                embedding_function=self.embedder,
+                index=_new_faiss_index(vectors, self.vector_encoding),
+                docstore=InMemoryDocstore(),
+                index_to_docstore_id={},
+            )
+            if self.rerank and self.vector_encoding != "float32":
+                self._full = faiss.IndexFlatL2(vectors.shape[1])
+        self.store.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+        if self._full is not None:
+            self._full.add(vectors)
+
+    def existing_ids(self, ids: List[str]) -> set:
+        self.refresh()
+        return {doc_id for doc_id in ids if doc_id in self.ids}
+
+    def delete(self, ids: List[str]):
+        with self._lock:
+            self.refresh()
+            ids = [doc_id for doc_id in set(ids) if doc_id in self.ids]
+            if ids:
+                self._index_untrained()
+                if self._full is not None:
+                    # Both indexes compact in row order on removal, so they stay aligned
+                    doomed = set(ids)
+                    rows = [row for row, doc_id in self.store.index_to_docstore_id.items() if doc_id in doomed]
+                    self._full.remove_ids(np.array(rows, dtype=np.int64))
+                self.store.delete(ids)
+                self.ids.difference_update(ids)
+                self.lexical.remove(ids)
+                self._touch()
+        return len(ids)
+
+    def file_hashes(self) -> Dict[str, str]:
+        """Content hash of every ingested file, keyed by source name."""
+        self.refresh()
+        return {source: f["hash"] for source, f in self.files.items()}
+
+    def finish_file(self, source: str, file_hash: str, chunk_ids: List[str], page_starts: List[int] = None,
+                    kept: Dict[str, dict] = None):
+        """
+        Record `source` as ingested at `file_hash` and drop its chunks that are no longer produced.
+        `page_starts` (see chunking.ChunkedFile) is kept to map chunk offsets back to pages, and
+        `kept` maps chunks that were already stored to their metadata in the new version of the file.
+        """
+        with self._lock:
+            self.refresh()
+            previous = self.files.get(source, {}).get("chunk_ids", [])
+            self.delete(set(previous) - set(chunk_ids))
+            if kept:
+                self._index_untrained()
+                moved = 0
+                for doc_id, metadata in kept.items():
+                    doc = self.store.docstore.search(doc_id) if doc_id in self.ids else None
+                    if doc is not None and doc.metadata != metadata:
+                        doc.metadata = metadata
+                        moved += 1
+                if moved:
+                    self._touch()  # citations changed: answers cached against the old pages are stale
+            self.files[source] = {"hash": file_hash, "chunk_ids": list(chunk_ids), "page_starts": page_starts or []}
+            self._dirty = True
+
+    def delete_source(self, source: str):
+        with self._lock:
+            self.refresh()
+            self.delete(self.files.pop(source, {}).get("chunk_ids", []))
+            self._dirty = True
+
+    def flush_index(self):
+        """Persist the collection if it changed since it was last saved (no-op without a path)."""
+        with self._lock:
+            if self._dirty:
+                self.save()
+                self._dirty = False
+
+    @property
+    def is_warm(self) -> bool:
+        return not self._untrained
+
+    def warm_up(self):
+        """Build the index from held vectors now, so the first search is not charged for it."""
+        with self._lock:
+            self._index_untrained()
+
+    def _cosine(self, rows, queries) -> np.ndarray:
+        # Cosine similarity of each index row to the query paired with it, from the float32 copies
+        # when they are kept; einsum keeps this to a few calls for a handful of rows
+        index = self._full if self._full is not None else self.store.index
+        vectors = index.reconstruct_batch(np.asarray(rows, dtype=np.int64))
+        queries = np.asarray(queries, dtype=np.float32)
+        norms = np.sqrt(np.einsum("ij,ij->i", vectors, vectors) * np.einsum("ij,ij->i", queries, queries))
+        return np.einsum("ij,ij->i", vectors, queries) / (norms + 1e-12)
+
+    def _row_of(self, doc_id: str) -> int:
+        if self._row_lookup is None or self._row_lookup[0] != self.version:
+            self._row_lookup = (self.version, {d: row for row, d in self.store.index_to_docstore_id.items()})
+        return self._row_lookup[1][doc_id]
+
+    def _dense_search(self, query_embs, k: int):
+        # One batched FAISS search returning (chunk id, cosine similarity) lists, most similar first.
+        # The L2 search picks the candidates (more of them when float32 copies can re-score them)
+        query_embs = np.array(query_embs, dtype=np.float32)
+        n_candidates = k * RERANK_FACTOR if self._full is not None else k
+        _, rows = self.store.index.search(query_embs, n_candidates)
+        # Every query's candidates are scored in one pass
+        found = rows != -1
+        sims = np.full(rows.shape, -np.inf, dtype=np.float32)
+        sims[found] = self._cosine(rows[found], query_embs[np.nonzero(found)[0]])
+        mapping = self.store.index_to_docstore_id
+        return [[(mapping[int(row_ids[i])], float(row_sims[i])) for i in np.argsort(-row_sims)[:k] if row_found[i]]
+                for row_ids, row_sims, row_found in zip(rows, sims, found)]
+
+    def retrieve(self, query: str, k: int = 3, hybrid: bool = False, query_embedding: List[float] = None):
+        """
+        Return top-k documents (text, metadata, chunk id) relevant to query. `score` is the cosine
+        similarity to the query (higher is better), as in MongoVectorStore. With `hybrid` the vector and
+        BM25 rankings are fused, and the reciprocal-rank-fusion score that orders them is `rrf_score`.
+        Pass `query_embedding` when the query has already been embedded.
+        """
+        return self.retrieve_many([query], k, hybrid, None if query_embedding is None else [query_embedding])[0]
+
+    def retrieve_many(self, queries: List[str], k: int = 3, hybrid: bool = False,
+                      query_embeddings: List[List[float]] = None):
+        """Batched `retrieve`: all queries are embedded together and searched in one FAISS call."""
+        self.refresh()
+        if not self.ids or not queries:
+            return [[] for _ in queries]
+        query_embs = query_embeddings if query_embeddings is not None else self.embedder.embed_documents(list(queries))
+        n_candidates = k * HYBRID_CANDIDATE_FACTOR if hybrid else k
+        with self._lock:
+            self._index_untrained()
+            results = []
+            for query, query_emb, dense in zip(queries, query_embs, self._dense_search(query_embs, n_candidates)):
+                similarity = dict(dense)
+                if not hybrid:
+                    hits = dense[:k]
+                else:
+                    hits = reciprocal_rank_fusion(dense, self.lexical.search(query, n_candidates))[:k]
+                    lexical_only = [doc_id for doc_id, _ in hits if doc_id not in similarity]
+                    if lexical_only:
+                        sims = self._cosine([self._row_of(doc_id) for doc_id in lexical_only],
+                                            np.tile(np.asarray(query_emb, dtype=np.float32), (len(lexical_only), 1)))
+                        similarity.update(zip(lexical_only, sims.tolist()))
+                docs = []
+                for doc_id, score in hits:
+                    doc = self.store.docstore.search(doc_id)
+                    docs.append({
+                        "text": doc.page_content,
+                        "metadata": doc.metadata,
+                        "score": float(similarity[doc_id]),
+                        "id": doc_id
+                    })
+                    if hybrid:
+                        docs[-1]["rrf_score"] = score
+                results.append(docs)
+        return results
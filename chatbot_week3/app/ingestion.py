@@ -0,0 +1,165 @@
+import queue
+import threading
+from typing import Callable, Dict, Iterator, List, NamedTuple, Tuple
+from app.chunking import chunk_file, chunk_id
+from app.pdf_utils import file_hash, iter_extracted_files
+
+# Chunks embedded and written per batch, and batches buffered between stages.
+# Together they cap how much of the corpus is held in memory at once.
+BATCH_SIZE = 64
+QUEUE_SIZE = 4
+
+_DONE = object()
+
+
+class _Failed:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def _threaded(iterator, maxsize: int = QUEUE_SIZE):
+    """
+    Run `iterator` in a background thread and yield its items through a bounded queue.
+    The producer blocks once `maxsize` items are waiting; exceptions are re-raised here.
+    """
+    items = queue.Queue(maxsize)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterator:
+                if not put(item):
+                    return
+            put(_DONE)
+        except Exception as exc:
+            put(_Failed(exc))
+        finally:
+            close = getattr(iterator, "close", None)
+            if close:
+                close()
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failed):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+
+
+class ChunkBatch(NamedTuple):
+    texts: List[str]
+    metadatas: List[dict]
+    ids: List[str]
+    # (source, file_hash, chunk_ids, page_starts, kept) of files whose chunks are all in this or earlier
+    # batches; `kept` maps the ids of chunks that were already stored to their new metadata
+    finished: List[Tuple[str, str, List[str], List[int], Dict[str, dict]]]
+    files_done: int
+
+
+def iter_chunk_batches(files, file_hashes: List[str], existing_ids: Callable[[List[str]], set] = None,
+                       batch_size: int = BATCH_SIZE, max_workers: int = None) -> Iterator[ChunkBatch]:
+    """
+    Yield batches of at most `batch_size` new chunks as files finish extracting.
+    Chunks whose content-hash id is already stored (per `existing_ids`) are left out,
+    so only new or changed text reaches the embedding stage; their current metadata
+    (pages and offsets may have moved) travels with the file's `finished` entry.
+    """
+    texts, metadatas, ids, finished = [], [], [], []
+    files_done = 0
+    for file_idx, name, pages in iter_extracted_files(files, max_workers=max_workers):
+        files_done += 1
+        chunks, chunk_metadatas, page_starts = chunk_file(name, pages)
+        chunk_ids = [chunk_id(name, chunk) for chunk in chunks]
+        stored = existing_ids(chunk_ids) if existing_ids else set()
+        known, kept = set(stored), {}
+        for doc_id, chunk, metadata in zip(chunk_ids, chunks, chunk_metadatas):
+            if doc_id in known:
+                if doc_id in stored:
+                    kept.setdefault(doc_id, metadata)
+                continue
+            known.add(doc_id)
+            texts.append(chunk)
+            metadatas.append(metadata)
+            ids.append(doc_id)
+            if len(texts) == batch_size:
+                yield ChunkBatch(texts, metadatas, ids, finished, files_done)
+                texts, metadatas, ids, finished = [], [], [], []
+        finished.append((name, file_hashes[file_idx], chunk_ids, page_starts, kept))
+    if texts or finished:
+        yield ChunkBatch(texts, metadatas, ids, finished, files_done)
+
+
+def iter_embedded_batches(batches, embedder):
+    """Embed each batch with one forward pass."""
+    for batch in batches:
+        yield batch, embedder.embed_documents(batch.texts) if batch.texts else []
+
+
+def ingest_files(files, store, batch_size: int = BATCH_SIZE, queue_size: int = QUEUE_SIZE,
+                 progress_callback: Callable[[int, int, int], None] = None, max_workers: int = None,
+                 remove_missing: bool = True, flush: bool = True) -> Dict[str, int]:
+    """
+    Incrementally sync `store` (FaissVectorStore or MongoVectorStore) with `files`.
+
+    Files whose content hash matches the last ingestion are skipped, files that are no
+    longer present have their vectors deleted, and changed files only embed chunks that
+    are new; their stale chunks are removed once the file is fully written.
+
+    The remaining files stream through extract -> chunk -> embed -> store: extraction/chunking
+    and embedding each run in their own thread, connected by bounded queues, while batches
+    are written on the calling thread as soon as they are ready. Earlier batches are
+    therefore searchable while later files are still being processed, and memory stays
+    flat regardless of corpus size.
+
+    Args:
+        files (list): Uploaded file objects.
+        store: Vector store to update.
+        progress_callback (callable): Called after each write as (chunks_written, files_done, files_total).
+        remove_missing (bool): Delete ingested sources absent from `files`; off when `files` is one
+            slice of a larger set, as in bulk ingestion.
+        flush (bool): Persist the store at the end; off when the caller decides when to save.
+
+    Returns:
+        dict: Counts of files skipped/removed/processed and chunks added.
+    """
+    known = store.file_hashes()
+    names = {f.name for f in files}
+    removed = [source for source in known if source not in names] if remove_missing else []
+    for source in removed:
+        store.delete_source(source)
+
+    hashes = [file_hash(f) for f in files]
+    changed = [(f, h) for f, h in zip(files, hashes) if known.get(f.name) != h]
+    stats = {"files_skipped": len(files) - len(changed), "files_removed": len(removed),
+             "files_processed": len(changed), "chunks_added": 0}
+    if not changed:
+        return stats
+
+    changed_files = [f for f, _ in changed]
+    batches = _threaded(iter_chunk_batches(changed_files, [h for _, h in changed], store.existing_ids,
+                                           batch_size, max_workers), queue_size)
+    embedded = _threaded(iter_embedded_batches(batches, store.embedder), queue_size)
+    for batch, embeddings in embedded:
+        if batch.texts:
+            stats["chunks_added"] += store.add_embeddings(batch.texts, embeddings, batch.metadatas, batch.ids)
+        for source, source_hash, chunk_ids, page_starts, kept in batch.finished:
+            store.finish_file(source, source_hash, chunk_ids, page_starts, kept)
+        if progress_callback:
+            progress_callback(stats["chunks_added"], batch.files_done, len(changed_files))
+    if flush:
+        store.flush_index()
+    return stats
@@ -0,0 +1,152 @@
+import os
+import re
+import threading
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Sequence, Tuple
+import numpy as np
+
+# Candidates fetched from each retriever per requested result before fusion
+HYBRID_CANDIDATE_FACTOR = 4
+RRF_K = 60
+
+# Keep identifiers such as "AB-1234", "4.2.1" or "clause_7b" as single tokens
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over chunks, built incrementally as chunks are added.
+
+    Each term's postings are two compact `array`s (row numbers and term
+    frequencies) that are appended to in place and read as numpy views at
+    query time, so scoring a query is a handful of vectorized gathers and
+    scatter-adds over the rows that contain its terms. Deletes are tombstones.
+    """
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        self.ids: List[str] = []
+        self.dead_rows = set()
+        self.version = None
+        self._rows: Dict[str, List[int]] = {}
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._doc_lens = array("I")
+        self._length_norm = None  # cached K1 * (1 - B + B * len / avg_len), reset on add
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids) - len(self.dead_rows)
+
+    def add(self, ids: Sequence[str], texts: Iterable[str]):
+        with self._lock:
+            for doc_id, text in zip(ids, texts):
+                row = len(self.ids)
+                counts = Counter(tokenize(text))
+                for term, tf in counts.items():
+                    postings = self._postings.get(term)
+                    if postings is None:
+                        postings = self._postings[term] = (array("I"), array("H"))
+                    postings[0].append(row)
+                    postings[1].append(min(tf, 65535))
+                self._doc_lens.append(sum(counts.values()))
+                self._rows.setdefault(str(doc_id), []).append(row)
+                self.ids.append(str(doc_id))
+            self._length_norm = None
+
+    def remove(self, ids: Sequence[str]):
+        with self._lock:
+            for doc_id in ids:
+                self.dead_rows.update(self._rows.pop(str(doc_id), []))
+
+    def _norm(self) -> np.ndarray:
+        if self._length_norm is None:
+            lens = np.frombuffer(self._doc_lens, dtype=np.uint32).astype(np.float32)
+            avg_len = max(float(lens.mean()), 1.0) if len(lens) else 1.0
+            self._length_norm = self.K1 * (1 - self.B + self.B * lens / avg_len)
+        return self._length_norm
+
+    def search(self, query: str, k: int = 3) -> List[Tuple[str, float]]:
+        """Return up to k (id, BM25 score) pairs for chunks sharing terms with `query`, best first."""
+        with self._lock:
+            n = len(self.ids)
+            if not len(self):
+                return []
+            norm = self._norm()
+            scores = np.zeros(n, dtype=np.float32)
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if postings is None:
+                    continue
+                rows = np.frombuffer(postings[0], dtype=np.uint32)
+                tfs = np.frombuffer(postings[1], dtype=np.uint16).astype(np.float32)
+                idf = np.log1p((n - len(rows) + 0.5) / (len(rows) + 0.5))
+                # A term appears at most once per row, so plain fancy-index add is safe
+                scores[rows] += idf * tfs * (self.K1 + 1) / (tfs + norm[rows])
+            if self.dead_rows:
+                scores[list(self.dead_rows)] = 0
+            candidates = np.flatnonzero(scores)
+            if not len(candidates):
+                return []
+            k = min(k, len(candidates))
+            top = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+            top = top[np.argsort(-scores[top])]
+            return [(self.ids[i], float(scores[i])) for i in top]
+
+    def save(self, path: str):
+        with self._lock:
+            terms = list(self._postings)
+            offsets = np.cumsum([0] + [len(self._postings[t][0]) for t in terms])
+            rows = [np.frombuffer(self._postings[t][0], dtype=np.uint32) for t in terms]
+            tfs = [np.frombuffer(self._postings[t][1], dtype=np.uint16) for t in terms]
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            tmp = path + ".npz.tmp"
+            with open(tmp, "wb") as f:
+                np.savez(
+                    f,
+                    terms=np.array(terms, dtype=str),
+                    offsets=offsets,
+                    rows=np.concatenate(rows) if rows else np.empty(0, dtype=np.uint32),
+                    tfs=np.concatenate(tfs) if tfs else np.empty(0, dtype=np.uint16),
+                    doc_lens=np.frombuffer(self._doc_lens, dtype=np.uint32),
+                    ids=np.array(self.ids, dtype=str),
+                    dead_rows=np.array(sorted(self.dead_rows), dtype=np.int64),
+                    version=np.array(-1 if self.version is None else self.version),
+                )
+            os.replace(tmp, path + ".npz")
+
+    @classmethod
+    def load(cls, path: str):
+        """Load an index saved with `save`, or return None if it does not exist."""
+        if not os.path.exists(path + ".npz"):
+            return None
+        data = np.load(path + ".npz")
+        index = cls()
+        offsets, rows, tfs = data["offsets"], data["rows"], data["tfs"]
+        for i, term in enumerate(data["terms"].tolist()):
+            start, end = offsets[i], offsets[i + 1]
+            index._postings[term] = (array("I", rows[start:end].tobytes()), array("H", tfs[start:end].tobytes()))
+        index._doc_lens = array("I", data["doc_lens"].astype(np.uint32).tobytes())
+        index.ids = data["ids"].tolist()
+        for row, doc_id in enumerate(index.ids):
+            index._rows.setdefault(doc_id, []).append(row)
+        index.dead_rows = set(data["dead_rows"].tolist())
+        for row in index.dead_rows:
+            index._rows[index.ids[row]].remove(row)
+        version = int(data["version"])
+        index.version = None if version < 0 else version
+        return index
+
+
+def reciprocal_rank_fusion(*rankings: List[Tuple[str, float]], k: int = RRF_K) -> List[Tuple[str, float]]:
+    """Fuse ranked (id, score) lists by summing 1 / (k + rank); raw scores are ignored."""
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, (doc_id, _) in enumerate(ranking):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda item: -item[1])
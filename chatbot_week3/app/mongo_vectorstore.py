@@ -1,63 +1,404 @@
 from typing import List, Dict, Any
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument, UpdateOne
+from bson import ObjectId
 import numpy as np
-import os
+from app.ann_index import DEFAULT_INDEX_KIND, QUERY_BLOCK, AnnIndex, create_ann_index, index_path
+from app.chunking import CHUNKING, chunk_id
+from app.embeddings import EMBEDDING_MODEL, get_embeddings
+from app.lexical_index import HYBRID_CANDIDATE_FACTOR, LexicalIndex, reciprocal_rank_fusion
+from app.vector_codec import (RERANK_FACTOR, VECTOR_ENCODING, VECTOR_RERANK, decode_vectors, encode_vector,
+                              normalize_rows, storage_encoding)
+
+
+# Stored with the document count; counts without it (or an older format) are recomputed once
+COUNT_FORMAT = 2
+
+
+def _to_mongo_id(doc_id: str):
+    # Documents inserted before content-hash ids were introduced still use ObjectIds
+    return ObjectId(doc_id) if ObjectId.is_valid(doc_id) and len(doc_id) == 24 else doc_id
 
 
 class MongoVectorStore:
-    def __init__(self, uri: str, db_name: str, collection_name: str, embedding_model_name: str = "sentence-transformers/all-mpnet-base-v2"):
+    def __init__(self, uri: str, db_name: str, collection_name: str, embedding_model_name: str = EMBEDDING_MODEL,
+                 index_kind: str = DEFAULT_INDEX_KIND, vector_encoding: str = VECTOR_ENCODING,
+                 rerank: bool = VECTOR_RERANK):
         self.client = MongoClient(uri)
         self.db = self.client[db_name]
         self.collection = self.db[collection_name]
-        self.embedder = HuggingFaceEmbeddings(model_name=embedding_model_name)
+        # Single-document collection holding the version stamp used to keep local indexes in sync
+        self.meta = self.db[f"{collection_name}__meta"]
+        self.name = f"{db_name}.{collection_name}"
+        self.embedding_model_name = embedding_model_name
+        # Embeddings are stored as compact binary ("float32", "float16" or "int8"); with `rerank`
+        # a float32 copy is stored too and used to re-score the top candidates
+        self.vector_encoding = storage_encoding(vector_encoding)
+        self.rerank = rerank
+        # "hnsw"/"ivf" use an ANN index, "exact" a shared memory-mapped matrix;
+        # index_kind=None falls back to a full collection scan (and dense-only retrieval)
+        self.index_kind = index_kind
+        self.index_path = index_path(uri, db_name, collection_name, index_kind) if index_kind else None
+        self.index: AnnIndex = None
+        # BM25 index kept in step with the ANN index, for hybrid retrieval
+        self.lexical: LexicalIndex = None
+        self._index_dirty = False
+        self._count_checked = False
+        self._lookup_indexes = False
+
+    @property
+    def embedder(self):
+        # Resolved lazily from the shared registry so creating a store never loads a model
+        return get_embeddings(self.embedding_model_name)
+
+    def _version_doc(self):
+        doc = self.meta.find_one({"_id": "version"})
+        if doc is None or doc.get("count_format") != COUNT_FORMAT:
+            # Collections written before the document count was tracked, or whose count was
+            # doubled by a first write that counted after inserting: count once
+            doc = self.meta.find_one_and_update(
+                {"_id": "version"},
+                {"$set": {"count": self.collection.count_documents({}), "count_format": COUNT_FORMAT}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        self._count_checked = True
+        return doc
+
+    def collection_version(self) -> int:
+        """Generation counter, bumped on every write; a single indexed lookup."""
+        doc = self.meta.find_one({"_id": "version"})
+        return doc.get("value", 0) if doc else 0
+
+    @property
+    def version(self) -> int:
+        return self.collection_version()
+
+    def __len__(self):
+        # Maintained alongside the version stamp, so no collection scan or count
+        return self._version_doc()["count"]
+
+    def _bump_version(self, count_delta: int = 0, reset_count: bool = False) -> int:
+        update = {"$inc": {"value": 1}}
+        if reset_count:
+            update["$set"] = {"count": 0, "count_format": COUNT_FORMAT}
+        else:
+            update["$inc"]["count"] = count_delta
+        doc = self.meta.find_one_and_update(
+            {"_id": "version"},
+            update,
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return doc["value"]
+
+    def _ensure_lookup_indexes(self):
+        # Chunks are found by source when a file is re-ingested or deleted, and file records by
+        # kind; without these indexes each of those lookups scans the whole collection
+        if not self._lookup_indexes:
+            self.collection.create_index("metadata.source")
+            self.meta.create_index("kind")
+            self._lookup_indexes = True
+
+    def _index_version(self):
+        # Version of the in-memory index, making sure one is loaded when indexing is enabled.
+        # Called before every write, which is also when a legacy count must be taken: once the
+        # write has happened, counting would include its documents on top of the delta.
+        self._ensure_lookup_indexes()
+        if not self._count_checked:
+            self._version_doc()
+        if self.index_kind:
+            self._ensure_index()
+        return self.index.version if self.index is not None else None
+
+    def _sync_index(self, previous_version, version: int, update):
+        """Apply `update(index, lexical)` in place only if nobody else wrote since the indexes were built."""
+        if previous_version is not None and version == previous_version + 1:
+            update(self.index, self.lexical)
+            self.index.version = self.lexical.version = version
+            self._index_dirty = True
 
     def clear_collection(self):
         self.collection.delete_many({})
+        self.meta.delete_many({"kind": "file"})
+        version = self._bump_version(reset_count=True)
+        if self.index is not None:
+            self.index.reset()
+            self.lexical = LexicalIndex()
+            self.index.version = self.lexical.version = version
+            self.index.save(self.index_path)
+            self.lexical.save(self._lexical_path)
+            self._index_dirty = False
 
     def upsert_texts(self, texts: List[str], metadatas: List[Dict[str, Any]] = None):
-        """Compute embeddings and insert documents. Overwrites collection (append behavior is possible)."""
+        """Compute embeddings and insert documents. Chunks already stored (same content hash) are skipped."""
+        metadatas = metadatas or [{} for _ in texts]
+        ids = [chunk_id(m.get("source", ""), t) for t, m in zip(texts, metadatas)]
+        existing = self.existing_ids(ids)
+        new = [i for i, doc_id in enumerate(ids) if doc_id not in existing]
+        texts, metadatas, ids = [texts[i] for i in new], [metadatas[i] for i in new], [ids[i] for i in new]
+        embeddings = self.embedder.embed_documents(texts) if texts else []  # returns List[List[float]]
+        inserted = self.add_embeddings(texts, embeddings, metadatas, ids)
+        self.flush_index()
+        return inserted
+
+    def add_embeddings(self, texts: List[str], embeddings: List[List[float]], metadatas: List[Dict[str, Any]] = None,
+                       ids: List[str] = None):
+        """
+        Insert documents whose embeddings were computed elsewhere (e.g. by the ingestion pipeline).
+        `ids` are content hashes used as `_id`; ids that are already stored are skipped.
+        The local index is extended in memory; call `flush_index` once the batch run is over.
+        """
         metadatas = metadatas or [{} for _ in texts]
-        embeddings = self.embedder.embed_documents(texts)  # returns List[List[float]]
-        docs = []
+        ids = ids or [chunk_id(m.get("source", ""), t) for t, m in zip(texts, metadatas)]
+        existing = self.existing_ids(ids)
+        docs, new_texts, new_embeddings = [], [], []
         for i, text in enumerate(texts):
+            if ids[i] in existing:
+                continue
+            existing.add(ids[i])
             doc = {
+                "_id": ids[i],
                 "text": text,
                 "metadata": metadatas[i],
-                "embedding": embeddings[i]
+                "embedding": encode_vector(embeddings[i], self.vector_encoding)
             }
+            if self.rerank and self.vector_encoding != "float32":
+                doc["embedding_full"] = encode_vector(embeddings[i], "float32")
             docs.append(doc)
+            new_texts.append(text)
+            new_embeddings.append(embeddings[i])
         if docs:
-            self.collection.insert_many(docs)
+            previous_version = self._index_version()
+            inserted_ids = self.collection.insert_many(docs).inserted_ids
+            version = self._bump_version(len(inserted_ids))
+            self._sync_index(previous_version, version, lambda index, lexical: (
+                index.add(inserted_ids, new_embeddings), lexical.add(inserted_ids, new_texts)))
         return len(docs)
 
-    def _cosine_similarities(self, query_emb, embeddings_np):
-        # query_emb: (d,), embeddings_np: (n,d)
-        # return cosine similarities as (n,)
-        q = query_emb / (np.linalg.norm(query_emb) + 1e-12)
+    def existing_ids(self, ids: List[str]) -> set:
+        return {d["_id"] for d in self.collection.find({"_id": {"$in": list(ids)}}, {"_id": 1})}
+
+    def delete(self, ids: List[str]):
+        ids = list(ids)
+        if not ids:
+            return 0
+        previous_version = self._index_version()
+        deleted = self.collection.delete_many({"_id": {"$in": ids}}).deleted_count
+        version = self._bump_version(-deleted)
+        self._sync_index(previous_version, version, lambda index, lexical: (index.remove(ids), lexical.remove(ids)))
+        return deleted
+
+    def file_hashes(self) -> Dict[str, str]:
+        """
+        Content hash of every ingested file, keyed by source name. Files chunked with other
+        chunking parameters map to None, so they are re-chunked on the next ingestion.
+        """
+        return {d["source"]: d["hash"] if d.get("chunking") == CHUNKING else None
+                for d in self.meta.find({"kind": "file"})}
+
+    def finish_file(self, source: str, file_hash: str, chunk_ids: List[str], page_starts: List[int] = None,
+                    kept: Dict[str, dict] = None):
+        """
+        Record `source` as ingested at `file_hash` and drop its chunks that are no longer produced.
+        `page_starts` (see chunking.ChunkedFile) is kept to map chunk offsets back to pages, and
+        `kept` maps chunks that were already stored to their metadata in the new version of the file.
+        """
+        self._ensure_lookup_indexes()
+        stale = self.collection.find({"metadata.source": source, "_id": {"$nin": list(chunk_ids)}}, {"_id": 1})
+        self.delete([d["_id"] for d in stale])
+        if kept:
+            previous_version = self._index_version()
+            moved = self.collection.bulk_write([
+                UpdateOne({"_id": doc_id, "metadata": {"$ne": metadata}}, {"$set": {"metadata": metadata}})
+                for doc_id, metadata in kept.items()
+            ], ordered=False).modified_count
+            if moved:
+                # Citations changed: answers cached against the old pages are stale. The local
+                # indexes hold no metadata, so they only move to the new version
+                version = self._bump_version()
+                self._sync_index(previous_version, version, lambda index, lexical: None)
+        self.meta.replace_one(
+            {"_id": f"file:{source}"},
+            {"kind": "file", "source": source, "hash": file_hash, "chunking": CHUNKING,
+             "page_starts": page_starts or []},
+            upsert=True,
+        )
+
+    def delete_source(self, source: str):
+        self._ensure_lookup_indexes()
+        stale = self.collection.find({"metadata.source": source}, {"_id": 1})
+        self.delete([d["_id"] for d in stale])
+        self.meta.delete_one({"_id": f"file:{source}"})
+
+    @property
+    def _lexical_path(self):
+        return self.index_path + ".lexical"
+
+    def flush_index(self):
+        """Persist the local indexes if they changed since they were last saved."""
+        if self.index is not None and self._index_dirty:
+            self.index.save(self.index_path)
+            self.lexical.save(self._lexical_path)
+            self._index_dirty = False
+
+    def _ensure_index(self):
+        """Make sure the local ANN and BM25 indexes match the current collection version."""
+        version = self.collection_version()
+        if self.index is not None and self.index.version == version and not self.index.needs_rebuild:
+            return self.index
+        index = AnnIndex.load(self.index_path)
+        lexical = LexicalIndex.load(self._lexical_path)
+        if (index is None or index.version != version or index.needs_rebuild
+                or lexical is None or lexical.version != version):
+            index, lexical = self._build_index(version)
+        self.index, self.lexical = index, lexical
+        return index
+
+    @property
+    def is_warm(self) -> bool:
+        return not self.index_kind or self.index is not None
+
+    def warm_up(self):
+        """Load (or build) the local indexes now, so the first retrieval is not charged for it."""
+        if self.index_kind:
+            self._ensure_index()
+
+    def _build_index(self, version: int):
+        ids, texts, embeddings = [], [], []
+        for doc in self.collection.find({}, {"text": 1, "embedding": 1}):
+            ids.append(doc["_id"])
+            texts.append(doc["text"])
+            embeddings.append(doc["embedding"])
+        embeddings = decode_vectors(embeddings)
+        dim = embeddings.shape[1] if len(ids) else len(self.embedder.embed_query(""))
+        index = create_ann_index(self.index_kind, dim)
+        index.add(ids, embeddings)
+        lexical = LexicalIndex()
+        lexical.add(ids, texts)
+        index.version = lexical.version = version
+        index.save(self.index_path)
+        lexical.save(self._lexical_path)
+        self._index_dirty = False
+        return index, lexical
+
+    def _cosine_similarities(self, query_embs, embeddings_np):
+        # query_embs: (d,) or (q,d), embeddings_np: (n,d)
+        # return cosine similarities as (n,) or (q,n)
+        q = query_embs / (np.linalg.norm(query_embs, axis=-1, keepdims=True) + 1e-12)
         embs = embeddings_np / (np.linalg.norm(embeddings_np, axis=1, keepdims=True) + 1e-12)
-        sims = embs.dot(q)
+        sims = q.dot(embs.T)
         return sims
 
-    def retrieve(self, query: str, k: int = 3):
-        """Return top-k documents (text, metadata) relevant to query."""
-        # compute query embedding
-        query_emb = np.array(self.embedder.embed_query(query), dtype=float)
+    def retrieve(self, query: str, k: int = 3, hybrid: bool = False, query_embedding: List[float] = None):
+        """
+        Return top-k documents (text, metadata, chunk id) relevant to query. `score` is the cosine
+        similarity to the query (higher is better). With `hybrid` (and an index) the vector and BM25
+        rankings are fused, and the reciprocal-rank-fusion score that orders them is `rrf_score`.
+        Pass `query_embedding` when the query has already been embedded.
+        """
+        return self.retrieve_many([query], k, hybrid, None if query_embedding is None else [query_embedding])[0]
+
+    def retrieve_many(self, queries: List[str], k: int = 3, hybrid: bool = False,
+                      query_embeddings: List[List[float]] = None):
+        """
+        Batched `retrieve`: one ranked result list per query. All queries are embedded in one
+        pass and scored together (one index call, or one matrix-matrix multiply on a full scan).
+        """
+        if not queries:
+            return []
+        # compute query embeddings
+        if query_embeddings is None:
+            query_embeddings = self.embedder.embed_documents(list(queries))
+        query_embs = np.array(query_embeddings, dtype=np.float32)
+        if self.index_kind:
+            return self._retrieve_from_index(query_embs, k, queries if hybrid else None)
         # load all candidate embeddings and ids
         docs_cursor = list(self.collection.find({}, {"text": 1, "metadata": 1, "embedding": 1}))
         if not docs_cursor:
-            return []
+            return [[] for _ in queries]
+
+        embeddings = normalize_rows(decode_vectors(doc["embedding"] for doc in docs_cursor))
+        n_candidates = min(k * RERANK_FACTOR if self.rerank else k, len(docs_cursor))
+        ranked = []
+        # Scored QUERY_BLOCK queries at a time, so the score matrix stays (block x docs) however
+        # many queries come in, and only each row's top candidates are sorted
+        for start in range(0, len(query_embs), QUERY_BLOCK):
+            sims = normalize_rows(query_embs[start:start + QUERY_BLOCK]) @ embeddings.T
+            top = np.argpartition(-sims, n_candidates - 1, axis=1)[:, :n_candidates]
+            top_sims = np.take_along_axis(sims, top, axis=1)
+            order = np.argsort(-top_sims, axis=1)
+            for row, row_sims in zip(np.take_along_axis(top, order, axis=1), np.take_along_axis(top_sims, order, axis=1)):
+                ranked.append([(str(docs_cursor[int(idx)]["_id"]), float(sim)) for idx, sim in zip(row, row_sims)])
+        if self.rerank:
+            ranked = [hits[:k] for hits in self._rerank(query_embs, ranked)]
+        by_id = {str(d["_id"]): d for d in docs_cursor}
+        return [[{
+            "text": by_id[doc_id]["text"],
+            "metadata": by_id[doc_id].get("metadata", {}),
+            "score": score,
+            "id": doc_id
+        } for doc_id, score in hits] for hits in ranked]
 
-        embeddings = np.array([doc["embedding"] for doc in docs_cursor], dtype=float)
-        sims = self._cosine_similarities(query_emb, embeddings)
-        topk_idx = np.argsort(-sims)[:k]
+    def _rerank(self, query_embs, ranked):
+        """Re-score each query's candidates with the stored float32 vectors and re-sort them."""
+        ids = list({_to_mongo_id(doc_id) for hits in ranked for doc_id, _ in hits})
+        full = {}
+        for d in self.collection.find({"_id": {"$in": ids}}, {"embedding_full": 1, "embedding": 1}):
+            # Documents written without a full-precision copy are scored with their compact vector
+            full[str(d["_id"])] = d.get("embedding_full", d["embedding"])
+        reranked = []
+        for query_emb, hits in zip(query_embs, ranked):
+            hits = [doc_id for doc_id, _ in hits if doc_id in full]
+            if not hits:
+                reranked.append([])
+                continue
+            sims = self._cosine_similarities(query_emb, decode_vectors(full[doc_id] for doc_id in hits))
+            order = np.argsort(-sims)
+            reranked.append([(hits[i], float(sims[i])) for i in order])
+        return reranked
 
+    def _retrieve_from_index(self, query_embs, k: int, queries: List[str] = None):
+        index = self._ensure_index()
+        n_candidates = k * HYBRID_CANDIDATE_FACTOR if queries is not None else k
+        if self.rerank:
+            # Quantized scores pick the candidates, full-precision vectors order them
+            ranked = self._rerank(query_embs, index.search_many(query_embs, n_candidates * RERANK_FACTOR))
+            ranked = [hits[:n_candidates] for hits in ranked]
+        else:
+            ranked = index.search_many(query_embs, n_candidates)
+        similarities = [dict(dense) for dense in ranked]
+        if queries is None:
+            ranked = [hits[:k] for hits in ranked]
+        else:
+            ranked = [
+                reciprocal_rank_fusion(dense, self.lexical.search(query, n_candidates))[:k]
+                for query, dense in zip(queries, ranked)
+            ]
+        # Fetch only the winning documents in one round trip for all queries; their embeddings only
+        # when BM25 brought in chunks the vector search did not score
+        ids = list({_to_mongo_id(doc_id) for hits in ranked for doc_id, _ in hits})
+        if not ids:
+            return [[] for _ in ranked]
+        unscored = any(doc_id not in sims for hits, sims in zip(ranked, similarities) for doc_id, _ in hits)
+        projection = {"text": 1, "metadata": 1, **({"embedding": 1, "embedding_full": 1} if unscored else {})}
+        found = {str(d["_id"]): d for d in self.collection.find({"_id": {"$in": ids}}, projection)}
         results = []
-        for idx in topk_idx:
-            d = docs_cursor[int(idx)]
-            results.append({
-                "text": d["text"],
-                "metadata": d.get("metadata", {}),
-                "score": float(sims[int(idx)])
-            })
+        for query_emb, hits, sims in zip(query_embs, ranked, similarities):
+            docs = []
+            for doc_id, score in hits:
+                d = found.get(doc_id)
+                if d is None:
+                    continue
+                if doc_id not in sims:
+                    vector = decode_vectors([d.get("embedding_full", d["embedding"])])
+                    sims[doc_id] = float(self._cosine_similarities(query_emb, vector)[0])
+                docs.append({
+                    "text": d["text"],
+                    "metadata": d.get("metadata", {}),
+                    "score": sims[doc_id],
+                    "id": doc_id
+                })
+                if queries is not None:
+                    docs[-1]["rrf_score"] = score
+            results.append(docs)
         return results
@@ -1,10 +1,134 @@
 from pypdf import PdfReader
-from typing import List
-import io
+from typing import Callable, Iterator, List, Tuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import hashlib
+import os
+import tempfile
 
-def extract_text_from_pdf(file) -> str:
+# Large files are split into page ranges of this size so one big manual
+# is spread over several workers instead of pinning a single one.
+PAGES_PER_TASK = 25
+MAX_WORKERS = int(os.getenv("PDF_WORKERS", "0")) or os.cpu_count()
+
+
+def extract_pages_from_pdf(file) -> List[str]:
+    """Return the text of every page of a PDF, in page order."""
     reader = PdfReader(file)
-    text = ''
-    for page in reader.pages:
-        text += page.extract_text() or ''
-    return text
+    return [page.extract_text() or '' for page in reader.pages]
+
+
+def extract_text_from_pdf(file) -> str:
+    return ''.join(extract_pages_from_pdf(file))
+
+
+# Reader of the file a worker last extracted from, reused for the next range of the same file
+_worker_reader = (None, None)
+
+
+def _extract_page_range(path: str, start: int, end: int) -> List[str]:
+    # Runs in a worker process: open the PDF on disk and extract pages [start, end)
+    global _worker_reader
+    if _worker_reader[0] != path:
+        _worker_reader = (path, PdfReader(path))
+    reader = _worker_reader[1]
+    return [reader.pages[i].extract_text() or '' for i in range(start, end)]
+
+
+def read_file_bytes(file) -> bytes:
+    if hasattr(file, "getvalue"):
+        return file.getvalue()
+    file.seek(0)
+    return file.read()
+
+
+def file_hash(file) -> str:
+    """Content hash of an uploaded file, used to skip files that did not change."""
+    return hashlib.sha256(read_file_bytes(file)).hexdigest()
+
+
+def iter_extracted_files(files, progress_callback: Callable[[str, int, int], None] = None,
+                         max_workers: int = None, pages_per_task: int = PAGES_PER_TASK) -> Iterator[Tuple[int, str, List[str]]]:
+    """
+    Extract page texts from many PDFs on a process pool, yielding each file as soon as it is done.
+
+    Only about two page ranges per worker are in flight at any time, and each file is read
+    only when its first range is submitted, so memory does not grow with the number of files.
+    Workers get a path, not the bytes: files without one on disk are spooled to a temporary
+    file once, so a big PDF is not pickled to every worker that extracts part of it.
+
+    Args:
+        files (list): Uploaded file objects (anything with `.name` and `getvalue()`/`read()`);
+            those with a `.path` on disk are extracted from it directly.
+        progress_callback (callable): Called as (file_name, files_done, files_total)
+            each time a file has been fully extracted.
+        max_workers (int): Pool size, defaults to PDF_WORKERS or the CPU count.
+        pages_per_task (int): Page range size handed to a single worker.
+
+    Yields:
+        (file_index, file_name, pages) in completion order, where pages[i] is the text of page i + 1.
+    """
+    workers = max_workers or MAX_WORKERS
+    pending = {}  # file index -> page ranges still being extracted
+    partial = {}  # file index -> page texts collected so far
+
+    spooled = {}  # file index -> temporary copy, removed once the file is done
+
+    def tasks():
+        for file_idx, file in enumerate(files):
+            path = getattr(file, "path", None)
+            if path is None:
+                fd, path = tempfile.mkstemp(suffix=".pdf", dir=spool_dir)
+                with os.fdopen(fd, "wb") as f:
+                    f.write(read_file_bytes(file))
+                spooled[file_idx] = path
+            n_pages = len(PdfReader(path).pages)
+            starts = range(0, max(n_pages, 1), pages_per_task)
+            pending[file_idx] = len(starts)
+            partial[file_idx] = [''] * n_pages
+            for start in starts:
+                yield file_idx, path, start, min(start + pages_per_task, n_pages)
+
+    done = 0
+    with tempfile.TemporaryDirectory(prefix="pdf-extract-") as spool_dir, \
+            ProcessPoolExecutor(max_workers=workers) as pool:
+        task_iter = tasks()
+        in_flight = {}
+
+        def submit_next():
+            task = next(task_iter, None)
+            if task is not None:
+                file_idx, path, start, end = task
+                in_flight[pool.submit(_extract_page_range, path, start, end)] = (file_idx, start)
+
+        for _ in range(2 * workers):
+            submit_next()
+
+        while in_flight:
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                file_idx, start = in_flight.pop(future)
+                texts = future.result()
+                partial[file_idx][start:start + len(texts)] = texts
+                pending[file_idx] -= 1
+                submit_next()
+                if pending[file_idx] == 0:
+                    if file_idx in spooled:
+                        os.remove(spooled.pop(file_idx))
+                    done += 1
+                    if progress_callback:
+                        progress_callback(files[file_idx].name, done, len(files))
+                    yield file_idx, files[file_idx].name, partial.pop(file_idx)
+
+
+def extract_pages_parallel(files, progress_callback: Callable[[str, int, int], None] = None,
+                           max_workers: int = None, pages_per_task: int = PAGES_PER_TASK) -> List[Tuple[str, List[str]]]:
+    """
+    Extract page texts from many PDFs on a process pool.
+
+    Returns:
+        list of (file_name, pages) in the order of `files`, where pages[i] is the text of page i + 1.
+    """
+    results = [None] * len(files)
+    for file_idx, name, pages in iter_extracted_files(files, progress_callback, max_workers, pages_per_task):
+        results[file_idx] = (name, pages)
+    return results
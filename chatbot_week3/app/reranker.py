@@ -0,0 +1,171 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+# Cross-encoder that re-scores retrieved chunks against the question; empty disables re-ranking
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+# Candidates fetched from the store for every chunk finally kept
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+# Seconds re-ranking may add to a turn; when scoring would take longer, retrieval order is kept
+RERANK_BUDGET = float(os.getenv("RERANK_BUDGET", "0.5"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "20000"))
+
+
+def query_hash(query: str) -> str:
+    return hashlib.sha256(" ".join(query.split()).encode()).hexdigest()[:32]
+
+
+class ScoreCache:
+    """
+    In-memory LRU of cross-encoder scores keyed by (query hash, chunk id). Chunk ids
+    are content hashes, so an entry can never outlive the text it was computed for.
+    """
+
+    def __init__(self, max_entries: int = RERANK_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._scores: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, query_key: str, chunk_ids: List[str]) -> List[Optional[float]]:
+        found = []
+        with self._lock:
+            for chunk_id in chunk_ids:
+                score = self._scores.get((query_key, chunk_id))
+                if score is not None:
+                    self._scores.move_to_end((query_key, chunk_id))
+                found.append(score)
+            hits = sum(score is not None for score in found)
+            self.hits += hits
+            self.misses += len(found) - hits
+        return found
+
+    def put_many(self, query_key: str, chunk_ids: List[str], scores: List[float]):
+        with self._lock:
+            for chunk_id, score in zip(chunk_ids, scores):
+                self._scores[(query_key, chunk_id)] = score
+                self._scores.move_to_end((query_key, chunk_id))
+            while len(self._scores) > self.max_entries:
+                self._scores.popitem(last=False)
+
+    def __len__(self):
+        return len(self._scores)
+
+
+class CrossEncoderReranker:
+    """
+    Re-orders retrieval candidates by a cross-encoder's relevance score and keeps the best k.
+
+    The model (sentence-transformers' CrossEncoder) loads in a background thread on
+    first use; until it is ready, and whenever scoring the uncached candidates is
+    predicted to exceed `budget` seconds (from the measured cost per pair), the
+    candidates keep their retrieval order. Pairs are scored in batches, and the
+    budget is checked again before each one.
+    """
+
+    def __init__(self, model_name: str = RERANK_MODEL, batch_size: int = RERANK_BATCH_SIZE,
+                 budget: float = RERANK_BUDGET, cache: ScoreCache = None):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.budget = budget
+        self.cache = cache if cache is not None else ScoreCache()
+        self.seconds_per_pair = None  # running average, learned from scored batches
+        self.counts = {"reranked": 0, "skipped": 0}
+        self._model = None
+        self._loading = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            from sentence_transformers import CrossEncoder
+            model = CrossEncoder(self.model_name)
+            # The first prediction is slow (lazy initialisation); keep it out of the per-pair estimate
+            model.predict([("warm up", "warm up")], show_progress_bar=False)
+            self._model = model
+        except Exception:
+            self._model = False  # unavailable: re-ranking stays off for this process
+
+    def ready(self) -> bool:
+        """Whether the model is loaded; starts loading it otherwise."""
+        if self._model is None and self._loading is None:
+            with self._lock:
+                if self._loading is None:
+                    self._loading = threading.Thread(target=self._load, name="rerank-load", daemon=True)
+                    self._loading.start()
+        return bool(self._model)
+
+    def _predict(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        start = time.perf_counter()
+        scores = self._model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False)
+        per_pair = (time.perf_counter() - start) / len(pairs)
+        previous = self.seconds_per_pair
+        self.seconds_per_pair = per_pair if previous is None else 0.8 * previous + 0.2 * per_pair
+        return [float(s) for s in scores]
+
+    def _fits(self, n_pairs: int, elapsed: float) -> bool:
+        if self.seconds_per_pair is None:
+            return True  # nothing measured yet: try, the per-batch check still bounds it
+        return elapsed + n_pairs * self.seconds_per_pair <= self.budget
+
+    def rerank(self, query: str, docs: List[dict], k: int) -> List[dict]:
+        """
+        Best `k` of `docs` ({text, metadata, score, id} dicts from a store's `retrieve`)
+        by cross-encoder score, stored as "rerank_score". Falls back to `docs[:k]`.
+        """
+        start = time.perf_counter()
+        if len(docs) <= 1 or not self.ready():
+            self.counts["skipped"] += 1
+            return docs[:k]
+        key = query_hash(query)
+        ids = [doc.get("id") or query_hash(doc["text"]) for doc in docs]
+        scores = self.cache.get_many(key, ids)
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if not self._fits(len(missing), 0.0):
+            # Skipped calls measure nothing, so let the estimate drift down until it is probed again
+            self.seconds_per_pair *= 0.95
+            self.counts["skipped"] += 1
+            return docs[:k]
+        for batch_start in range(0, len(missing), self.batch_size):
+            batch = missing[batch_start:batch_start + self.batch_size]
+            if batch_start and not self._fits(len(batch), time.perf_counter() - start):
+                # Scores computed so far stay cached, so asking again finishes the job cheaply
+                self.counts["skipped"] += 1
+                return docs[:k]
+            batch_scores = self._predict([(query, docs[i]["text"]) for i in batch])
+            self.cache.put_many(key, [ids[i] for i in batch], batch_scores)
+            for i, score in zip(batch, batch_scores):
+                scores[i] = score
+        self.counts["reranked"] += 1
+        order = sorted(range(len(docs)), key=lambda i: -scores[i])[:k]
+        return [{**docs[i], "rerank_score": scores[i]} for i in order]
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.cache.hits + self.cache.misses
+        return {
+            **self.counts,
+            "ready": bool(self._model),
+            "cache_entries": len(self.cache),
+            "cache_hit_rate": self.cache.hits / lookups if lookups else 0.0,
+            "ms_per_pair": self.seconds_per_pair * 1000 if self.seconds_per_pair is not None else None,
+        }
+
+
+_reranker = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker() -> Optional[CrossEncoderReranker]:
+    """Shared re-ranker for the process, or None when RERANK_MODEL is empty or its model failed to load."""
+    global _reranker
+    if _reranker is None and RERANK_MODEL:
+        with _reranker_lock:
+            if _reranker is None:
+                _reranker = CrossEncoderReranker()
+    if _reranker is not None and _reranker._model is False:
+        return None
+    return _reranker
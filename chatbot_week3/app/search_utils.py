@@ -1,31 +1,172 @@
+import asyncio
+import json
 import os
-import requests
-from dotenv import load_dotenv
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+import httpx
 
-load_dotenv()
 TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
+# Override to point the client at a local stub server (e.g. in tests)
+TAVILY_URL = os.getenv("TAVILY_URL", "https://api.tavily.com/search")
+SEARCH_TIMEOUT = float(os.getenv("SEARCH_TIMEOUT", "10"))
+SEARCH_CONNECT_TIMEOUT = float(os.getenv("SEARCH_CONNECT_TIMEOUT", "3"))
+SEARCH_MAX_CONNECTIONS = int(os.getenv("SEARCH_MAX_CONNECTIONS", "10"))
+SEARCH_CACHE_PATH = os.getenv("SEARCH_CACHE_PATH", ".search_cache.sqlite")
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "86400"))
+# Start the web search alongside document retrieval, so the fallback is ready if no chunks are found.
+# Opt-in: it sends every question to the (paid) search API, even the ones the documents answer
+SPECULATIVE_SEARCH = os.getenv("SPECULATIVE_SEARCH", "0") == "1"
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+class SearchCache:
+    """
+    On-disk cache of search results keyed by normalized query, stored in SQLite.
+    Entries older than `ttl` seconds are treated as misses and dropped.
+    """
+
+    def __init__(self, path: str = SEARCH_CACHE_PATH, ttl: float = SEARCH_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS search_results ("
+            "key TEXT PRIMARY KEY, results TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[List[Dict[str, str]]]:
+        with self._lock:
+            row = self._conn.execute("SELECT results, created FROM search_results WHERE key = ?", (key,)).fetchone()
+            if row is not None and time.time() - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM search_results WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, results: List[Dict[str, str]]):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO search_results VALUES (?, ?, ?)",
+                               (key, json.dumps(results), time.time()))
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM search_results").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+        }
+
+
+class SearchClient:
+    """
+    Async Tavily client on one pooled `httpx.AsyncClient`, with the result cache in front.
+
+    The HTTP client lives on a private event loop running in a daemon thread, so
+    synchronous callers (Streamlit reruns) can `start` a search, keep working and
+    collect the result later. Code running on another event loop should await
+    `search_internet_async` rather than `search`, which must run on this loop.
+    """
+
+    def __init__(self, url: str = TAVILY_URL, api_key: str = TAVILY_API_KEY, timeout: float = SEARCH_TIMEOUT,
+                 connect_timeout: float = SEARCH_CONNECT_TIMEOUT, max_connections: int = SEARCH_MAX_CONNECTIONS,
+                 cache: SearchCache = None):
+        self.url = url
+        self.api_key = api_key
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.cache = cache
+        self._http = None
+        self._loop = None
+        self._lock = threading.Lock()
+
+    def _event_loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    threading.Thread(target=loop.run_forever, name="search-client", daemon=True).start()
+                    self._loop = loop
+        return self._loop
+
+    async def search(self, query: str, max_results: int = 5) -> List[Dict[str, str]]:
+        """Return a list of dicts with title, snippet, and link, from the cache when possible."""
+        key = f"{max_results}:{normalize_query(query)}"
+        # SQLite calls run off the event loop so they never stall other in-flight searches
+        if self.cache is not None:
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                return cached
+        if self._http is None:
+            self._http = httpx.AsyncClient(timeout=self.timeout, limits=self.limits)
+        payload = {
+            "api_key": self.api_key,
+            "query": query,
+            "max_results": max_results
+        }
+        response = await self._http.post(self.url, json=payload)
+        response.raise_for_status()
+        data = response.json()
+
+        results = []
+        for item in data.get("results", []):
+            results.append({
+                "title": item.get("title", "No title"),
+                "snippet": item.get("content", "No description"),
+                "link": item.get("url", "#")
+            })
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.put, key, results)
+        return results
+
+    def start(self, query: str, max_results: int = 5) -> Future:
+        """Begin a search on the client's event loop; the returned future holds its results."""
+        return asyncio.run_coroutine_threadsafe(self.search(query, max_results), self._event_loop())
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_search_client() -> SearchClient:
+    """Shared client (and connection pool) for the whole process."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = SearchClient(cache=SearchCache() if SEARCH_CACHE_PATH else None)
+    return _client
+
+
+def start_search(query: str, max_results: int = 5) -> Future:
+    return get_search_client().start(query, max_results)
+
+
+async def search_internet_async(query: str, max_results: int = 5):
+    return await asyncio.wrap_future(start_search(query, max_results))
+
 
 def search_internet(query: str, max_results: int = 5):
     """
     Search the internet using Tavily API and return a list of dicts with title, snippet, and link.
     """
-    url = "https://api.tavily.com/search"
-    payload = {
-        "api_key": TAVILY_API_KEY,
-        "query": query,
-        "max_results": max_results
-    }
-    
-    response = requests.post(url, json=payload)
-    response.raise_for_status()
-    data = response.json()
-
-    results = []
-    for item in data.get("results", []):
-        results.append({
-            "title": item.get("title", "No title"),
-            "snippet": item.get("content", "No description"),
-            "link": item.get("url", "#")
-        })
-
-    return results
+    return start_search(query, max_results).result()
@@ -0,0 +1,81 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import numpy as np
+from app.vector_codec import normalize_rows
+
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1000"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+
+
+class SemanticCache:
+    """
+    Process-wide answer cache. A question hits when its embedding has cosine
+    similarity >= `threshold` with a cached question asked under the same key,
+    so rephrasings of the same question share one answer. The key names the
+    corpus and, for follow-up questions, the conversation they depend on.
+    Entries expire after `ttl` seconds and the least recently used ones are
+    evicted beyond `max_entries`.
+    """
+
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD, max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+                 ttl: float = SEMANTIC_CACHE_TTL):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # entry id -> (key, unit query vector, answer, query time, created at)
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def _expire(self, now: float):
+        expired = [eid for eid, entry in self._entries.items() if now - entry[4] > self.ttl]
+        for eid in expired:
+            del self._entries[eid]
+
+    def lookup(self, query_vector, key: str) -> Optional[Tuple[str, float]]:
+        """Return the cached (answer, query_time) for a similar question, or None."""
+        vector = normalize_rows(query_vector)[0]
+        with self._lock:
+            self._expire(time.time())
+            candidates = [(eid, entry) for eid, entry in self._entries.items() if entry[0] == key]
+            if candidates:
+                sims = np.stack([entry[1] for _, entry in candidates]) @ vector
+                best = int(np.argmax(sims))
+                if sims[best] >= self.threshold:
+                    eid, entry = candidates[best]
+                    self._entries.move_to_end(eid)
+                    self.hits += 1
+                    return entry[2], entry[3]
+            self.misses += 1
+            return None
+
+    def store(self, query_vector, key: str, answer: str, query_time: float):
+        vector = normalize_rows(query_vector)[0]
+        with self._lock:
+            self._entries[self._next_id] = (key, vector, answer, query_time, time.time())
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+        }
+
+
+# Shared by every session in the process
+answer_cache = SemanticCache()
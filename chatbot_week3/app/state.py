@@ -1,17 +1,38 @@
 import streamlit as st
 from app.chat_utils import get_chat_model
+from app.context_assembler import ConversationMemory
+from app.tracing import LatencyHistogram
 import os
+import uuid
 
 def init_session_state():
     if "messages" not in st.session_state:
         st.session_state.messages = []
-    if "query_cache" not in st.session_state:
-        st.session_state.query_cache = {}
+    if "conversation_memory" not in st.session_state:
+        st.session_state.conversation_memory = ConversationMemory()
     if "vectorstore" not in st.session_state:
         st.session_state.vectorstore = None
-    if "chat_model" not in st.session_state:
-        st.session_state.chat_model = get_chat_model(os.getenv("EURI_API_KEY", ""))
     if "store_type" not in st.session_state:
         st.session_state.store_type = "faiss"
     if "timings" not in st.session_state:
-        st.session_state.timings = {"faiss": [], "mongo": []}
+        st.session_state.timings = {}
+    if "last_turn" not in st.session_state:
+        st.session_state.last_turn = None
+    if "conversation_id" not in st.session_state:
+        # Names this conversation's server-side memory when the UI runs against the API
+        st.session_state.conversation_id = uuid.uuid4().hex
+
+
+def session_chat_model():
+    """This session's chat client, created on first use so the page renders without loading it."""
+    if st.session_state.get("chat_model") is None:
+        st.session_state.chat_model = get_chat_model(os.getenv("EURI_API_KEY", ""))
+    return st.session_state.chat_model
+
+
+def session_histogram(name: str) -> LatencyHistogram:
+    """This session's latency histogram for `name` (a store type, "ttft", "generation", ...)."""
+    timings = st.session_state.setdefault("timings", {})
+    if not isinstance(timings.get(name), LatencyHistogram):  # also replaces lists kept by older versions
+        timings[name] = LatencyHistogram()
+    return timings[name]
@@ -1,8 +1,65 @@
-from app.chat_utils import ask_chat_model, get_chat_model
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from app.chat_utils import ask_chat_model, get_shared_chat_model
+
+# "concurrent": one call per chunk on a bounded pool; "batched": one call for all chunks
+SUMMARY_MODE = os.getenv("SUMMARY_MODE", "concurrent")
+MAX_SUMMARY_WORKERS = int(os.getenv("MAX_SUMMARY_WORKERS", "4"))
+
+_executor = ThreadPoolExecutor(max_workers=MAX_SUMMARY_WORKERS, thread_name_prefix="summarize")
+
+
+def _summary_prompt(context: str) -> str:
+    return f"Summarize the following documents/search results into a concise, clear answer:\n\n{context}"
+
+
+def _timed_call(prompt: str):
+    start = time.perf_counter()
+    answer = ask_chat_model(get_shared_chat_model(), prompt)
+    return answer, time.perf_counter() - start
+
 
 def summarize_context(context: str) -> str:
-    chat_model = get_chat_model()
-    summary_prompt = (
-        f"Summarize the following documents/search results into a concise, clear answer:\n\n{context}"
+    return ask_chat_model(get_shared_chat_model(), _summary_prompt(context))
+
+
+def _summarize_each(contexts: List[str], call_times: List[float] = None) -> List[str]:
+    results = list(_executor.map(_timed_call, map(_summary_prompt, contexts)))
+    if call_times is not None:
+        call_times.extend(elapsed for _, elapsed in results)
+    return [summary for summary, _ in results]
+
+
+def summarize_contexts(contexts: List[str], call_times: List[float] = None) -> List[str]:
+    """
+    Summarize several chunks concurrently, sharing one chat client.
+    The duration of every LLM call is appended to `call_times` when given.
+    """
+    if SUMMARY_MODE == "batched" and len(contexts) > 1:
+        return summarize_batch(contexts, call_times)
+    return _summarize_each(contexts, call_times)
+
+
+def summarize_batch(contexts: List[str], call_times: List[float] = None) -> List[str]:
+    """
+    Summarize all chunks with a single LLM call. Falls back to concurrent
+    per-chunk calls if the reply does not contain one summary per chunk.
+    """
+    sections = "\n\n".join(f"[{i}]\n{context}" for i, context in enumerate(contexts, 1))
+    prompt = (
+        "Summarize each of the following numbered documents/search results into a concise, clear answer. "
+        f"Reply with exactly {len(contexts)} summaries, each starting on a new line with its number "
+        f"in brackets, e.g. [1] ...\n\n{sections}"
     )
-    return ask_chat_model(chat_model, summary_prompt)
+    reply, elapsed = _timed_call(prompt)
+    if call_times is not None:
+        call_times.append(elapsed)
+    # With a capture group re.split yields [preamble, "1", text1, "2", text2, ...]
+    parts = re.split(r"^\s*\[(\d+)\]\s*", reply, flags=re.MULTILINE)
+    summaries = {int(num): text.strip() for num, text in zip(parts[1::2], parts[2::2])}
+    if sorted(summaries) != list(range(1, len(contexts) + 1)):
+        return _summarize_each(contexts, call_times)
+    return [summaries[i] for i in range(1, len(contexts) + 1)]
@@ -0,0 +1,159 @@
+import json
+import math
+import os
+import secrets
+import threading
+from typing import Dict, List
+
+# Where finished turns are exported: "" (nowhere), "jsonl" (TRACE_PATH) or "otel"
+# (the OpenTelemetry SDK configured in this process, if installed)
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "")
+TRACE_PATH = os.getenv("TRACE_PATH", ".traces.jsonl")
+
+
+class LatencyHistogram:
+    """
+    Latency distribution in fixed memory: log-spaced buckets, each GROWTH times wider
+    than the last, from MIN_SECONDS to MAX_SECONDS. Quantiles are accurate to within
+    half a bucket (about 2.5%) however many samples are recorded.
+    """
+
+    MIN_SECONDS = 1e-4
+    MAX_SECONDS = 600.0
+    GROWTH = 1.05
+    BUCKETS = math.ceil(math.log(MAX_SECONDS / MIN_SECONDS, GROWTH)) + 2  # plus underflow and overflow
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def _bucket(self, seconds: float) -> int:
+        if seconds < self.MIN_SECONDS:
+            return 0
+        return min(int(math.log(seconds / self.MIN_SECONDS, self.GROWTH)) + 1, self.BUCKETS - 1)
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.counts[self._bucket(seconds)] += 1
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        """Approximate `q`-quantile (0..1): the geometric middle of the bucket holding it."""
+        with self._lock:
+            if not self.count:
+                return 0.0
+            rank = q * (self.count - 1) + 1
+            seen = 0
+            for bucket, n in enumerate(self.counts):
+                seen += n
+                if seen >= rank:
+                    break
+        if bucket == 0:
+            return self.MIN_SECONDS
+        lower = self.MIN_SECONDS * self.GROWTH ** (bucket - 1)
+        return min(lower * math.sqrt(self.GROWTH), self.max)
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "p50": self.quantile(0.50),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "max": self.max,
+        }
+
+
+# Process-wide histograms, one per stage name, shared by every session
+_histograms: Dict[str, LatencyHistogram] = {}
+_lock = threading.Lock()
+
+
+def stage_histogram(name: str) -> LatencyHistogram:
+    histogram = _histograms.get(name)
+    if histogram is None:
+        with _lock:
+            histogram = _histograms.setdefault(name, LatencyHistogram())
+    return histogram
+
+
+def stage_latencies() -> Dict[str, Dict[str, float]]:
+    """p50/p95/p99 (and count, mean, max) of every stage recorded in this process."""
+    return {name: histogram.summary() for name, histogram in sorted(_histograms.items())}
+
+
+def new_span_id() -> str:
+    return secrets.token_hex(8)
+
+
+def new_trace_id() -> str:
+    return secrets.token_hex(16)
+
+
+class JsonlExporter:
+    """
+    Appends one JSON object per span to `path`, with the field names of OpenTelemetry's
+    OTLP/JSON span encoding (traceId, spanId, parentSpanId, startTimeUnixNano, ...).
+    """
+
+    def __init__(self, path: str = TRACE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans: List[dict]):
+        lines = "".join(json.dumps(span) + "\n" for span in spans)
+        with self._lock, open(self.path, "a") as f:
+            f.write(lines)
+
+
+class OtelExporter:
+    """Replays spans through the OpenTelemetry API, keeping their ids' parent/child structure and timestamps."""
+
+    def __init__(self):
+        from opentelemetry import trace
+        self._trace = trace
+        self._tracer = trace.get_tracer("chatbot-pdf")
+
+    def export(self, spans: List[dict]):
+        trace = self._trace
+        opened = {}
+        for span in spans:  # parents come before their children
+            parent = opened.get(span["parentSpanId"])
+            context = trace.set_span_in_context(parent) if parent is not None else None
+            otel_span = self._tracer.start_span(span["name"], context=context, start_time=span["startTimeUnixNano"],
+                                                attributes=span["attributes"])
+            if span["status"]["code"] == "STATUS_CODE_ERROR":
+                otel_span.set_status(trace.Status(trace.StatusCode.ERROR, span["status"].get("message")))
+            opened[span["spanId"]] = otel_span
+        for span in reversed(spans):
+            opened[span["spanId"]].end(end_time=span["endTimeUnixNano"])
+
+
+_exporter = None
+
+
+def get_exporter():
+    """The exporter selected by TRACE_EXPORTER, or None. OpenTelemetry is optional: without it nothing is exported."""
+    global _exporter
+    if _exporter is None and TRACE_EXPORTER:
+        with _lock:
+            if _exporter is None:
+                if TRACE_EXPORTER == "jsonl":
+                    _exporter = JsonlExporter()
+                elif TRACE_EXPORTER == "otel":
+                    try:
+                        _exporter = OtelExporter()
+                    except ImportError:
+                        _exporter = False
+                else:
+                    raise ValueError(f"Unknown TRACE_EXPORTER '{TRACE_EXPORTER}'. Choose one of: jsonl, otel")
+    return _exporter or None
@@ -0,0 +1,177 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Awaitable, Dict, List, Sequence
+from app.tracing import get_exporter, new_span_id, new_trace_id, stage_histogram
+
+# Seconds each stage of a turn may take before the turn moves on without it
+STAGE_DEADLINES = {
+    "embed": float(os.getenv("EMBED_DEADLINE", "10")),
+    "retrieve": float(os.getenv("RETRIEVE_DEADLINE", "10")),
+    # Backstop only: the re-ranker keeps to its own, much smaller, RERANK_BUDGET
+    "rerank": float(os.getenv("RERANK_DEADLINE", "5")),
+    "summarize": float(os.getenv("SUMMARIZE_DEADLINE", "20")),
+    "web_search": float(os.getenv("WEB_SEARCH_DEADLINE", "10")),
+}
+
+# Blocking stage work runs here rather than on the event loop's default executor:
+# a stage abandoned at its deadline must not hold up the end of the turn.
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("TURN_WORKERS", "8")), thread_name_prefix="rag-turn")
+
+
+class TurnTrace:
+    """
+    When every stage of one turn started and ended (seconds from the start of the
+    turn), how it finished ("ok", "timeout" or "error") and which stages it waited on.
+
+    Each stage is a span of the turn: its duration goes into the stage's process-wide
+    histogram as it is recorded, and `finish` exports the whole turn (see app.tracing).
+    """
+
+    def __init__(self):
+        self.trace_id = new_trace_id()
+        self.span_id = new_span_id()
+        self.started = time.perf_counter()
+        self.started_unix = time.time()
+        self.stages: Dict[str, Dict[str, Any]] = {}
+
+    def record(self, name: str, start: float, end: float, status: str = "ok", deps: Sequence[str] = ()):
+        self.stages[name] = {
+            "start": start - self.started,
+            "end": end - self.started,
+            "status": status,
+            "deps": list(deps),
+            "span_id": new_span_id(),
+        }
+        stage_histogram(name).record(end - start)
+
+    @contextmanager
+    def span(self, name: str, deps: Sequence[str] = ()):
+        """Record the enclosed block (which may await) as stage `name`."""
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            yield
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            self.record(name, start, time.perf_counter(), status, deps)
+
+    def finish(self, **attributes):
+        """End the turn: record its total latency and export its spans, with `attributes` on the root span."""
+        elapsed = self.elapsed()
+        stage_histogram("turn").record(elapsed)
+        exporter = get_exporter()
+        if exporter is not None:
+            exporter.export(self.spans(elapsed, attributes))
+
+    def spans(self, elapsed: float, attributes: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """The turn and its stages as spans in OTLP/JSON field layout, root first."""
+        def unix_nano(offset):
+            return int((self.started_unix + offset) * 1e9)
+
+        root = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": "",
+            "name": "turn",
+            "startTimeUnixNano": unix_nano(0),
+            "endTimeUnixNano": unix_nano(elapsed),
+            "status": {"code": "STATUS_CODE_OK"},
+            "attributes": {"critical_path": self.critical_path(), **(attributes or {})},
+        }
+        spans = [root]
+        for name, stage in sorted(self.stages.items(), key=lambda item: item[1]["start"]):
+            status = {"code": "STATUS_CODE_OK"}
+            if stage["status"] != "ok":
+                status = {"code": "STATUS_CODE_ERROR", "message": stage["status"]}
+            spans.append({
+                "traceId": self.trace_id,
+                "spanId": stage["span_id"],
+                "parentSpanId": self.span_id,
+                "name": name,
+                "startTimeUnixNano": unix_nano(stage["start"]),
+                "endTimeUnixNano": unix_nano(stage["end"]),
+                "status": status,
+                "attributes": {"deps": stage["deps"]},
+            })
+        return spans
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def critical_path(self) -> List[str]:
+        """Stages that determined the turn's latency: from the last stage to end, back through the latest dependency."""
+        if not self.stages:
+            return []
+        name = max(self.stages, key=lambda n: self.stages[n]["end"])
+        path = [name]
+        while True:
+            deps = [d for d in self.stages[name]["deps"] if d in self.stages]
+            if not deps:
+                break
+            name = max(deps, key=lambda n: self.stages[n]["end"])
+            path.append(name)
+        return path[::-1]
+
+
+def in_thread(fn, *args) -> Awaitable:
+    """Run blocking `fn(*args)` on the turn pool."""
+    return asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+
+
+async def run_stage(trace: TurnTrace, name: str, work: Awaitable, deps: Sequence[str] = (), default=None,
+                    tolerate_errors: bool = False):
+    """
+    Await one stage under its deadline and record it in `trace`.
+
+    A stage that misses its deadline yields `default`; so does one that fails when
+    `tolerate_errors` is set (otherwise the error propagates to the turn).
+    """
+    start = time.perf_counter()
+    status, result = "ok", default
+    try:
+        result = await asyncio.wait_for(work, STAGE_DEADLINES.get(name))
+    except asyncio.TimeoutError:
+        status = "timeout"
+    except Exception:
+        if not tolerate_errors:
+            trace.record(name, start, time.perf_counter(), "error", deps)
+            raise
+        status = "error"
+    trace.record(name, start, time.perf_counter(), status, deps)
+    return result
+
+
+_warm_up_thread = None
+_warm_up_lock = threading.Lock()
+
+
+def _load_embedding_model():
+    from app.embeddings import EMBEDDING_MODEL, load_model
+    try:
+        load_model(EMBEDDING_MODEL)
+    except Exception:
+        pass  # the first turn tries again, and reports the error there
+
+
+def warm_up_in_background():
+    """
+    Start loading the embedding model on a background thread, once per process, so the
+    first question does not wait for it. A turn that arrives earlier waits for the load
+    in its own stage, outside the embed and retrieve deadlines.
+    """
+    global _warm_up_thread
+    with _warm_up_lock:
+        if _warm_up_thread is None:
+            _warm_up_thread = threading.Thread(target=_load_embedding_model, name="model-warm-up", daemon=True)
+            _warm_up_thread.start()
+
+
+def run_turn(coro):
+    """Run a turn's orchestration coroutine to completion from synchronous code."""
+    return asyncio.run(coro)
@@ -1,5 +1,10 @@
 import streamlit as st
-from app.document_processor import process_uploaded_documents
+import httpx
+from app.api_client import RAG_API_URL, get_stats
+from app.document_processor import delete_documents, process_uploaded_documents
+from app.engine_stats import collect_stats
+from app.state import session_histogram
+from app.vectorstore_utils import FAISS_COLLECTION, CollectionConflict, faiss_collection_path
 import os
 
 def pdf_uploader():
@@ -18,21 +23,146 @@ def render_sidebar():
     st.markdown("### Document Upload")
     uploaded_files = pdf_uploader()
 
+    if store_choice == "faiss":
+        collection = st.text_input("FAISS collection", value=FAISS_COLLECTION, key="faiss_collection_input")
+        try:
+            faiss_collection_path(collection)
+        except ValueError as e:
+            st.error(str(e))
+        else:
+            _attach_faiss_collection(collection)
+
     if store_choice == "mongo":
-        st.text_input("Mongo URI", value=os.getenv("MONGO_URI", ""), key="mongo_uri_input")
-        st.text_input("Mongo DB", value=os.getenv("MONGO_DB", ""), key="mongo_db_input")
+        if not RAG_API_URL:  # the service connects with its own MONGO_URI / MONGO_DB
+            st.text_input("Mongo URI", value=os.getenv("MONGO_URI", ""), key="mongo_uri_input")
+            st.text_input("Mongo DB", value=os.getenv("MONGO_DB", ""), key="mongo_db_input")
         st.text_input("Mongo Collection", value=os.getenv("MONGO_COLLECTION", ""), key="mongo_collection_input")
 
     if uploaded_files and st.button("Process Documents"):
         with st.spinner("Processing your documents..."):
             process_uploaded_documents(uploaded_files)
 
-    avg_faiss = _get_avg_time("faiss")
-    avg_mongo = _get_avg_time("mongo")
-    st.markdown("### Average Query Times")
-    st.write(f"FAISS: {avg_faiss:.3f} s")
-    st.write(f"MongoDB: {avg_mongo:.3f} s")
+    _render_documents()
+
+    stats = _engine_stats()
+    if stats is None:
+        return
+
+    answers = stats["answer_cache"]
+    st.markdown("### Answer Cache")
+    st.write(f"Hits: {answers['hits']} | Misses: {answers['misses']} ({answers['hit_rate']:.0%} hit rate)")
+    st.caption(f"{answers['entries']} cached answers")
+
+    cache = stats.get("embedding_cache")
+    if cache is not None:
+        st.markdown("### Embedding Cache")
+        st.write(f"Hits: {cache['hits']} | Misses: {cache['misses']} ({cache['hit_rate']:.0%} hit rate)")
+        st.caption(f"{cache['size_mb']:.1f} MB on disk")
+
+    search_cache = stats.get("search_cache")
+    if search_cache is not None:
+        st.markdown("### Search Cache")
+        st.write(f"Hits: {search_cache['hits']} | Misses: {search_cache['misses']} "
+                 f"({search_cache['hit_rate']:.0%} hit rate)")
+        st.caption(f"{search_cache['entries']} cached searches")
+
+    reranker = stats.get("reranker")
+    if reranker is not None:
+        st.markdown("### Re-ranking")
+        st.write(f"Re-ranked: {reranker['reranked']} | Skipped: {reranker['skipped']} "
+                 f"({reranker['cache_hit_rate']:.0%} score cache hit rate)")
+        if not reranker["ready"]:
+            st.caption("Cross-encoder loading; retrieval order is used meanwhile")
+        elif reranker["ms_per_pair"] is not None:
+            st.caption(f"{reranker['ms_per_pair']:.1f} ms per candidate, budget {reranker['budget']:.2f} s")
+
+def _engine_stats():
+    # Figures of whichever process runs the pipeline: this one, or the API service
+    if not RAG_API_URL:
+        return collect_stats()
+    try:
+        return get_stats()
+    except (httpx.HTTPError, RuntimeError) as e:
+        st.caption(f"RAG service unavailable: {e}")
+        return None
+
+def _attach_faiss_collection(name):
+    # Only the name is kept here: the collection (and its index) is opened by the first question
+    current = st.session_state.vectorstore
+    if not current or current.get("collection") != name:
+        st.session_state.vectorstore = {"type": "faiss", "collection": name}
+
+def _render_documents():
+    # Documents of the collection this session has open; uploads never remove any, this does
+    vectorstore = st.session_state.vectorstore
+    store = vectorstore.get("store") if vectorstore else None
+    sources = sorted(store.file_hashes()) if store is not None else []
+    if not sources:
+        return
+    st.markdown("### Documents")
+    with st.form("delete_documents", clear_on_submit=True):
+        doomed = st.multiselect(f"{len(sources)} indexed", sources, placeholder="Select documents to delete")
+        if st.form_submit_button("Delete selected") and doomed:
+            try:
+                delete_documents(store, doomed)
+            except CollectionConflict as e:
+                st.error(str(e))
+                return
+            st.rerun()
+
+def render_latency_panel():
+    """Query times, per-stage latency and the last turn's waterfall; rendered after the chat so they include it."""
+    st.markdown("### Query Times")
+    for name, label in (("faiss", "FAISS"), ("mongo", "MongoDB"), ("ttft", "First token"), ("generation", "Generation")):
+        _write_percentiles(label, session_histogram(name))
+
+    calls = session_histogram("summary_calls")
+    if calls.count:
+        # Serial summarization would have cost the sum of the calls; show what concurrency saved
+        per_turn = session_histogram("summary_total")
+        st.markdown("### Summarization")
+        st.write(f"Avg LLM call: {calls.mean:.3f} s over {calls.count} calls")
+        st.write(f"Avg per turn: {per_turn.mean:.3f} s (saved {max(calls.total - per_turn.total, 0):.1f} s total)")
+
+    stats = _engine_stats()
+    latencies = stats["stages"] if stats else {}
+    if latencies:
+        st.markdown("### Stage Latency")
+        st.dataframe(
+            [{"stage": name, "count": s["count"], "p50": round(s["p50"], 3), "p95": round(s["p95"], 3),
+              "p99": round(s["p99"], 3)} for name, s in latencies.items()],
+            hide_index=True, width="stretch",
+        )
+        st.caption("Seconds, across all sessions")
+
+    turn = st.session_state.get("last_turn")
+    if turn and turn.get("stages"):
+        st.markdown("### Last Turn")
+        _render_waterfall(turn)
+
+
+def _write_percentiles(label, histogram):
+    if histogram.count:
+        st.write(f"{label}: p50 {histogram.quantile(0.5):.3f} s · p95 {histogram.quantile(0.95):.3f} s · "
+                 f"p99 {histogram.quantile(0.99):.3f} s")
+
 
-def _get_avg_time(store):
-    times = st.session_state.timings.get(store, [])
-    return sum(times) / len(times) if times else 0
+def _render_waterfall(turn):
+    critical = set(turn.get("critical_path", []))
+    rows = [{"stage": name, "start": stage["start"], "end": stage["end"], "seconds": stage["end"] - stage["start"],
+             "status": stage["status"], "critical": name in critical}
+            for name, stage in turn["stages"].items()]
+    st.vega_lite_chart(rows, {
+        "mark": {"type": "bar", "cornerRadius": 2},
+        "encoding": {
+            "y": {"field": "stage", "type": "nominal", "sort": {"field": "start", "op": "min"}, "title": None},
+            "x": {"field": "start", "type": "quantitative", "title": "seconds into the turn"},
+            "x2": {"field": "end"},
+            "color": {"field": "status", "type": "nominal",
+                      "scale": {"domain": ["ok", "timeout", "error"], "range": ["#4c78a8", "#f58518", "#e45756"]}},
+            # Stages off the critical path are faded: they overlapped with something slower
+            "opacity": {"field": "critical", "type": "nominal", "scale": {"domain": [True, False], "range": [1, 0.4]},
+                        "legend": None},
+            "tooltip": [{"field": "stage"}, {"field": "seconds", "format": ".3f"}, {"field": "status"}],
+        },
+    }, width="stretch")
@@ -0,0 +1,68 @@
+import os
+import struct
+from typing import Iterable
+import numpy as np
+
+# How embeddings are stored: "float32", "float16" or "int8" (scalar quantization with a
+# per-vector scale). "pq" (product quantization) needs a trained codebook, so it only applies
+# to in-memory FAISS indexes; stored documents fall back to int8.
+VECTOR_ENCODING = os.getenv("VECTOR_ENCODING", "float16")
+# Also keep float32 vectors and re-score the top candidates with them
+VECTOR_RERANK = os.getenv("VECTOR_RERANK", "0") == "1"
+# Candidates re-scored per requested result when re-ranking
+RERANK_FACTOR = 4
+
+# Blob layout: 4-byte header (codec id + padding, so the payload stays aligned),
+# then for int8 a float32 scale, then the vector itself.
+_HEADER = 4
+_CODECS = {"float32": 1, "float16": 2, "int8": 3}
+_DTYPES = {1: np.float32, 2: np.float16}
+
+
+def storage_encoding(encoding: str = None) -> str:
+    encoding = encoding or VECTOR_ENCODING
+    if encoding == "pq":
+        return "int8"
+    if encoding not in _CODECS:
+        raise ValueError(f"Unknown vector encoding '{encoding}'. Choose one of: {', '.join(_CODECS)}, pq")
+    return encoding
+
+
+def encode_vector(vector, encoding: str = None) -> bytes:
+    """Pack one embedding into a compact, self-describing byte string."""
+    encoding = storage_encoding(encoding)
+    code = _CODECS[encoding]
+    header = struct.pack("<B3x", code)
+    vector = np.asarray(vector, dtype=np.float32)
+    if encoding == "int8":
+        scale = float(np.abs(vector).max()) / 127 or 1.0
+        codes = np.clip(np.rint(vector / scale), -127, 127).astype(np.int8)
+        return header + struct.pack("<f", scale) + codes.tobytes()
+    return header + vector.astype(_DTYPES[code]).tobytes()
+
+
+def decode_vector(value) -> np.ndarray:
+    """Inverse of `encode_vector`. Plain lists (documents written before encodings existed) are accepted too."""
+    if isinstance(value, (list, tuple)):
+        return np.asarray(value, dtype=np.float32)
+    code = value[0]
+    if code == _CODECS["int8"]:
+        scale = struct.unpack_from("<f", value, _HEADER)[0]
+        return np.frombuffer(value, dtype=np.int8, offset=_HEADER + 4).astype(np.float32) * scale
+    # float32 blobs come back as a read-only view of the stored bytes, without a copy
+    return np.frombuffer(value, dtype=_DTYPES[code], offset=_HEADER)
+
+
+def decode_vectors(values: Iterable) -> np.ndarray:
+    """Decode many stored embeddings into one float32 (n, d) matrix."""
+    vectors = [decode_vector(v) for v in values]
+    if not vectors:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.stack(vectors).astype(np.float32, copy=False)
+
+
+def normalize_rows(vectors) -> np.ndarray:
+    """Return a float32 (n, d) copy of `vectors` with unit L2 norm per row."""
+    arr = np.array(vectors, dtype=np.float32, ndmin=2)
+    arr /= np.linalg.norm(arr, axis=1, keepdims=True) + 1e-12
+    return arr
@@ -1,38 +1,120 @@
-from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from typing import List
-from app.mongo_vectorstore import MongoVectorStore
-from dotenv import load_dotenv
+from typing import TYPE_CHECKING, List
 import os
+import re
+import threading
 
-load_dotenv()
-
-EMBEDDING_MODEL = "sentence-transformers/all-mpnet-base-v2"
+# The store modules pull in FAISS, pymongo, LangChain and the embedding stack; they are
+# imported when a store is first opened, so reading the settings below stays cheap for the UI
+if TYPE_CHECKING:
+    from app.faiss_vectorstore import FaissVectorStore
+    from app.mongo_vectorstore import MongoVectorStore
 
 # Read environment variables for MongoDB
 MONGO_URI = os.getenv("MONGO_URI")
 MONGO_DB = os.getenv("MONGO_DB")
 MONGO_COLLECTION = os.getenv("MONGO_COLLECTION")
 
+# Named FAISS collections live under this directory
+FAISS_INDEX_DIR = os.getenv("FAISS_INDEX_DIR", ".faiss_collections")
+FAISS_COLLECTION = os.getenv("FAISS_COLLECTION", "default")
+# Collection names become directory names, so they are restricted to a single safe path component
+COLLECTION_NAME = re.compile(r"[A-Za-z0-9_-]+")
+
+# "hybrid" fuses vector and BM25 rankings (exact terms such as part numbers and
+# error codes); "dense" is vector similarity only
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+
+# One loaded store per collection, shared by every session in the process
+_faiss_collections = {}
+_faiss_lock = threading.Lock()
+_mongo_collections = {}
+_mongo_lock = threading.Lock()
+
+
+class CollectionConflict(RuntimeError):
+    """Another process saved a FAISS collection after this process loaded it (see FaissVectorStore.save)."""
+
+
 # FAISS helpers (storing)
-def create_faiss_index(texts: List[str]):
-    embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
-    return FAISS.from_texts(texts, embeddings)
+def create_faiss_store():
+    """In-memory store that is never written to disk."""
+    from app.embeddings import EMBEDDING_MODEL
+    from app.faiss_vectorstore import FaissVectorStore
+    return FaissVectorStore(embedding_model_name=EMBEDDING_MODEL)
+
+def faiss_collection_path(name: str) -> str:
+    """Directory of the named FAISS collection; raises ValueError for names that could point outside FAISS_INDEX_DIR."""
+    if not isinstance(name, str) or not COLLECTION_NAME.fullmatch(name):
+        raise ValueError(f"Invalid collection name {name!r}: use letters, digits, '_' and '-' only")
+    root = os.path.realpath(FAISS_INDEX_DIR)
+    path = os.path.join(root, name)
+    if os.path.dirname(os.path.realpath(path)) != root:
+        raise ValueError(f"Collection {name!r} resolves outside {FAISS_INDEX_DIR}")
+    return path
+
+def open_faiss_collection(name: str = None, create: bool = True):
+    """
+    Return the shared store for a named on-disk FAISS collection, loading it on first use; it
+    reloads itself when another process saves the collection (see FaissVectorStore.refresh). Returns None if the collection does not exist and `create` is False; raises ValueError
+    for an invalid name (see `faiss_collection_path`).
+    """
+    name = name or FAISS_COLLECTION
+    path = faiss_collection_path(name)
+    store = _faiss_collections.get(name)
+    if store is not None:
+        store.refresh()
+    else:
+        from app.embeddings import EMBEDDING_MODEL
+        from app.faiss_vectorstore import FaissVectorStore
+        with _faiss_lock:
+            store = _faiss_collections.get(name)
+            if store is None:
+                store = FaissVectorStore.load(path)
+                if store is None:
+                    if not create:
+                        return None
+                    store = FaissVectorStore(embedding_model_name=EMBEDDING_MODEL, path=path)
+                _faiss_collections[name] = store
+    return store
+
+def create_faiss_index(texts: List[str], metadatas: List[dict] = None):
+    store = create_faiss_store()
+    store.upsert_texts(texts, metadatas)
+    return store
 
 # retrieving
-def retrieve_relevant_docs_faiss(vectorstore, query: str, k: int = 3):
-    return vectorstore.similarity_search(query, k=k)
+def retrieve_relevant_docs_faiss(vectorstore: "FaissVectorStore", query: str, k: int = 3, query_embedding=None):
+    # returns list of dicts { text, metadata, score, id }
+    return vectorstore.retrieve(query, k=k, hybrid=RETRIEVAL_MODE == "hybrid", query_embedding=query_embedding)
 
 # MongoDB-backed vector store helpers
 def create_mongo_store(mongo_uri: str = None, db_name: str = None, collection_name: str = None):
     mongo_uri = mongo_uri or MONGO_URI
     db_name = db_name or MONGO_DB
     collection_name = collection_name or MONGO_COLLECTION
+    from app.embeddings import EMBEDDING_MODEL
+    from app.mongo_vectorstore import MongoVectorStore
     return MongoVectorStore(mongo_uri, db_name, collection_name, embedding_model_name=EMBEDDING_MODEL)
 
-def upsert_texts_to_mongo(mongo_store: MongoVectorStore, texts: List[str], metadatas: List[dict] = None):
+def open_mongo_collection(mongo_uri: str = None, db_name: str = None, collection_name: str = None):
+    """Return the shared store for a MongoDB collection, so its client and ANN index are built once per process."""
+    key = (mongo_uri or MONGO_URI, db_name or MONGO_DB, collection_name or MONGO_COLLECTION)
+    store = _mongo_collections.get(key)
+    if store is None:
+        with _mongo_lock:
+            store = _mongo_collections.get(key)
+            if store is None:
+                store = create_mongo_store(*key)
+                _mongo_collections[key] = store
+    return store
+
+def upsert_texts_to_mongo(mongo_store: "MongoVectorStore", texts: List[str], metadatas: List[dict] = None):
     return mongo_store.upsert_texts(texts, metadatas)
 
-def retrieve_relevant_docs_mongo(mongo_store: MongoVectorStore, query: str, k: int = 3):
-    # returns list of dicts { text, metadata, score }
-    return mongo_store.retrieve(query, k=k)
+def retrieve_relevant_docs_mongo(mongo_store: "MongoVectorStore", query: str, k: int = 3, query_embedding=None):
+    # returns list of dicts { text, metadata, score, id }
+    return mongo_store.retrieve(query, k=k, hybrid=RETRIEVAL_MODE == "hybrid", query_embedding=query_embedding)
+
+def retrieve_relevant_docs_many(store, queries: List[str], k: int = 3):
+    # Either store type; one list of { text, metadata, score, id } dicts per query, in query order
+    return store.retrieve_many(queries, k=k, hybrid=RETRIEVAL_MODE == "hybrid")
@@ -0,0 +1,72 @@
+"""
+Compare two benchmark result files and report timings that got slower.
+
+    python -m benchmarks.compare benchmarks/results/old.json benchmarks/results/new.json --threshold 0.1
+
+Runs are matched by corpus size. Every timing (seconds, mean, p50, p95, per-query
+figures, cold import time per entry point) present in both files is compared;
+recall changes are listed too. Exits
+with status 1 when any timing regressed by more than the threshold, for use in CI.
+"""
+import argparse
+import json
+import sys
+
+TIMING_KEYS = {"seconds", "mean", "p50", "p95", "batched_per_query", "load_seconds"}
+
+
+def _flatten(value, prefix=""):
+    if isinstance(value, dict):
+        for key, child in value.items():
+            yield from _flatten(child, f"{prefix}.{key}" if prefix else key)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, float(value)
+
+
+def _metrics(report):
+    metrics = dict(_flatten(report.get("web_fallback", {}), "web_fallback"))
+    metrics.update(_flatten(report.get("import_profile", {}), "import"))
+    for run in report["runs"]:
+        metrics.update(_flatten({k: v for k, v in run.items() if k in ("stages", "stores")}, f"{run['pages']}p"))
+    return metrics
+
+
+def compare(old, new, threshold: float = 0.1):
+    """Returns (regressions, rows) where rows are (metric, old, new, relative change)."""
+    old_metrics, new_metrics = _metrics(old), _metrics(new)
+    rows, regressions = [], []
+    for name in sorted(old_metrics.keys() & new_metrics.keys()):
+        leaf = name.rsplit(".", 1)[-1]
+        if leaf not in TIMING_KEYS and leaf != "recall":
+            continue
+        before, after = old_metrics[name], new_metrics[name]
+        change = (after - before) / before if before else 0.0
+        rows.append((name, before, after, change))
+        if leaf in TIMING_KEYS and change > threshold:
+            regressions.append(name)
+    return regressions, rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown reported as a regression")
+    args = parser.parse_args(argv)
+    with open(args.baseline) as f:
+        old = json.load(f)
+    with open(args.candidate) as f:
+        new = json.load(f)
+
+    regressions, rows = compare(old, new, args.threshold)
+    width = max((len(name) for name, *_ in rows), default=10)
+    for name, before, after, change in rows:
+        flag = "  REGRESSION" if name in regressions else ""
+        print(f"{name:<{width}}  {before:12.6f}  {after:12.6f}  {change:+8.1%}{flag}")
+    print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%} "
+          f"({old['meta'].get('commit')} -> {new['meta'].get('commit')})")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+import io
+import json
+import os
+import random
+from typing import List, NamedTuple
+from fpdf import FPDF
+
+# Generated corpora are kept here and reused by later runs with the same size and seed
+CORPUS_DIR = os.getenv("BENCH_CORPUS_DIR", ".bench_corpora")
+PAGES_PER_FILE = 500
+PARAGRAPHS_PER_PAGE = 4
+SENTENCES_PER_PARAGRAPH = 4
+WORDS_PER_SENTENCE = 12
+VOCABULARY_SIZE = 3000
+
+_SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "ta", "vo", "se", "di", "pa", "zu", "fe", "gri", "tor", "ban", "quel"]
+
+
+class Fact(NamedTuple):
+    """A question whose answer is stated on exactly one page of the corpus."""
+    question: str
+    answer: str
+    source: str
+    page: int  # 1-based
+
+
+class Corpus(NamedTuple):
+    paths: List[str]
+    pages: int
+    bytes: int
+    facts: List[Fact]
+
+
+class CorpusFile(io.BytesIO):
+    """A corpus PDF in memory, shaped like a Streamlit upload (`name` and `getvalue()`)."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            super().__init__(f.read())
+        self.name = os.path.basename(path)
+
+
+def _vocabulary(rng: random.Random) -> List[str]:
+    words = set()
+    while len(words) < VOCABULARY_SIZE:
+        words.add("".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def _sentence(rng: random.Random, vocabulary: List[str]) -> str:
+    words = rng.choices(vocabulary, k=WORDS_PER_SENTENCE)
+    return " ".join(words).capitalize() + "."
+
+
+def _write_file(path: str, name: str, first_page: int, n_pages: int, rng: random.Random,
+                vocabulary: List[str]) -> List[Fact]:
+    pdf = FPDF()
+    pdf.set_auto_page_break(False)
+    facts = []
+    for page in range(1, n_pages + 1):
+        pdf.add_page()
+        pdf.set_font("Helvetica", "B", 14)
+        title = " ".join(w.capitalize() for w in rng.choices(vocabulary, k=3))
+        pdf.cell(0, 10, f"{first_page + page - 1}. {title}", ln=1)
+        pdf.set_font("Helvetica", "", 10)
+        subject = " ".join(rng.choices(vocabulary, k=2))
+        answer = str(rng.randint(100000, 999999))
+        fact_paragraph = rng.randrange(PARAGRAPHS_PER_PAGE)
+        for paragraph in range(PARAGRAPHS_PER_PAGE):
+            sentences = [_sentence(rng, vocabulary) for _ in range(SENTENCES_PER_PARAGRAPH)]
+            if paragraph == fact_paragraph:
+                sentences.insert(rng.randrange(len(sentences) + 1), f"The {subject} reference number is {answer}.")
+            pdf.multi_cell(0, 5, " ".join(sentences))
+            pdf.ln(3)
+        facts.append(Fact(f"What is the {subject} reference number?", answer, name, page))
+    pdf.output(path, "F")
+    return facts
+
+
+def generate_corpus(pages: int, seed: int = 0, pages_per_file: int = PAGES_PER_FILE,
+                    root: str = CORPUS_DIR) -> Corpus:
+    """
+    Create (or reuse) a deterministic corpus of `pages` pages split into PDFs of
+    `pages_per_file` pages. Every page has a numbered heading, a few paragraphs of
+    pseudo-words and one fact sentence, which the retrieval benchmarks query for.
+    """
+    directory = os.path.join(root, f"pages{pages}-seed{seed}-per{pages_per_file}")
+    manifest_path = os.path.join(directory, "manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        return Corpus(manifest["paths"], manifest["pages"], manifest["bytes"],
+                      [Fact(*fact) for fact in manifest["facts"]])
+
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    vocabulary = _vocabulary(rng)
+    paths, facts = [], []
+    for first_page in range(1, pages + 1, pages_per_file):
+        name = f"corpus-{len(paths):05d}.pdf"
+        path = os.path.join(directory, name)
+        facts.extend(_write_file(path, name, first_page, min(pages_per_file, pages - first_page + 1), rng, vocabulary))
+        paths.append(path)
+    corpus = Corpus(paths, pages, sum(os.path.getsize(p) for p in paths), facts)
+    # Written last, so an interrupted generation is redone rather than reused
+    with open(manifest_path, "w") as f:
+        json.dump(corpus._asdict(), f)
+    return corpus
+
+
+def open_files(corpus: Corpus) -> List[CorpusFile]:
+    return [CorpusFile(path) for path in corpus.paths]
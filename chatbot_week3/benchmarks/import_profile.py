@@ -0,0 +1,79 @@
+"""
+Cold import cost of the app's entry points, each measured in a fresh interpreter
+with `python -X importtime`, so nothing is already cached in `sys.modules`.
+"""
+import os
+import subprocess
+import sys
+from collections import Counter
+from typing import Dict, List
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules imported by each entry point; "ui" is what main.py imports before its first paint
+ENTRY_POINTS = {
+    "ui": ["app.state", "app.ui", "app.chat_interface"],
+    "engine": ["app.chat_manager"],
+    "ingestion": ["app.ingestion", "app.vectorstore_utils"],
+    "api": ["app.api"],
+}
+# Imported first and left out of the figures: the host framework, not the app's choice
+PRELOADED = {"ui": ["streamlit"]}
+# Dependencies that should only load when a model or store is first used
+HEAVY = ["torch", "sentence_transformers", "transformers", "langchain_core", "langchain_community", "faiss",
+         "pymongo", "pypdf", "euriai", "tiktoken"]
+MARKER = "-- profile starts --"
+
+_SCRIPT = """
+import sys, time
+{preload}
+sys.stderr.write({marker!r} + "\\n")
+sys.stderr.flush()
+start = time.perf_counter()
+{imports}
+print(time.perf_counter() - start)
+print(",".join(name for name in {heavy!r} if name in sys.modules))
+"""
+
+
+def _run(modules: List[str], preload: List[str]) -> Dict:
+    script = _SCRIPT.format(preload="\n".join(f"import {m}" for m in preload), marker=MARKER,
+                            imports="\n".join(f"import {m}" for m in modules), heavy=HEAVY)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", script], cwd=APP_DIR,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        return {"error": (result.stderr.strip().splitlines() or ["failed"])[-1]}
+    seconds, heavy = result.stdout.splitlines()[-2:]
+    # "import time: self [us] | cumulative | imported package" lines, after the marker
+    lines = result.stderr.split(MARKER, 1)[-1].splitlines()
+    packages = Counter()
+    n_modules = 0
+    for line in lines:
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue  # the header line
+        n_modules += 1
+        packages[name.strip().split(".")[0]] += int(self_us) / 1e6
+    return {
+        "seconds": float(seconds),
+        "modules": n_modules,
+        "heavy_loaded": [name for name in heavy.split(",") if name],
+        "slowest_packages": {name: round(s, 4) for name, s in packages.most_common(8)},
+    }
+
+
+def import_profile(repeat: int = 3) -> Dict[str, Dict]:
+    """Per entry point, the fastest of `repeat` cold imports (seconds) with what it loaded."""
+    profile = {}
+    for entry, modules in ENTRY_POINTS.items():
+        runs = [_run(modules, PRELOADED.get(entry, [])) for _ in range(repeat)]
+        ok = [run for run in runs if "error" not in run]
+        profile[entry] = min(ok, key=lambda run: run["seconds"]) if ok else runs[0]
+    return profile
+
+
+if __name__ == "__main__":
+    import json
+    print(json.dumps(import_profile(), indent=2))
@@ -0,0 +1,296 @@
+"""
+Benchmark ingestion and querying on synthetic PDF corpora.
+
+    python -m benchmarks.run --pages 10 1000 100000 --stores faiss mongo --k 1 3 10
+
+Run from the chatbot_week3 directory. Each corpus size is timed stage by stage:
+extraction, chunking, embedding, then per store the index build, retrieval at every
+k (dense and hybrid, one query at a time and batched) and end-to-end `get_response`
+(cold, then answered from the semantic cache), and the re-ingestion of one file
+whose chunks all moved one page down. The LLM and Tavily are replaced by
+local deterministic stubs and Mongo by mongomock (benchmarks/requirements.txt)
+unless --mongo-uri is given; --embedder hash skips loading the embedding model.
+The cold import time of each entry point (UI, engine, ingestion, API) is profiled
+in fresh interpreters. Results are written as JSON; compare two runs with
+`python -m benchmarks.compare`.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+import numpy as np
+from benchmarks.corpus import CORPUS_DIR, PAGES_PER_FILE, CorpusFile, generate_corpus, open_files
+from benchmarks.import_profile import import_profile
+from benchmarks.stubs import TavilyStub, install_chat_stub, install_hash_embeddings, install_mongomock
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def _stats(samples):
+    """Latency summary in seconds."""
+    values = np.asarray(samples, dtype=np.float64)
+    if not len(values):
+        return {"n": 0}
+    return {
+        "n": len(values),
+        "mean": float(values.mean()),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "max": float(values.max()),
+        "total": float(values.sum()),
+    }
+
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _ingest_stages(files, batch_size, workers):
+    """Extraction, chunking and embedding, each run to completion on its own so they can be timed apart."""
+    from app.chunking import chunk_file, chunk_id
+    from app.embeddings import EMBEDDING_MODEL, get_embeddings
+    from app.pdf_utils import extract_pages_parallel
+
+    file_pages, extraction = _timed(extract_pages_parallel, files, max_workers=workers)
+    n_pages = sum(len(pages) for _, pages in file_pages)
+
+    start = time.perf_counter()
+    texts, metadatas, ids = [], [], []
+    for name, pages in file_pages:
+        chunked = chunk_file(name, pages)
+        texts.extend(chunked.texts)
+        metadatas.extend(chunked.metadatas)
+        ids.extend(chunk_id(name, text) for text in chunked.texts)
+    chunking = time.perf_counter() - start
+
+    # Loading the model is timed on its own, so the embedding rate is comparable across sizes
+    embedder = get_embeddings(EMBEDDING_MODEL)
+    _, model_load = _timed(embedder.embed_query, "warm up")
+    start = time.perf_counter()
+    embeddings = None
+    for i in range(0, len(texts), batch_size):
+        batch = np.asarray(embedder.embed_documents(texts[i:i + batch_size]), dtype=np.float32)
+        if embeddings is None:
+            embeddings = np.empty((len(texts), batch.shape[1]), dtype=np.float32)
+        embeddings[i:i + batch_size] = batch
+    embedding = time.perf_counter() - start
+
+    stages = {
+        "extraction": {"seconds": extraction, "pages": n_pages, "pages_per_second": n_pages / extraction},
+        "chunking": {"seconds": chunking, "chunks": len(texts), "chunks_per_second": len(texts) / chunking},
+        "model_load": {"seconds": model_load},
+        "embedding": {"seconds": embedding, "chunks_per_second": len(texts) / embedding},
+    }
+    return stages, texts, metadatas, ids, embeddings
+
+
+def _open_store(kind, args, work_dir, pages):
+    if kind == "faiss":
+        from app.faiss_vectorstore import FaissVectorStore
+        return FaissVectorStore(path=os.path.join(work_dir, f"faiss-{pages}"))
+    from app.mongo_vectorstore import MongoVectorStore
+    store = MongoVectorStore(args.mongo_uri or "mongodb://localhost", args.mongo_db, f"bench_{pages}")
+    store.clear_collection()
+    return store
+
+
+def _build_index(store, texts, metadatas, ids, embeddings, batch_size):
+    start = time.perf_counter()
+    for i in range(0, len(texts), batch_size):
+        store.add_embeddings(texts[i:i + batch_size], embeddings[i:i + batch_size].tolist(),
+                             metadatas[i:i + batch_size], ids[i:i + batch_size])
+    store.flush_index()
+    if hasattr(store, "save"):
+        store.save()
+    return {"seconds": time.perf_counter() - start, "chunks": len(store)}
+
+
+def _covers(metadata, fact):
+    page = metadata.get("page", 0)
+    return metadata.get("source") == fact.source and page <= fact.page <= metadata.get("page_end", page)
+
+
+def _retrieval(store, facts, ks):
+    """Latency and recall (the fact's page among the results) for every k, dense and hybrid."""
+    questions = [fact.question for fact in facts]
+    results = {}
+    for mode in ("dense", "hybrid"):
+        hybrid = mode == "hybrid"
+        store.retrieve(questions[0], k=max(ks), hybrid=hybrid)  # warm up lazily built indexes
+        for k in ks:
+            latencies, hits = [], 0
+            for fact in facts:
+                docs, seconds = _timed(store.retrieve, fact.question, k=k, hybrid=hybrid)
+                latencies.append(seconds)
+                hits += any(_covers(d["metadata"], fact) for d in docs)
+            _, batched = _timed(store.retrieve_many, questions, k=k, hybrid=hybrid)
+            results[f"{mode}@{k}"] = {
+                "latency": _stats(latencies),
+                "batched_per_query": batched / len(questions),
+                "recall": hits / len(facts),
+            }
+    return results
+
+
+def _end_to_end(chat_model, vectorstore, questions):
+    """`get_response` per question with the cache cleared, then the same questions again from the cache."""
+    from app.chat_manager import get_response
+    from app.semantic_cache import answer_cache
+
+    answer_cache.clear()
+    runs = {}
+    for name in ("cold", "cached"):
+        latencies = []
+        for question in questions:
+            _, seconds = _timed(get_response, chat_model, [{"role": "user", "content": question}],
+                                vectorstore, question)
+            latencies.append(seconds)
+        runs[name] = _stats(latencies)
+    return runs
+
+
+def _reingest_changed(store, path):
+    """
+    Ingest one corpus file, then a copy of it with a blank first page: every chunk is unchanged
+    but sits one page later, so none is embedded again and all of their metadata is rewritten.
+    """
+    from pypdf import PdfReader, PdfWriter
+    from app.ingestion import ingest_files
+
+    ingest_files([CorpusFile(path)], store, remove_missing=False)  # records the file; its chunks are stored
+    reader = PdfReader(path)
+    writer = PdfWriter()
+    first = reader.pages[0].mediabox
+    writer.add_blank_page(width=first.width, height=first.height)
+    for page in reader.pages:
+        writer.add_page(page)
+    changed = io.BytesIO()
+    writer.write(changed)
+    changed.name = os.path.basename(path)
+    stats, seconds = _timed(ingest_files, [changed], store, remove_missing=False)
+    return {"seconds": seconds, **stats}
+
+
+def bench_corpus(pages, args, chat_model, work_dir):
+    corpus = generate_corpus(pages, seed=args.seed, pages_per_file=args.pages_per_file, root=args.corpus_dir)
+    facts = random.Random(args.seed).sample(corpus.facts, min(args.queries, len(corpus.facts)))
+    stages, texts, metadatas, ids, embeddings = _ingest_stages(open_files(corpus), args.batch_size, args.workers)
+    result = {
+        "pages": pages,
+        "corpus": {"files": len(corpus.paths), "bytes": corpus.bytes},
+        "stages": stages,
+        "stores": {},
+    }
+    for kind in args.stores:
+        if kind == "mongo" and not args.mongo_uri and not install_mongomock():
+            result["stores"][kind] = {"skipped": "mongomock is not installed and no --mongo-uri was given"}
+            continue
+        store = _open_store(kind, args, work_dir, pages)
+        index_build = _build_index(store, texts, metadatas, ids, embeddings, args.batch_size)
+        store_result = {"index_build": index_build}
+        if kind == "faiss":
+            from app.faiss_vectorstore import FaissVectorStore
+            _, store_result["load_seconds"] = _timed(FaissVectorStore.load, store.path)
+        store_result["retrieval"] = _retrieval(store, facts, args.k)
+        store_result["get_response"] = _end_to_end(chat_model, {"type": kind, "store": store},
+                                                   [fact.question for fact in facts[:args.e2e_queries]])
+        store_result["reingest_changed"] = _reingest_changed(store, corpus.paths[0])
+        result["stores"][kind] = store_result
+        if kind == "mongo":
+            store.clear_collection()
+        print(f"{pages} pages, {kind}: built in {index_build['seconds']:.2f}s", flush=True)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 1000], help="corpus sizes to benchmark")
+    parser.add_argument("--stores", nargs="+", default=["faiss", "mongo"], choices=["faiss", "mongo"])
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 10], help="retrieval depths")
+    parser.add_argument("--queries", type=int, default=50, help="retrieval queries per corpus")
+    parser.add_argument("--e2e-queries", type=int, default=10, help="get_response calls per store")
+    parser.add_argument("--embedder", choices=["model", "hash"], default="model",
+                        help="the real embedding model, or deterministic hash embeddings (no model download)")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds added to every stub LLM call")
+    parser.add_argument("--search-latency", type=float, default=0.0, help="seconds added to every stub search")
+    parser.add_argument("--mongo-uri", help="benchmark a real MongoDB instead of mongomock")
+    parser.add_argument("--mongo-db", default="rag_benchmark")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=None, help="PDF extraction processes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--pages-per-file", type=int, default=PAGES_PER_FILE)
+    parser.add_argument("--corpus-dir", default=CORPUS_DIR)
+    parser.add_argument("--import-repeat", type=int, default=3,
+                        help="cold imports per entry point, fastest kept (0 skips the import profile)")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/<timestamp>.json)")
+    args = parser.parse_args(argv)
+
+    started = datetime.now(timezone.utc)
+    imports = import_profile(args.import_repeat) if args.import_repeat else {}
+    work_dir = tempfile.mkdtemp(prefix="rag-bench-")
+    with TavilyStub(args.search_latency) as tavily:
+        # Read by the app at import time: no persistent caches, local indexes and the stub search API
+        os.environ.update(EMBEDDING_CACHE_PATH="", SEARCH_CACHE_PATH="", TAVILY_URL=tavily.url,
+                          TAVILY_API_KEY="benchmark", ANN_INDEX_DIR=os.path.join(work_dir, "ann"))
+        import streamlit.logger
+        from app.chunking import CHUNKING
+        from app.embeddings import EMBEDDING_MODEL
+        from app.vector_codec import VECTOR_ENCODING
+        from app.vectorstore_utils import RETRIEVAL_MODE
+
+        # get_response records session timings, which warns on every call outside `streamlit run`
+        streamlit.logger.set_log_level("error")
+        if args.embedder == "hash":
+            install_hash_embeddings(EMBEDDING_MODEL)
+        chat_model = install_chat_stub(args.llm_latency)
+        try:
+            runs = [bench_corpus(pages, args, chat_model, work_dir) for pages in args.pages]
+            from app.chat_manager import get_response
+            web_fallback = [_timed(get_response, chat_model, [{"role": "user", "content": f"web question {i}"}],
+                                   None, f"web question {i}")[1] for i in range(args.e2e_queries)]
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "started": started.isoformat(),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+            "embedding_model": EMBEDDING_MODEL if args.embedder == "model" else "hash",
+            "chunking": CHUNKING,
+            "vector_encoding": VECTOR_ENCODING,
+            "retrieval_mode": RETRIEVAL_MODE,
+        },
+        "import_profile": imports,
+        "runs": runs,
+        "web_fallback": _stats(web_fallback),
+    }
+    output = args.output or os.path.join(RESULTS_DIR, started.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
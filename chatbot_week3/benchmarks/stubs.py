@@ -0,0 +1,153 @@
+import hashlib
+import json
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+HASH_EMBEDDING_DIM = 384
+
+
+class _Message:
+    def __init__(self, content: str):
+        self.content = content
+
+
+class StubChatModel:
+    """
+    Deterministic stand-in for the euriai chat model: the answer is derived from a
+    hash of the prompt, after an optional fixed `latency` per call (spread over the
+    tokens when streaming).
+    """
+
+    def __init__(self, latency: float = 0.0, tokens: int = 20):
+        self.latency = latency
+        self.tokens = tokens
+
+    def _answer(self, prompt: str) -> List[str]:
+        digest = hashlib.sha256(str(prompt).encode()).hexdigest()
+        return [f"{digest[i % 60:i % 60 + 4]} " for i in range(self.tokens)]
+
+    def invoke(self, prompt):
+        time.sleep(self.latency)
+        return _Message("".join(self._answer(prompt)))
+
+    def stream(self, prompt):
+        for token in self._answer(prompt):
+            time.sleep(self.latency / self.tokens)
+            yield _Message(token)
+
+
+def install_chat_stub(latency: float = 0.0):
+    """Make every chat model the app creates (answers and summaries) a StubChatModel."""
+    import app.chat_utils as chat_utils
+    chat_utils.create_chat_model = lambda **kwargs: StubChatModel(latency)
+    chat_utils._shared_models.clear()
+    return chat_utils.get_chat_model()
+
+
+class HashEmbeddings(Embeddings):
+    """
+    Deterministic bag-of-words embeddings: every token maps to a fixed random unit
+    vector and a text is the normalized sum of its tokens. Texts sharing words are
+    similar, which keeps retrieval meaningful without loading a model.
+    """
+
+    def __init__(self, dim: int = HASH_EMBEDDING_DIM):
+        self.dim = dim
+        self._tokens: Dict[str, np.ndarray] = {}
+
+    def _token(self, token: str) -> np.ndarray:
+        vector = self._tokens.get(token)
+        if vector is None:
+            vector = np.random.default_rng(zlib.crc32(token.encode())).standard_normal(self.dim).astype(np.float32)
+            self._tokens[token] = vector
+        return vector
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in text.lower().split():
+            vector += self._token(token.strip(".,;:?!()"))
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+def install_hash_embeddings(model_name: str, dim: int = HASH_EMBEDDING_DIM):
+    """Register HashEmbeddings as the loaded model for `model_name` in the shared registry."""
+    import app.embeddings as embeddings
+    embeddings._models[model_name] = HashEmbeddings(dim)
+
+
+def install_mongomock():
+    """Point MongoVectorStore at an in-process mongomock server. Returns False if mongomock is not installed."""
+    try:
+        import mongomock
+    except ImportError:
+        return False
+    import app.mongo_vectorstore as mongo_vectorstore
+    mongo_vectorstore.MongoClient = mongomock.MongoClient
+    _accept_update_sort(mongomock.collection.BulkOperationBuilder)
+    return True
+
+
+def _accept_update_sort(builder):
+    # pymongo 4.11+ passes UpdateOne's `sort` option to bulk builders, which mongomock 4.x does not
+    # know about; the app never sets it, so it is dropped rather than failing every bulk_write
+    add_update = builder.add_update
+    if getattr(add_update, "accepts_sort", False):
+        return
+
+    def add_update_without_sort(self, *args, sort=None, **kwargs):
+        return add_update(self, *args, **kwargs)
+
+    add_update_without_sort.accepts_sort = True
+    builder.add_update = add_update_without_sort
+
+
+class _TavilyHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+
+    def do_POST(self):
+        raw = self.rfile.read(int(self.headers["Content-Length"]))
+        if not raw:
+            return  # a speculative search cancelled by the client before its body was sent
+        body = json.loads(raw)
+        time.sleep(self.latency)
+        digest = hashlib.sha256(body["query"].encode()).hexdigest()
+        results = [{"title": f"Result {i} for {body['query']}", "content": f"Snippet {digest[i:i + 16]}",
+                    "url": f"https://example.com/{digest[:12]}/{i}"} for i in range(body.get("max_results", 5))]
+        payload = json.dumps({"results": results}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class TavilyStub:
+    """Local HTTP server answering Tavily search requests with deterministic results."""
+
+    def __init__(self, latency: float = 0.0):
+        handler = type("Handler", (_TavilyHandler,), {"latency": latency})
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.url = f"http://127.0.0.1:{self._server.server_port}/search"
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, name="tavily-stub", daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
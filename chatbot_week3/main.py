@@ -1,10 +1,8 @@
 import streamlit as st
-from dotenv import load_dotenv
 from app.state import init_session_state
-from app.ui import render_sidebar
+from app.ui import render_latency_panel, render_sidebar
 from app.chat_interface import render_chat
 
-load_dotenv()
 st.set_page_config(page_title="PDF Pro", layout="wide", initial_sidebar_state="expanded")
 
 init_session_state()
@@ -20,10 +18,15 @@ st.markdown("""
 # Sidebar
 with st.sidebar:
     render_sidebar()
+    latency_panel = st.empty()
 
 # Chat interface
 render_chat()
 
+# Filled in after the chat, so the figures include the turn that just ran
+with latency_panel.container():
+    render_latency_panel()
+
 # Footer
 st.markdown("---")
 st.markdown(